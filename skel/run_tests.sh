@@ -4,6 +4,9 @@ SRC=tema
 TESTS=tests
 OUT=out
 PYTHON_CMD=python3
+# The options are passed to test.py, e.g. "./run_tests.sh --service" runs the suite through
+# the marketplace service
+TEST_OPTIONS=("$@")
 
 for i in {1..8}
 do
@@ -24,7 +27,7 @@ do
     rm -f "${TESTS}/$prefix".out
     echo "Starting test $i"
 
-    timeout ${TIMEOUT_VALS[i]} ${PYTHON_CMD} test.py "${TESTS}/$prefix.in" > "${TESTS}/$prefix.out"
+    timeout ${TIMEOUT_VALS[i]} ${PYTHON_CMD} test.py "${TESTS}/$prefix.in" "${TEST_OPTIONS[@]}" > "${TESTS}/$prefix.out"
     if [ ! $? -eq 0 ]
     then
         echo "TIMEOUT. Test $i exceeded maximum allowed time of ${TIMEOUT_VALS[i]}"
@@ -0,0 +1,118 @@
+"""
+This module represents the adaptive producer queues of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from threading import Lock
+
+# Number of orders between two adjustments used by "--adaptive-queues"
+ADAPT_INTERVAL = 16
+# Largest queue of a producer, in multiples of queue_size_per_producer
+MAX_QUEUE_FACTOR = 2
+
+
+class AdaptiveQueuesMixin:
+    """
+    Mixin of the Marketplace that sizes the queue of each producer by its sell-through rate.
+    The Marketplace provides queue_size_per_producer and products_per_producer.
+    """
+
+    def __init__(self, adapt_interval=None, inventory_budget=None):
+        """
+        Constructor
+
+        :type adapt_interval: Int
+        :param adapt_interval: the number of orders placed between two adjustments of the
+        queues, None keeps queue_size_per_producer for every producer
+
+        :type inventory_budget: Int
+        :param inventory_budget: the total number of products the producers' queues share in
+        adaptive mode, by default queue_size_per_producer for each registered producer
+        """
+        self.adaptive = adapt_interval is not None
+        self.adapt_interval = adapt_interval
+        self.inventory_budget = inventory_budget
+        self.num_orders = 0
+        self.producer_limits = []   # [queue size], one per producer
+        self.units_reserved = []    # [products taken from the producer since the last adjustment]
+        self.sell_through = []      # [smoothed products taken per adjustment interval]
+        self.lock_limits = Lock()
+
+    def add_queue(self, producer_id):
+        """
+        Creates the queue of a new producer, or resets it if the id is reused. The queues of the
+        other producers keep their sizes until the next adjustment.
+        """
+        with self.lock_limits:
+            # The producers registered at the same time may get here in any order
+            while len(self.producer_limits) <= producer_id:
+                self.producer_limits.append(self.queue_size_per_producer)
+                self.units_reserved.append(0)
+                self.sell_through.append(0.0)
+            self.producer_limits[producer_id] = self.queue_size_per_producer
+            self.units_reserved[producer_id] = 0
+            self.sell_through[producer_id] = 0.0
+
+    def count_sale(self, producer_id):
+        """ Counts a product of the producer taken in a cart. """
+        if self.adaptive:
+            with self.lock_limits:
+                self.units_reserved[producer_id] += 1
+
+    def count_order(self):
+        """ Counts a placed order and periodically resizes the producers' queues. """
+        if self.adaptive:
+            with self.lock_limits:
+                self.num_orders += 1
+                if self.num_orders % self.adapt_interval == 0:
+                    self.adjust_queue_sizes()
+
+    def queue_size(self, producer_id):
+        """ Returns the maximum number of products the producer can have in the marketplace. """
+        if self.adaptive:
+            return self.producer_limits[producer_id]
+        return self.queue_size_per_producer
+
+    def adjust_queue_sizes(self):
+        """
+        Splits the inventory budget between the producers proportionally to their
+        sell-through rate. Every producer keeps room for the products it has queued or in
+        carts plus a minimum share, so a producer whose products wait in unfinished carts can
+        still publish the products the other carts need, and no producer gets more than
+        MAX_QUEUE_FACTOR times queue_size_per_producer. Must be called with lock_limits taken.
+        """
+        num_producers = len(self.producer_limits)
+        budget = self.inventory_budget
+        if budget is None:
+            budget = self.queue_size_per_producer * num_producers
+        min_share = max(1, self.queue_size_per_producer // 2)
+        max_size = max(min_share, self.queue_size_per_producer * MAX_QUEUE_FACTOR)
+
+        # Smooth the products taken since the last adjustment
+        for producer_id in range(num_producers):
+            self.sell_through[producer_id] = \
+                (self.sell_through[producer_id] + self.units_reserved[producer_id]) / 2
+            self.units_reserved[producer_id] = 0
+
+        floors = [self.products_per_producer[producer_id] + min_share
+                  for producer_id in range(num_producers)]
+        total_rate = sum(self.sell_through)
+        spare = max(0, budget - sum(floors))
+        for producer_id in range(num_producers):
+            if total_rate == 0:
+                share = spare // num_producers
+            else:
+                share = int(spare * self.sell_through[producer_id] / total_rate)
+            self.producer_limits[producer_id] = \
+                max(floors[producer_id], min(max_size, floors[producer_id] + share))
+
+        self.log('Adjusted producer queue sizes: %s', self.producer_limits)
+
+    def queue_sizes(self):
+        """
+        Returns the current queue size of every producer.
+        """
+        return [self.queue_size(producer_id) for producer_id in range(len(self.producer_limits))]
@@ -0,0 +1,288 @@
+"""
+This module represents the admission control of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from dataclasses import dataclass
+from threading import Lock, BoundedSemaphore
+import threading
+import time
+import unittest
+
+# Weight of the newest interval in the smoothed rates
+SMOOTHING = 0.2
+
+
+@dataclass(init=True, repr=True, order=False)
+class Rejection:
+    """
+    Class that represents a refused publish or add_to_cart. It is falsy, so the callers that
+    only check the status keep working, and carries the number of seconds after which a retry
+    is likely to succeed.
+    """
+    retry_after: float
+    reason: str = 'unavailable'
+
+    def __bool__(self):
+        return False
+
+
+def retry_delay(status, default):
+    """ Returns the number of seconds to wait after a refused call. """
+    return getattr(status, 'retry_after', default)
+
+
+def smooth(average, value):
+    """ Returns the exponentially weighted average updated with the value. """
+    if average is None:
+        return value
+    return average + SMOOTHING * (value - average)
+
+
+class IntervalTracker:
+    """
+    Class that keeps the smoothed number of seconds between two events of every key.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.intervals = {}     # {key : smoothed seconds between two events}
+        self.last_event = {}    # {key : time of the last event}
+        self.lock = Lock()
+
+    def note(self, key):
+        """ Counts an event of the key. """
+        now = time.monotonic()
+        with self.lock:
+            last = self.last_event.get(key)
+            if last is not None:
+                self.intervals[key] = smooth(self.intervals.get(key), now - last)
+            self.last_event[key] = now
+
+    def interval(self, key):
+        """ Returns the smoothed interval of the key or None if it is not known yet. """
+        return self.intervals.get(key)
+
+    def forget(self, key):
+        """ Forgets the events of the key. """
+        with self.lock:
+            self.intervals.pop(key, None)
+            self.last_event.pop(key, None)
+
+
+class AdmissionControl:
+    """
+    Class that computes the retry-after hints of the refused calls from the state of the
+    marketplace and sheds the calls that exceed max_in_flight before they take any lock.
+
+    A producer with a full queue is told to come back after the time its products are usually
+    checked out. A cart that finds a product out of stock is told to come back after the time
+    the product is usually published, multiplied by its position among the carts waiting for it,
+    so the waiting carts do not all retry at once and the oldest one is served first.
+    """
+
+    def __init__(self, max_in_flight=None, default_retry_after=0.01, max_retry_after=1.0):
+        """
+        Constructor
+
+        :type max_in_flight: Int
+        :param max_in_flight: the maximum number of calls executed at the same time, the others
+        are refused without waiting; None does not shed any call
+
+        :type default_retry_after: Time
+        :param default_retry_after: the hint given while there is no rate to compute it from
+
+        :type max_retry_after: Time
+        :param max_retry_after: the upper bound of the hints
+        """
+        self.max_in_flight = max_in_flight
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self.slots = None if max_in_flight is None else BoundedSemaphore(max_in_flight)
+        self.call_start = threading.local()
+        self.service_time = None        # smoothed seconds spent in an admitted call
+        self.arrivals = IntervalTracker()   # products made available, by product
+        self.checkouts = IntervalTracker()  # products checked out, by producer_id
+        self.waiting = {}               # {product : {cart_id : None}}, in order of arrival
+        self.lock = Lock()
+
+    def hint(self, interval, factor=1):
+        """ Returns the bounded hint for factor intervals. """
+        if interval is None:
+            interval = self.default_retry_after
+        return min(self.max_retry_after, interval * factor)
+
+    def enter(self):
+        """
+        Admits a call, without blocking.
+
+        :returns None if the call is admitted or a Rejection if it must be shed
+        """
+        if self.slots is None:
+            return None
+
+        # The slot is released by exit(), at the end of the call
+        if not self.slots.acquire(blocking=False):  # pylint: disable=consider-using-with
+            # Every admitted call will be done after about one service time
+            return Rejection(self.hint(self.service_time, self.max_in_flight), 'overloaded')
+
+        self.call_start.time = time.perf_counter()
+        return None
+
+    def exit(self):
+        """ Ends an admitted call. """
+        if self.slots is None:
+            return
+
+        elapsed = time.perf_counter() - self.call_start.time
+        self.service_time = smooth(self.service_time, elapsed)
+        self.slots.release()
+
+    def note_arrival(self, product):
+        """ Counts a unit of the product made available (published or removed from a cart). """
+        self.arrivals.note(product)
+
+    def note_checkout(self, producer_id):
+        """ Counts a unit of the producer checked out, which frees a place in its queue. """
+        self.checkouts.note(producer_id)
+
+    def forget_producer(self, producer_id):
+        """ Forgets the checkouts of an unregistered producer before its id is reused. """
+        self.checkouts.forget(producer_id)
+
+    def reject_publish(self, producer_id, queued, queue_size):
+        """
+        Returns the Rejection of a publish.
+
+        :type queued: Int
+        :param queued: the number of products the producer has in the marketplace
+
+        :type queue_size: Int
+        :param queue_size: the maximum number of products the producer can have
+        """
+        interval = self.checkouts.interval(producer_id)
+        # A shrunk adaptive queue needs several checkouts before it has room, a publish that
+        # lost the race for the last place only one
+        return Rejection(self.hint(interval, max(1, queued - queue_size + 1)), 'queue full')
+
+    def reject_cart(self, cart_id, product):
+        """ Returns the Rejection of an add_to_cart and remembers that the cart waits. """
+        with self.lock:
+            waiting = self.waiting.setdefault(product, {})
+            waiting[cart_id] = None
+            position = list(waiting).index(cart_id)
+            interval = self.arrivals.interval(product)
+
+        return Rejection(self.hint(interval, position + 1), 'out of stock')
+
+    def cart_closed(self, cart_id):
+        """
+        Forgets the cart once it is checked out. A cart keeps its place among the waiting carts
+        until then, so the first cart gets all its products instead of every cart getting a
+        part of them and holding the producers' queues.
+        """
+        if not self.waiting:
+            return
+
+        with self.lock:
+            for product in list(self.waiting):
+                waiting = self.waiting[product]
+                waiting.pop(cart_id, None)
+                if not waiting:
+                    del self.waiting[product]
+
+
+class AdmissionMixin:
+    """
+    Mixin of the Marketplace that passes the publish and add_to_cart calls through the
+    optional admission control. The Marketplace provides the producers' queues.
+    """
+
+    def __init__(self, admission=None):
+        """
+        Constructor
+
+        :type admission: AdmissionControl
+        :param admission: optional admission control, which makes publish and add_to_cart
+        return a Rejection with a retry-after hint and sheds the calls over its limit
+        """
+        self.admission = admission
+
+    def admit(self):
+        """
+        Admits a publish or add_to_cart call before it takes any lock.
+
+        :returns None if the call goes on or the Rejection of a shed call
+        """
+        if self.admission is None:
+            return None
+        return self.admission.enter()
+
+    def leave(self):
+        """ Ends a call admitted by admit(). """
+        if self.admission is not None:
+            self.admission.exit()
+
+    def refuse_publish(self, producer_id):
+        """ Returns the status of a refused publish, a Rejection with admission control. """
+        if self.admission is None:
+            return False
+        return self.admission.reject_publish(producer_id, self.products_per_producer[producer_id],
+                                             self.queue_size(producer_id))
+
+    def refuse_cart(self, cart_id, product):
+        """ Returns the status of a refused add_to_cart, a Rejection with admission control. """
+        if self.admission is None:
+            return False
+        return self.admission.reject_cart(cart_id, product)
+
+
+class AdmissionControlTest(unittest.TestCase):
+    """ Admission Control Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        self.admission = AdmissionControl(max_in_flight=1, default_retry_after=0.05)
+
+    def test_rejection(self):
+        """ Test method """
+        rejection = Rejection(0.5)
+        # Check if the rejection is falsy and carries its hint
+        self.assertFalse(rejection)
+        self.assertEqual(0.5, retry_delay(rejection, 0.1))
+        self.assertEqual(0.1, retry_delay(False, 0.1))
+
+    def test_overload(self):
+        """ Test method """
+        self.assertIsNone(self.admission.enter())
+        # Check if the call over the limit is shed
+        rejection = self.admission.enter()
+        self.assertEqual('overloaded', rejection.reason)
+        self.admission.exit()
+        self.assertIsNone(self.admission.enter())
+        self.admission.exit()
+
+    def test_hints(self):
+        """ Test method """
+        self.admission.arrivals.intervals['Cocoa'] = 0.2
+        self.admission.checkouts.intervals[0] = 0.3
+
+        # Check if the waiting carts are spread over the expected arrivals
+        self.assertAlmostEqual(0.2, self.admission.reject_cart(0, 'Cocoa').retry_after)
+        self.assertAlmostEqual(0.4, self.admission.reject_cart(1, 'Cocoa').retry_after)
+        self.assertAlmostEqual(0.2, self.admission.reject_cart(0, 'Cocoa').retry_after)
+        self.admission.cart_closed(0)
+        self.assertAlmostEqual(0.2, self.admission.reject_cart(1, 'Cocoa').retry_after)
+        # Check the hints without a known rate and the upper bound
+        self.assertAlmostEqual(0.05, self.admission.reject_cart(0, 'Vanilla').retry_after)
+        self.assertAlmostEqual(0.6, self.admission.reject_publish(0, 6, 5).retry_after)
+        self.assertAlmostEqual(1.0, self.admission.reject_publish(0, 9, 1).retry_after)
+        # Check if the hint is never zero when the queue had room at the check
+        self.assertAlmostEqual(0.3, self.admission.reject_publish(0, 3, 5).retry_after)
+        # Check if a recycled producer id starts without the checkouts of the previous one
+        self.admission.forget_producer(0)
+        self.assertAlmostEqual(0.05, self.admission.reject_publish(0, 5, 5).retry_after)
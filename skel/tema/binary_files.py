@@ -0,0 +1,51 @@
+"""
+This module has the helpers shared by the binary files of the Marketplace: the binary log, the
+trace and the shared inventory.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import os
+import tempfile
+import unittest
+
+# The id written for a missing argument, product or result
+NONE = -1
+
+
+def intern(ids, item):
+    """
+    Returns the dense id of the item, assigning the next one if it is new.
+
+    :type ids: Dict
+    :param ids: {item : id}, updated with the new items
+
+    :returns a tuple (id of the item, True if the item was new)
+    """
+    item_id = ids.get(item)
+    if item_id is not None:
+        return item_id, False
+
+    item_id = len(ids)
+    ids[item] = item_id
+    return item_id, True
+
+
+class BinaryFileTest(unittest.TestCase):
+    """
+    Base class of the tests that write a file at self.path. The file and its sidecar files,
+    the path followed by one of the suffixes, are removed after every test.
+    """
+    suffixes = ('',)
+
+    def setUp(self):
+        """ Creates the file. """
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        """ Removes the file and its sidecar files. """
+        for suffix in self.suffixes:
+            os.remove(self.path + suffix)
@@ -0,0 +1,225 @@
+"""
+This module represents the binary operation log of the Marketplace and its decoder.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from threading import Lock
+import argparse
+import os
+import struct
+import time
+
+from tema.binary_files import NONE, BinaryFileTest, intern
+from tema.marketplace import Marketplace
+from tema.product import Tea
+
+# timestamp, method code, producer or cart id, product id, result
+RECORD = struct.Struct('<dBiii')
+
+REGISTER_PRODUCER = 0
+ADD_PRODUCT = 1
+PUBLISH = 2
+NEW_CART = 3
+ADD_TO_CART = 4
+REMOVE_FROM_CART = 5
+PLACE_ORDER = 6
+ORDER_ITEM = 7
+UNREGISTER_PRODUCER = 8
+
+METHOD_CODES = {'register_producer': REGISTER_PRODUCER, 'add_product': ADD_PRODUCT,
+                'publish': PUBLISH, 'new_cart': NEW_CART, 'add_to_cart': ADD_TO_CART,
+                'remove_from_cart': REMOVE_FROM_CART, 'place_order': PLACE_ORDER,
+                'order_item': ORDER_ITEM, 'unregister_producer': UNREGISTER_PRODUCER}
+
+
+class BinaryLog:
+    """
+    Class that writes fixed-width records into a preallocated segment, which is written to
+    the log file once it is full. The products are interned, their text is appended once to
+    a sidecar file (<path>.products).
+    """
+
+    def __init__(self, path, segment_records=1 << 16):
+        """
+        Constructor
+
+        :type path: String
+        :param path: the log file
+
+        :type segment_records: Int
+        :param segment_records: the number of records buffered in memory
+        """
+        # The segments are the buffer, write them straight to the file
+        self.log_file = open(path, 'wb', buffering=0)  # pylint: disable=consider-using-with
+        self.products_file = open(  # pylint: disable=consider-using-with
+            path + '.products', 'w', encoding='utf-8')
+        self.segment = bytearray(segment_records * RECORD.size)
+        self.offset = 0
+        self.product_ids = {}   # {product : product id}
+        self.closed = False
+        self.lock = Lock()
+
+    def record(self, method, id_arg=NONE, product=None, result=NONE):
+        """
+        Appends a record to the current segment.
+
+        :type method: String
+        :param method: the name of the Marketplace method, or 'order_item' for every product
+        returned by place_order (written before the place_order record)
+        """
+        timestamp = time.time()
+        code = METHOD_CODES[method]
+
+        with self.lock:
+            if self.closed:
+                return
+
+            product_id = NONE
+            if product is not None:
+                product_id, new = intern(self.product_ids, product)
+                if new:
+                    self.products_file.write(f'{str(product)}\n')
+
+            RECORD.pack_into(self.segment, self.offset, timestamp, code, id_arg, product_id,
+                             int(result))
+            self.offset += RECORD.size
+            if self.offset == len(self.segment):
+                self.flush()
+
+    def flush(self):
+        """ Writes the records of the current segment. Must be called with the lock taken. """
+        self.log_file.write(memoryview(self.segment)[:self.offset])
+        self.products_file.flush()
+        self.offset = 0
+
+    def close(self):
+        """ Writes the remaining records and closes the files, later records are dropped. """
+        with self.lock:
+            if self.closed:
+                return
+
+            self.closed = True
+            self.flush()
+            self.log_file.close()
+            self.products_file.close()
+
+
+def format_line(timestamp, message):
+    """ Formats a line like the text log of the Marketplace. """
+    asctime = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+    return f'{asctime} INFO  {message}'
+
+
+def decode(path):
+    """
+    Renders a binary log in the format of the text log.
+
+    :type path: String
+    :param path: the log file written by BinaryLog
+
+    :returns a generator of lines
+    """
+    with open(path + '.products', encoding='utf-8') as products_file:
+        products = products_file.read().splitlines()
+    with open(path, 'rb') as log_file:
+        data = log_file.read()
+
+    order_items = {}    # {cart_id : [product]}
+    for timestamp, code, id_arg, product_id, result in RECORD.iter_unpack(data):
+        product = products[product_id] if product_id != NONE else None
+
+        if code == REGISTER_PRODUCER:
+            yield format_line(timestamp, f'Method \'register producer\' returns int: {result}')
+        elif code == ADD_PRODUCT:
+            yield format_line(timestamp, f'Method \'add_product\' has params producer_id (int): '
+                                         f'{id_arg}, product (object): {product}')
+        elif code == PUBLISH:
+            yield format_line(timestamp, f'Method \'publish\' has params producer_id (int): '
+                                         f'{id_arg}, product (object): {product}')
+            yield format_line(timestamp, f'Method \'publish\' returns bool: {bool(result)}')
+        elif code == UNREGISTER_PRODUCER:
+            # Only the number of unsold products is recorded
+            yield format_line(timestamp, f'Method \'unregister_producer\' has params '
+                                         f'producer_id (int): {id_arg}')
+            yield format_line(timestamp, f'Method \'unregister_producer\' returns '
+                                         f'{result} products')
+        elif code == NEW_CART:
+            yield format_line(timestamp, f'Method \'new_cart\' returns int: {result}')
+        elif code == ADD_TO_CART:
+            yield format_line(timestamp, f'Method \'add_to_cart\' has params cart_id (int): '
+                                         f'{id_arg}, product (object): {product}')
+            yield format_line(timestamp, f'Method \'add_to_cart\' returns bool: {bool(result)}')
+        elif code == REMOVE_FROM_CART:
+            yield format_line(timestamp, f'Method \'remove_from_cart\' has params cart_id (int): '
+                                         f'{id_arg}, product (object): {product}')
+        elif code == ORDER_ITEM:
+            order_items.setdefault(id_arg, []).append(product)
+        elif code == PLACE_ORDER:
+            cart_list = order_items.pop(id_arg, [])
+            yield format_line(timestamp, f'Method \'place_order\' has params cart_id (int): '
+                                         f'{id_arg}')
+            yield format_line(timestamp, f'Method \'place_order\' returns cart (list): '
+                                         f'[{", ".join(cart_list)}]')
+
+
+def main():
+    """ Prints a binary log as text. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log', type=str, help='binary log written by the marketplace')
+    args = parser.parse_args()
+
+    for line in decode(args.log):
+        print(line)
+
+
+class BinaryLogTest(BinaryFileTest):
+    """ Binary Log Test class """
+    suffixes = ('', '.products')
+
+    def setUp(self):
+        """ Sets up initial fields. """
+        super().setUp()
+        self.binary_log = BinaryLog(self.path, segment_records=4)
+
+    def test_segments(self):
+        """ Test method """
+        for i in range(5):
+            self.binary_log.record('new_cart', result=i)
+        # Check if only the full segment has been written
+        self.assertEqual(4 * RECORD.size, os.path.getsize(self.path))
+        self.binary_log.close()
+        self.assertEqual(5 * RECORD.size, os.path.getsize(self.path))
+
+    def test_decode(self):
+        """ Test method """
+        marketplace = Marketplace(1, binary_log=self.binary_log)
+        product = Tea('Linden', 9, 'Herbal')
+        producer_id = marketplace.register_producer()
+        cart = marketplace.new_cart()
+        marketplace.publish(producer_id, product)
+        marketplace.publish(producer_id, product)
+        marketplace.add_to_cart(cart, product)
+        marketplace.place_order(cart)
+        self.binary_log.close()
+
+        # Check if the lines are the ones of the text log (a call is logged when it returns)
+        messages = [line[len('2021-03-01 00:00:00 INFO  '):] for line in decode(self.path)]
+        self.assertEqual([
+            'Method \'register producer\' returns int: 0',
+            'Method \'new_cart\' returns int: 0',
+            f'Method \'add_product\' has params producer_id (int): 0, product (object): {product}',
+            f'Method \'publish\' has params producer_id (int): 0, product (object): {product}',
+            'Method \'publish\' returns bool: True',
+            f'Method \'publish\' has params producer_id (int): 0, product (object): {product}',
+            'Method \'publish\' returns bool: False',
+            f'Method \'add_to_cart\' has params cart_id (int): 0, product (object): {product}',
+            'Method \'add_to_cart\' returns bool: True',
+            'Method \'place_order\' has params cart_id (int): 0',
+            f'Method \'place_order\' returns cart (list): {[product]}'], messages)
+
+
+if __name__ == '__main__':
+    main()
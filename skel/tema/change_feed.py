@@ -0,0 +1,290 @@
+"""
+This module represents the Change Feed of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from dataclasses import dataclass
+from threading import Lock, Condition
+import time
+import unittest
+
+from tema.marketplace import Marketplace
+
+PUBLISH = 'publish'
+RESERVE = 'reserve'
+RELEASE = 'release'
+ORDER = 'order'
+UNREGISTER = 'unregister'   # the units are taken off sale with their unregistered producer
+RECYCLE = 'recycle'   # the later events with the producer id are of a new producer
+
+DROP_POLICY = 'drop'
+BLOCK_POLICY = 'block'
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class ChangeEvent:
+    """
+    Class that represents an inventory change of the marketplace.
+    """
+    sequence: int
+    kind: str
+    producer_id: int
+    cart_id: int
+    product: object
+    quantity: int
+    timestamp: float
+
+
+class ChangeFeed:
+    """
+    Class that represents a bounded ring buffer of change events. The marketplace emits the
+    events, the subscribers read them at their own pace using a cursor. Writers are serialized
+    by the feed's own lock, readers only take it when they wait for new events or when they
+    have to wake up a blocked writer.
+    """
+
+    def __init__(self, capacity=1024, policy=DROP_POLICY, block_timeout=None):
+        """
+        Constructor
+
+        :type capacity: Int
+        :param capacity: the number of events kept in the ring buffer
+
+        :type policy: String
+        :param policy: 'drop' overwrites the oldest events of slow subscribers, 'block' makes
+        the writers wait until every subscriber has room in the buffer
+
+        :type block_timeout: Time
+        :param block_timeout: the maximum number of seconds a writer waits with the 'block'
+        policy, after which the oldest events are overwritten anyway
+        """
+        if policy not in (DROP_POLICY, BLOCK_POLICY):
+            raise ValueError(f'unknown policy: {policy}')
+
+        self.capacity = capacity
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.buffer = [None] * capacity
+        self.next_sequence = 0
+        self.subscriptions = []
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+
+    def emit(self, kind, producer_id=None, cart_id=None, product=None, quantity=1):
+        """
+        Appends an event to the ring buffer.
+
+        :returns the sequence number of the event
+        """
+        with self.condition:
+            sequence = self.next_sequence
+
+            # Wait until the slowest subscriber has room for the event
+            if self.policy == BLOCK_POLICY:
+                self.condition.wait_for(lambda: self.has_room(sequence), self.block_timeout)
+
+            self.buffer[sequence % self.capacity] = ChangeEvent(
+                sequence, kind, producer_id, cart_id, product, quantity, time.time())
+            # Make the event visible to the readers only after it has been written
+            self.next_sequence = sequence + 1
+            self.condition.notify_all()
+
+        return sequence
+
+    def has_room(self, sequence):
+        """ Checks if the event with the given sequence does not overwrite unread events. """
+        return all(sequence - subscription.cursor < self.capacity
+                   for subscription in self.subscriptions)
+
+    def subscribe(self, from_start=False):
+        """
+        Creates a new subscription.
+
+        :type from_start: Bool
+        :param from_start: True to read the oldest events still in the buffer, False to
+        read only the events emitted after subscribing
+        """
+        with self.lock:
+            cursor = self.next_sequence
+            if from_start:
+                cursor = max(0, cursor - self.capacity)
+            subscription = Subscription(self, cursor)
+            self.subscriptions.append(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ Removes the subscription and wakes up the writers blocked by it. """
+        with self.condition:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+            self.condition.notify_all()
+
+
+class Subscription:
+    """
+    Class that represents the read cursor of a subscriber.
+    """
+
+    def __init__(self, feed, cursor):
+        """
+        Constructor
+
+        :type feed: ChangeFeed
+        :param feed: the feed that is read
+
+        :type cursor: Int
+        :param cursor: the sequence of the next event to read
+        """
+        self.feed = feed
+        self.cursor = cursor
+        self.dropped = 0
+
+    def read(self, max_events=None, timeout=0):
+        """
+        Returns a batch of events starting at the cursor.
+
+        :type max_events: Int
+        :param max_events: the maximum number of events returned, None for all available
+
+        :type timeout: Time
+        :param timeout: the number of seconds to wait if there are no events, None waits forever
+        """
+        if self.feed.next_sequence == self.cursor and timeout != 0:
+            with self.feed.condition:
+                self.feed.condition.wait_for(
+                    lambda: self.feed.next_sequence != self.cursor, timeout)
+
+        events = []
+        end = self.feed.next_sequence
+
+        while self.cursor < end and (max_events is None or len(events) < max_events):
+            event = self.feed.buffer[self.cursor % self.feed.capacity]
+            if event is None or event.sequence != self.cursor:
+                # The event has been overwritten -> skip to the oldest one available
+                oldest = max(self.cursor + 1, self.feed.next_sequence - self.feed.capacity)
+                self.dropped += oldest - self.cursor
+                self.cursor = oldest
+                end = self.feed.next_sequence
+                continue
+
+            events.append(event)
+            self.cursor += 1
+
+        # Let the blocked writers know there is room again
+        if self.feed.policy == BLOCK_POLICY and events:
+            with self.feed.condition:
+                self.feed.condition.notify_all()
+
+        return events
+
+    def close(self):
+        """ Stops the subscription. """
+        self.feed.unsubscribe(self)
+
+
+class ChangeFeedTest(unittest.TestCase):
+    """ Change Feed Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        self.feed = ChangeFeed(4)
+
+    def test_read(self):
+        """ Test method """
+        subscription = self.feed.subscribe()
+        self.feed.emit(PUBLISH, 0, product='Cocoa')
+        self.feed.emit(PUBLISH, 0, product='Vanilla')
+
+        # Check if the batch size is honored
+        events = subscription.read(1)
+        self.assertEqual(['Cocoa'], [event.product for event in events])
+        events = subscription.read()
+        self.assertEqual(['Vanilla'], [event.product for event in events])
+        # Check if there is nothing left to read
+        self.assertEqual([], subscription.read())
+
+    def test_drop_policy(self):
+        """ Test method """
+        subscription = self.feed.subscribe()
+        for i in range(6):
+            self.feed.emit(PUBLISH, 0, product=i)
+
+        # Check if the oldest events have been dropped
+        events = subscription.read()
+        self.assertEqual([2, 3, 4, 5], [event.product for event in events])
+        self.assertEqual(2, subscription.dropped)
+
+    def test_block_policy(self):
+        """ Test method """
+        feed = ChangeFeed(2, BLOCK_POLICY, block_timeout=0.01)
+        subscription = feed.subscribe()
+        feed.emit(PUBLISH, 0, product=0)
+        feed.emit(PUBLISH, 0, product=1)
+
+        # Check if the writer waits for the subscriber before overwriting
+        start = time.monotonic()
+        feed.emit(PUBLISH, 0, product=2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.01)
+
+        subscription.close()
+        feed.emit(PUBLISH, 0, product=3)
+        self.assertEqual(4, feed.next_sequence)
+
+    def test_marketplace_events(self):
+        """ Test method """
+        feed = ChangeFeed(16)
+        marketplace = Marketplace(5, change_feed=feed)
+        subscription = feed.subscribe()
+        producer_id = marketplace.register_producer()
+        cart = marketplace.new_cart()
+
+        marketplace.publish(producer_id, 'Cocoa')
+        marketplace.publish(producer_id, 'Cocoa')
+        marketplace.add_to_cart(cart, 'Cocoa')
+        marketplace.add_to_cart(cart, 'Cocoa')
+        marketplace.remove_from_cart(cart, 'Cocoa')
+        marketplace.place_order(cart)
+
+        # Check if every inventory change has been emitted
+        events = subscription.read()
+        self.assertEqual([PUBLISH, PUBLISH, RESERVE, RESERVE, RELEASE, ORDER],
+                         [event.kind for event in events])
+        self.assertEqual(cart, events[-1].cart_id)
+        self.assertEqual(1, events[-1].quantity)
+
+    def test_recycled_producer(self):
+        """ Test method """
+        feed = ChangeFeed(16)
+        marketplace = Marketplace(5, change_feed=feed)
+        subscription = feed.subscribe()
+        producer_id = marketplace.register_producer()
+        marketplace.publish(producer_id, 'Cocoa')
+        marketplace.unregister_producer(producer_id)
+
+        # Check if the subscribers learn that the next events of the id are of a new producer
+        self.assertEqual([PUBLISH, UNREGISTER, RECYCLE],
+                         [event.kind for event in subscription.read()])
+
+    def test_unregistered_producer(self):
+        """ Test method """
+        feed = ChangeFeed(16)
+        marketplace = Marketplace(5, change_feed=feed)
+        producer_id = marketplace.register_producer()
+        cart = marketplace.new_cart()
+        for product in ('Cocoa', 'Cocoa', 'Cocoa', 'Vanilla'):
+            marketplace.publish(producer_id, product)
+        marketplace.add_to_cart(cart, 'Cocoa')
+        subscription = feed.subscribe()
+        marketplace.unregister_producer(producer_id)
+
+        # Check if the units taken off sale are emitted, not the one in the cart
+        self.assertEqual([(UNREGISTER, 'Cocoa', 2), (UNREGISTER, 'Vanilla', 1)],
+                         [(event.kind, event.product, event.quantity)
+                          for event in subscription.read()])
+        # Check if a unit removed from the cart is taken off sale again
+        marketplace.remove_from_cart(cart, 'Cocoa')
+        self.assertEqual([RELEASE, UNREGISTER, RECYCLE],
+                         [event.kind for event in subscription.read()])
@@ -0,0 +1,34 @@
+"""
+This module starts the Python processes run by the Marketplace's cluster and tests.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import os
+import subprocess
+import sys
+
+# The directory that contains the tema package and test.py
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_python(args, directory):
+    """
+    Starts a Python process in the directory, which imports the tema package from PACKAGE_ROOT
+    whatever the directory is. The text log of its marketplaces is written there too.
+
+    :type args: List
+    :param args: the arguments of the interpreter, e.g. ['-m', 'tema.service', 'serve']
+
+    :type directory: String
+    :param directory: the working directory of the process
+
+    :returns the Popen of the process, its standard output is a text pipe
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get('PYTHONPATH')]))
+    # The caller waits for the process
+    return subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, *args], cwd=directory, env=env, stdout=subprocess.PIPE, text=True)
@@ -0,0 +1,333 @@
+"""
+This module represents a cluster of Marketplaces, each one owning a partition of the products.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from itertools import count
+from threading import Thread, Lock, Barrier
+import argparse
+import os
+import random
+import tempfile
+import time
+import unittest
+import zlib
+
+from tema.child_process import start_python
+from tema.marketplace import Marketplace
+from tema.service import MarketplaceClient, MarketplaceError
+
+
+class ShardProcess(MarketplaceClient):
+    """
+    Class that runs a marketplace in a child process, served by tema.service on a Unix socket
+    of a temporary directory, and implements the Marketplace API through a client of it. The
+    shard has its own interpreter, so it does not share the GIL with the other shards.
+    """
+
+    def __init__(self, queue_size_per_producer, pool_size=16):
+        """
+        Constructor
+
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: the maximum size of a queue associated with each producer
+
+        :type pool_size: Int
+        :param pool_size: the maximum number of idle connections kept open
+        """
+        # The text log of the shard is written there too
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        path = os.path.join(self.directory.name, 'shard.sock')
+        self.process = start_python(['-m', 'tema.service', 'serve', '--unix', path,
+                                     '--queue-size', str(queue_size_per_producer), '--quiet'],
+                                    self.directory.name)
+
+        # The server prints its address once it listens
+        if not self.process.stdout.readline():
+            self.shutdown()
+            raise MarketplaceError('the shard process exited before serving')
+        super().__init__(path, pool_size)
+
+    def shutdown(self):
+        """ Stops the shard process and removes its directory. """
+        self.close()
+        self.process.terminate()
+        self.process.wait()
+        self.process.stdout.close()
+        self.directory.cleanup()
+
+
+def products_in_market(shard, producer_id):
+    """ Returns the number of products of the producer on a shard, in stock or in carts. """
+    if isinstance(shard, MarketplaceClient):
+        return shard.products_in_market(producer_id)
+    return shard.products_per_producer[producer_id]
+
+
+class MarketplaceCluster:
+    """
+    Class that routes the Marketplace API to N marketplaces (shards). A product always lives
+    on the same shard, a producer and a cart are spread over all of them.
+
+    The shards are marketplaces of this process, whose threads share the GIL, or ShardProcess
+    instances, each one with its own interpreter.
+    """
+
+    def __init__(self, queue_size_per_producer, num_shards=2, processes=False):
+        """
+        Constructor
+
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: the maximum size of a queue associated with each producer,
+        over all the shards
+
+        :type num_shards: Int
+        :param num_shards: the number of marketplaces
+
+        :type processes: Bool
+        :param processes: True to run every shard in a child process, shutdown stops them
+        """
+        shard_class = ShardProcess if processes else Marketplace
+        self.queue_size_per_producer = queue_size_per_producer
+        self.shards = [shard_class(queue_size_per_producer) for _ in range(num_shards)]
+        self.cart_ids = count()
+        self.num_producers = 0
+        # [upper bound of the products of the producer over all the shards], one per producer
+        self.products_per_producer = []
+        self.producer_locks = []
+        self.carts = {}     # {cart_id : {shard_index : shard_cart_id}}
+        self.lock_producer = Lock()
+        self.lock_cart = Lock()
+
+    def shard_index(self, product):
+        """
+        Returns the index of the shard that owns the product. The checksum of its text, unlike
+        hash(), is the same in every process.
+        """
+        return zlib.crc32(str(product).encode()) % len(self.shards)
+
+    def register_producer(self):
+        """
+        Returns an id for the producer that calls this. The producer has the same id on
+        every shard.
+        """
+        with self.lock_producer:
+            producer_id = self.num_producers
+            self.num_producers += 1
+            for shard in self.shards:
+                shard.register_producer()
+            self.products_per_producer.append(0)
+            self.producer_locks.append(Lock())
+
+        return producer_id
+
+    def products_in_market(self, producer_id):
+        """ Returns the number of products the producer has over all the shards. """
+        return sum(products_in_market(shard, producer_id) for shard in self.shards)
+
+    def publish(self, producer_id, product):
+        """
+        Publishes the product on its shard.
+
+        :returns True or False. If the caller receives False, it should wait and then try again.
+        """
+        # The queue size is global, the shards only ever see a smaller count. Only the shards
+        # see the sales, so the count of the cluster is an upper bound, asked to every shard
+        # once it reaches the queue size
+        with self.producer_locks[producer_id]:
+            if self.products_per_producer[producer_id] >= self.queue_size_per_producer:
+                self.products_per_producer[producer_id] = self.products_in_market(producer_id)
+                if self.products_per_producer[producer_id] >= self.queue_size_per_producer:
+                    return False
+
+            status = self.shards[self.shard_index(product)].publish(producer_id, product)
+            if status:
+                self.products_per_producer[producer_id] += 1
+            return status
+
+    def new_cart(self):
+        """
+        Creates a new cart, the carts of the shards are created when a product is added.
+
+        :returns an int representing the cart_id
+        """
+        with self.lock_cart:
+            cart_id = next(self.cart_ids)
+            self.carts[cart_id] = {}
+        return cart_id
+
+    def add_to_cart(self, cart_id, product):
+        """
+        Adds a product to the given cart on the product's shard.
+
+        :returns True or False. If the caller receives False, it should wait and then try again
+        """
+        index = self.shard_index(product)
+        shard = self.shards[index]
+
+        shard_cart_id = self.carts[cart_id].get(index)
+        if shard_cart_id is None:
+            shard_cart_id = shard.new_cart()
+            self.carts[cart_id][index] = shard_cart_id
+
+        return shard.add_to_cart(shard_cart_id, product)
+
+    def remove_from_cart(self, cart_id, product):
+        """ Removes a product from cart. """
+        index = self.shard_index(product)
+
+        shard_cart_id = self.carts[cart_id].get(index)
+        if shard_cart_id is not None:
+            self.shards[index].remove_from_cart(shard_cart_id, product)
+
+    def place_order(self, cart_id):
+        """
+        Checks out the cart on every shard it spans and returns all the products.
+        """
+        cart_list = []
+        for index, shard_cart_id in self.carts.pop(cart_id).items():
+            cart_list.extend(self.shards[index].place_order(shard_cart_id))
+
+        return cart_list
+
+    def shutdown(self):
+        """ Stops the shard processes, the shards of this process need nothing. """
+        for shard in self.shards:
+            if isinstance(shard, ShardProcess):
+                shard.shutdown()
+
+
+def benchmark(marketplace, num_threads, num_operations, num_products):
+    """
+    Runs producers and consumers against the marketplace as fast as possible.
+
+    :returns the number of operations per second
+    """
+    products = [f'product{i}' for i in range(num_products)]
+    barrier = Barrier(num_threads + 1)
+
+    def worker():
+        rng = random.Random()
+        producer_id = marketplace.register_producer()
+        barrier.wait()
+
+        for _ in range(num_operations):
+            # Buy the product published, the queues of the producers do not fill up
+            product = rng.choice(products)
+            marketplace.publish(producer_id, product)
+            cart_id = marketplace.new_cart()
+            marketplace.add_to_cart(cart_id, product)
+            marketplace.place_order(cart_id)
+
+    threads = [Thread(target=worker) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+
+    return 4 * num_threads * num_operations / (time.perf_counter() - start)
+
+
+def main():
+    """ Prints the throughput of the cluster for every number of shards. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--operations', type=int, default=2000,
+                        help='number of publish/new_cart/add_to_cart/place_order rounds per thread')
+    parser.add_argument('--products', type=int, default=64)
+    parser.add_argument('--in-process', action='store_true',
+                        help='run the shards in this process instead of one process per shard')
+    args = parser.parse_args()
+
+    place = 'this process' if args.in_process else 'one process per shard'
+    print(f'{os.cpu_count()} CPUs, the shards run in {place}')
+    with Marketplace.quiet_log():
+        baseline = None
+        for num_shards in args.shards:
+            cluster = MarketplaceCluster(8, num_shards, processes=not args.in_process)
+            try:
+                throughput = benchmark(cluster, args.threads, args.operations, args.products)
+            finally:
+                cluster.shutdown()
+            baseline = baseline or throughput
+            print(f'{num_shards} shards: {throughput:.0f} ops/s ({throughput / baseline:.2f}x)')
+
+
+class MarketplaceClusterTest(unittest.TestCase):
+    """ Marketplace Cluster Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        self.cluster = MarketplaceCluster(3, 4)
+        self.products = [f'product{i}' for i in range(8)]
+
+    def test_register_producer(self):
+        """ Test method """
+        # Check the IDs of the producers
+        self.assertEqual(0, self.cluster.register_producer())
+        self.assertEqual(1, self.cluster.register_producer())
+        # Check if every shard knows the producers
+        for shard in self.cluster.shards:
+            self.assertEqual([0, 0], shard.products_per_producer)
+
+    def test_publish(self):
+        """ Test method """
+        producer_id = self.cluster.register_producer()
+
+        # Check if the queue size is enforced over all the shards
+        for product in self.products[:3]:
+            self.assertTrue(self.cluster.publish(producer_id, product))
+        self.assertFalse(self.cluster.publish(producer_id, self.products[3]))
+
+        # Check if every product is on its shard, the same one in every process
+        self.assertEqual([0, 2, 0, 2, 1, 3, 1, 3],
+                         [self.cluster.shard_index(product) for product in self.products])
+        for product in self.products[:3]:
+            shard = self.cluster.shards[self.cluster.shard_index(product)]
+            self.assertDictEqual({producer_id: 1}, shard.products[product])
+
+    def test_place_order(self):
+        """ Test method """
+        producer_id = self.cluster.register_producer()
+        cart = self.cluster.new_cart()
+        for product in self.products[:3]:
+            self.cluster.publish(producer_id, product)
+            self.assertTrue(self.cluster.add_to_cart(cart, product))
+        self.cluster.remove_from_cart(cart, self.products[0])
+
+        # Check if the cart spanning several shards is checked out entirely
+        self.assertCountEqual(self.products[1:3], self.cluster.place_order(cart))
+        self.assertEqual(1, self.cluster.products_in_market(producer_id))
+        self.assertIsNone(self.cluster.carts.get(cart))
+
+    def test_processes(self):
+        """ Test method """
+        cluster = MarketplaceCluster(3, 2, processes=True)
+        try:
+            producer_id = cluster.register_producer()
+            cart = cluster.new_cart()
+
+            # Check if the queue size is enforced over the shard processes
+            for product in self.products[:3]:
+                self.assertTrue(cluster.publish(producer_id, product))
+                self.assertTrue(cluster.add_to_cart(cart, product))
+            self.assertFalse(cluster.publish(producer_id, self.products[3]))
+
+            # Check if the sales seen by the shards make room for the producer
+            self.assertCountEqual(self.products[:3], cluster.place_order(cart))
+            self.assertEqual(0, cluster.products_in_market(producer_id))
+            self.assertTrue(cluster.publish(producer_id, self.products[3]))
+        finally:
+            cluster.shutdown()
+        # Check if the shard processes are stopped
+        self.assertTrue(all(shard.process.poll() is not None for shard in cluster.shards))
+
+
+if __name__ == '__main__':
+    main()
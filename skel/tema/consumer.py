@@ -6,8 +6,52 @@ Assignment 1
 March 2021
 """
 
-from threading import Thread, Lock
+from threading import Thread
 import time
+import unittest
+
+from tema.admission import retry_delay
+from tema.marketplace import Marketplace
+
+
+def compile_cart(cart):
+    """
+    Compiles the add and remove operations of a cart into the net quantity of each product.
+    A removal never takes the quantity below 0, just like removing a product that is not in the
+    cart does nothing.
+
+    :type cart: List
+    :param cart: a list of add and remove operations
+
+    :returns a dict {product : quantity}, in the order the products first appear in the cart
+    """
+    quantities = {}
+
+    for operation in cart:
+        op_prod = operation['product']
+        if operation['type'] == 'add':
+            quantities[op_prod] = quantities.get(op_prod, 0) + operation['quantity']
+        elif operation['type'] == 'remove':
+            quantities[op_prod] = max(0, quantities.get(op_prod, 0) - operation['quantity'])
+
+    return {product: quantity for product, quantity in quantities.items() if quantity > 0}
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the values fall (nearest rank).
+
+    :type values: List
+    :param values: the measured values
+
+    :type fraction: Float
+    :param fraction: a number between 0 and 1, e.g. 0.99 for p99
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
 
 
 class Consumer(Thread):
@@ -15,7 +59,8 @@ class Consumer(Thread):
     Class that represents a consumer.
     """
 
-    def __init__(self, carts, marketplace, retry_wait_time, **kwargs):
+    def __init__(self, carts, marketplace, retry_wait_time, *, compile_carts=False,
+                 backorders=False, priority=0, atomic_carts=False, **kwargs):
         """
         Constructor.
 
@@ -29,6 +74,21 @@ class Consumer(Thread):
         :param retry_wait_time: the number of seconds that a producer must wait
         until the Marketplace becomes available
 
+        :type compile_carts: Bool
+        :param compile_carts: True to add only the net quantity of each product instead of
+        executing every add and remove operation
+
+        :type backorders: Bool
+        :param backorders: True to wait in the marketplace's backorder queue for the products
+        that are not in stock instead of retrying
+
+        :type priority: Int
+        :param priority: the priority class of the consumer's carts
+
+        :type atomic_carts: Bool
+        :param atomic_carts: True to reserve the net quantities of a cart all at once,
+        waiting until every product is in stock
+
         :type kwargs:
         :param kwargs: other arguments that are passed to the Thread's __init__()
         """
@@ -36,8 +96,12 @@ class Consumer(Thread):
         self.carts = carts
         self.marketplace = marketplace
         self.retry_wait_time = retry_wait_time
+        self.compile_carts = compile_carts
+        self.backorders = backorders
+        self.priority = priority
+        self.atomic_carts = atomic_carts
+        self.wait_times = []    # seconds waited for every product added
         self.kwargs = kwargs
-        self.lock = Lock()
 
     def add_to_cart(self, cart_id, product, quantity):
         """ Adds quantity products to the cart with the given id. """
@@ -45,13 +109,20 @@ class Consumer(Thread):
 
         # Add as many items as needed
         while num_products_added < quantity:
-            status = self.marketplace.add_to_cart(cart_id, product)
-            if status is False:
-                # Wait and retry again
-                time.sleep(self.retry_wait_time)
+            start = time.monotonic()
+            if self.backorders:
+                # Wait in line until a product is handed over
+                self.marketplace.reserve(cart_id, product)
             else:
-                # Increment number of items
-                num_products_added += 1
+                status = self.marketplace.add_to_cart(cart_id, product)
+                while not status:
+                    # Wait until the product is expected to be available and retry again
+                    time.sleep(retry_delay(status, self.retry_wait_time))
+                    status = self.marketplace.add_to_cart(cart_id, product)
+
+            # Increment number of items
+            self.wait_times.append(time.monotonic() - start)
+            num_products_added += 1
 
     def remove_from_cart(self, cart_id, product, quantity):
         """ Removes quantity products to the cart with the given id. """
@@ -65,12 +136,33 @@ class Consumer(Thread):
     def print_cart(self, cart):
         """ Print products in cart """
         for product in cart:
-            print(self.kwargs['name'], "bought", product)
+            # One write per line, the lines of the other consumers cannot split it
+            print(f'{self.kwargs["name"]} bought {product}')
 
     def run(self):
         for cart in self.carts:
             # Generate a new cart
-            cart_id = self.marketplace.new_cart()
+            if self.priority != 0:
+                cart_id = self.marketplace.new_cart(priority=self.priority)
+            else:
+                cart_id = self.marketplace.new_cart()
+
+            if self.atomic_carts:
+                # Hold nothing until the whole cart can be reserved
+                quantities = compile_cart(cart)
+                start = time.monotonic()
+                self.marketplace.reserve_all(cart_id, quantities, wait=True)
+                self.wait_times.extend([time.monotonic() - start] * sum(quantities.values()))
+                self.print_cart(self.marketplace.place_order(cart_id))
+                continue
+
+            if self.compile_carts:
+                # Reserve only the net quantities, nothing is released back
+                for product, quantity in compile_cart(cart).items():
+                    self.add_to_cart(cart_id, product, quantity)
+                self.print_cart(self.marketplace.place_order(cart_id))
+                continue
+
             for operation in cart:
                 op_type = operation['type']
                 op_prod = operation['product']
@@ -87,3 +179,54 @@ class Consumer(Thread):
 
             # Checkout
             self.print_cart(self.marketplace.place_order(cart_id))
+
+
+class ConsumerTest(unittest.TestCase):
+    """ Consumer Test class """
+    def test_compile_cart(self):
+        """ Test method """
+        cart = [{'type': 'add', 'product': 'Cocoa', 'quantity': 5},
+                {'type': 'add', 'product': 'Vanilla', 'quantity': 1},
+                {'type': 'remove', 'product': 'Cocoa', 'quantity': 3}]
+        # Check if the quantities are the net ones
+        self.assertDictEqual({'Cocoa': 2, 'Vanilla': 1}, compile_cart(cart))
+
+    def test_compile_cart_removals(self):
+        """ Test method """
+        cart = [{'type': 'remove', 'product': 'Cocoa', 'quantity': 1},
+                {'type': 'add', 'product': 'Cocoa', 'quantity': 2},
+                {'type': 'remove', 'product': 'Cocoa', 'quantity': 3},
+                {'type': 'add', 'product': 'Cocoa', 'quantity': 1},
+                {'type': 'add', 'product': 'Vanilla', 'quantity': 1},
+                {'type': 'remove', 'product': 'Vanilla', 'quantity': 1}]
+        # Check if removals never go below an empty cart and empty products are discarded
+        self.assertDictEqual({'Cocoa': 1}, compile_cart(cart))
+
+    def test_atomic_carts(self):
+        """ Test method """
+        marketplace = Marketplace(2)
+        producer_id = marketplace.register_producer()
+        cart = [{'type': 'add', 'product': 'Cocoa', 'quantity': 2},
+                {'type': 'remove', 'product': 'Cocoa', 'quantity': 1},
+                {'type': 'add', 'product': 'Vanilla', 'quantity': 1}]
+        consumer = Consumer([cart], marketplace, 0.01, atomic_carts=True, name='cons1')
+        consumer.print_cart = lambda products: self.assertCountEqual(['Cocoa', 'Vanilla'],
+                                                                      products)
+        consumer.start()
+
+        # Check if the consumer holds nothing until the whole cart is in stock
+        marketplace.publish(producer_id, 'Cocoa')
+        time.sleep(0.05)
+        self.assertEqual(1, marketplace.stock('Cocoa'))
+        marketplace.publish(producer_id, 'Vanilla')
+        consumer.join(timeout=5)
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(2, len(consumer.wait_times))
+
+    def test_percentile(self):
+        """ Test method """
+        values = [0.1 * i for i in range(1, 101)]
+        # Check the nearest rank of the percentiles
+        self.assertAlmostEqual(5.1, percentile(values, 0.5))
+        self.assertAlmostEqual(10.0, percentile(values, 0.99))
+        self.assertEqual(0.0, percentile([], 0.99))
@@ -0,0 +1,289 @@
+"""
+This module represents the Dense Marketplace, an array-backed inventory engine.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from array import array
+from threading import Lock
+import argparse
+import tracemalloc
+import unittest
+
+from tema.marketplace import Marketplace
+
+
+class DenseMarketplace:
+    """
+    Class that implements the Marketplace API with dense integer ids. Every product gets an id
+    the first time it is published and keeps its stock in an array indexed by producer id, so
+    an update is an array write instead of several dictionary lookups. The calls are not
+    written in the text log.
+    """
+
+    def __init__(self, queue_size_per_producer):
+        """
+        Constructor
+
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: the maximum size of a queue associated with each producer
+        """
+        self.queue_size_per_producer = queue_size_per_producer
+        self.num_carts = 0
+        self.products_per_producer = array('i')
+        self.product_ids = {}       # {product : product id}
+        self.products = []          # [product], indexed by product id
+        self.stock = []             # [array('i') of quantities indexed by producer id]
+        self.sellers = []           # [array('i') stack of the producer ids with stock]
+        self.carts = {}             # {cart_id : {product id : array('i') of producer ids}}
+        self.lock_inventory = Lock()
+        self.lock_cart = Lock()
+
+    def register_producer(self):
+        """
+        Returns an id for the producer that calls this.
+        """
+        with self.lock_inventory:
+            producer_id = len(self.products_per_producer)
+            self.products_per_producer.append(0)
+
+        return producer_id
+
+    def product_id(self, product):
+        """ Returns the id of the product, assigning one if it is new. Needs lock_inventory. """
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            product_id = len(self.products)
+            self.products.append(product)
+            self.stock.append(array('i'))
+            self.sellers.append(array('i'))
+            self.product_ids[product] = product_id
+        return product_id
+
+    def add_product(self, producer_id, product_id):
+        """ Makes one unit of the product available. Needs lock_inventory. """
+        row = self.stock[product_id]
+        if producer_id >= len(row):
+            # Grow the row up to the producer, the new producers have no stock
+            row.extend(bytes(4 * (producer_id + 1 - len(row))))
+
+        row[producer_id] += 1
+        if row[producer_id] == 1:
+            self.sellers[product_id].append(producer_id)
+
+    def publish(self, producer_id, product):
+        """
+        Adds the product provided by the producer to the marketplace
+
+        :returns True or False. If the caller receives False, it should wait and then try again.
+        """
+        with self.lock_inventory:
+            if self.products_per_producer[producer_id] >= self.queue_size_per_producer:
+                return False
+
+            self.products_per_producer[producer_id] += 1
+            self.add_product(producer_id, self.product_id(product))
+
+        return True
+
+    def new_cart(self):
+        """
+        Creates a new cart for the consumer
+
+        :returns an int representing the cart_id
+        """
+        with self.lock_cart:
+            cart_id = self.num_carts
+            self.num_carts += 1
+
+        self.carts[cart_id] = {}
+        return cart_id
+
+    def add_to_cart(self, cart_id, product):
+        """
+        Adds a product to the given cart.
+
+        :returns True or False. If the caller receives False, it should wait and then try again
+        """
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            return False
+
+        with self.lock_inventory:
+            sellers = self.sellers[product_id]
+            if not sellers:
+                return False
+
+            # Take the unit from the last producer that got stock, without any scan
+            producer_id = sellers[-1]
+            row = self.stock[product_id]
+            row[producer_id] -= 1
+            if row[producer_id] == 0:
+                sellers.pop()
+
+        self.carts[cart_id].setdefault(product_id, array('i')).append(producer_id)
+        return True
+
+    def remove_from_cart(self, cart_id, product):
+        """
+        Removes a product from cart.
+        """
+        product_id = self.product_ids.get(product)
+        producers = self.carts[cart_id].get(product_id)
+        if not producers:
+            return
+
+        producer_id = producers.pop()
+        if not producers:
+            del self.carts[cart_id][product_id]
+
+        with self.lock_inventory:
+            self.add_product(producer_id, product_id)
+
+    def place_order(self, cart_id):
+        """
+        Return a list with all the products in the cart.
+        """
+        cart_list = []
+
+        with self.lock_inventory:
+            for product_id, producers in self.carts.pop(cart_id).items():
+                for producer_id in producers:
+                    self.products_per_producer[producer_id] -= 1
+                cart_list.extend([self.products[product_id]] * len(producers))
+
+        return cart_list
+
+    def stock_of(self, product, producer_id):
+        """ Returns the quantity of the product the producer has available. """
+        product_id = self.product_ids.get(product)
+        if product_id is None or producer_id >= len(self.stock[product_id]):
+            return 0
+        return self.stock[product_id][producer_id]
+
+
+def measure(fill):
+    """ Returns the number of bytes allocated by fill(). """
+    tracemalloc.start()
+    engine = fill()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del engine
+    return size
+
+
+def memory_report(num_products, num_producers):
+    """
+    Returns the number of bytes used by the dict engine (Marketplace) and by the dense
+    engine (DenseMarketplace) for num_products products, each one with one unit from every one
+    of the num_producers producers.
+    """
+    products = [f'product{i}' for i in range(num_products)]
+
+    def fill_dict():
+        marketplace = Marketplace(1)
+        for product in products:
+            marketplace.products[product] = {producer_id: 1
+                                             for producer_id in range(num_producers)}
+        return marketplace
+
+    def fill_dense():
+        marketplace = DenseMarketplace(1)
+        for product in products:
+            product_id = marketplace.product_id(product)
+            marketplace.stock[product_id].extend([1] * num_producers)
+            marketplace.sellers[product_id].extend(range(num_producers))
+        return marketplace
+
+    return measure(fill_dict), measure(fill_dense)
+
+
+def main():
+    """ Prints the memory used by both engines. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--producers', type=int, default=1000)
+    parser.add_argument('--sample-products', type=int, default=500,
+                        help='number of products measured, the rest is extrapolated')
+    args = parser.parse_args()
+
+    sample = min(args.sample_products, args.products)
+    with Marketplace.quiet_log():
+        dict_bytes, dense_bytes = memory_report(sample, args.producers)
+    scale = args.products / sample
+    entries = sample * args.producers
+
+    print(f'measured {sample} products x {args.producers} producers:')
+    print(f'  dict engine:  {dict_bytes / 2 ** 20:10.1f} MiB ({dict_bytes / entries:.1f} B/entry)')
+    print(f'  dense engine: {dense_bytes / 2 ** 20:10.1f} MiB '
+          f'({dense_bytes / entries:.1f} B/entry)')
+    print(f'extrapolated to {args.products} products x {args.producers} producers:')
+    print(f'  dict engine:  {dict_bytes * scale / 2 ** 30:10.2f} GiB')
+    print(f'  dense engine: {dense_bytes * scale / 2 ** 30:10.2f} GiB')
+
+
+class DenseMarketplaceTest(unittest.TestCase):
+    """ Dense Marketplace Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        self.marketplace = DenseMarketplace(5)
+
+    def test_publish(self):
+        """ Test method """
+        producer_id = self.marketplace.register_producer()
+
+        for i in range(5):
+            # Check if the method returns True (queue size limit)
+            self.assertTrue(self.marketplace.publish(producer_id, 'Cocoa'))
+            self.assertEqual(i + 1, self.marketplace.stock_of('Cocoa', producer_id))
+
+        # Check if the product has not been added (queue size limit has been reached)
+        self.assertFalse(self.marketplace.publish(producer_id, 'Cocoa'))
+        self.assertEqual(5, self.marketplace.products_per_producer[producer_id])
+
+    def test_add_to_cart(self):
+        """ Test method """
+        cart = self.marketplace.new_cart()
+        producer_id = self.marketplace.register_producer()
+        producer_id_new = self.marketplace.register_producer()
+
+        self.marketplace.publish(producer_id_new, 'Cocoa')
+        self.marketplace.publish(producer_id, 'Cocoa')
+        # Check if the products are taken from the last producer that got stock first
+        self.assertTrue(self.marketplace.add_to_cart(cart, 'Cocoa'))
+        self.assertEqual(0, self.marketplace.stock_of('Cocoa', producer_id))
+        self.assertTrue(self.marketplace.add_to_cart(cart, 'Cocoa'))
+        self.assertEqual(0, self.marketplace.stock_of('Cocoa', producer_id_new))
+        # Check if there is nothing left
+        self.assertFalse(self.marketplace.add_to_cart(cart, 'Cocoa'))
+        self.assertFalse(self.marketplace.add_to_cart(cart, 'None'))
+
+    def test_remove_and_place_order(self):
+        """ Test method """
+        cart = self.marketplace.new_cart()
+        producer_id = self.marketplace.register_producer()
+
+        self.marketplace.publish(producer_id, 'Cocoa')
+        self.marketplace.publish(producer_id, 'Vanilla')
+        self.marketplace.add_to_cart(cart, 'Cocoa')
+        self.marketplace.add_to_cart(cart, 'Vanilla')
+        self.marketplace.remove_from_cart(cart, 'Cocoa')
+        self.marketplace.remove_from_cart(cart, 'None')
+
+        # Check if the removed product is available again
+        self.assertEqual(1, self.marketplace.stock_of('Cocoa', producer_id))
+        self.assertEqual(['Vanilla'], self.marketplace.place_order(cart))
+        self.assertEqual(1, self.marketplace.products_per_producer[producer_id])
+        self.assertIsNone(self.marketplace.carts.get(cart))
+
+    def test_memory_report(self):
+        """ Test method """
+        dict_bytes, dense_bytes = memory_report(10, 100)
+        # Check if the dense engine is smaller
+        self.assertLess(dense_bytes, dict_bytes)
+
+
+if __name__ == '__main__':
+    main()
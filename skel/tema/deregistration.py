@@ -0,0 +1,100 @@
+"""
+This module represents the deregistration of the producers of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+
+class DeregistrationMixin:
+    """
+    Mixin of the Marketplace that removes the producers and gives their ids to new producers
+    once none of their products is left. The Marketplace provides the products and the
+    producers' queues.
+    """
+
+    def __init__(self):
+        """ Constructor """
+        # {producer_id : unsold products}, the unregistered producers with products in carts
+        self.retiring_producers = {}
+        self.free_producer_ids = []      # ids of the unregistered producers, to be reused
+
+    def reuse_producer_id(self):
+        """
+        Returns the id of an unregistered producer, its counter is back to 0, or None if there
+        is none. Must be called with lock_producer taken.
+        """
+        if self.free_producer_ids:
+            return self.free_producer_ids.pop()
+        return None
+
+    def unregister_producer(self, producer_id):
+        """
+        Removes the producer from the marketplace. Its products that are not in a cart are
+        returned, the ones in carts are still sold. The id is given to a new producer once none
+        of its products is left in the marketplace.
+
+        :type producer_id: Int
+        :param producer_id: producer id
+
+        :returns a list with the unsold products, the products of the producer removed from
+        carts later are appended to it
+        """
+        self.log('Method \'unregister_producer\' has params producer_id (int): %d', producer_id)
+
+        # Refuse the next products of the producer
+        unsold = []
+        with self.producer_locks[producer_id]:
+            if producer_id in self.retiring_producers or producer_id in self.free_producer_ids:
+                return []
+            self.retiring_producers[producer_id] = unsold
+
+        # The products published from now on see the producer retiring under the same lock
+        with self.lock_add_product:
+            for product in list(self.products):
+                quantity = self.products[product].pop(producer_id, 0)
+                if quantity == 0:
+                    continue
+
+                if not self.products[product]:
+                    del self.products[product]
+                self.update_stock(product, -quantity)
+                self.emit('unregister', producer_id, product=product, quantity=quantity)
+                unsold.extend([product] * quantity)
+
+        self.return_products(producer_id, len(unsold))
+
+        self.log('Method \'unregister_producer\' returns list: %s', unsold)
+        self.log_call('unregister_producer', producer_id, result=len(unsold))
+        return unsold
+
+    def return_products(self, producer_id, quantity):
+        """
+        Takes quantity products of the producer out of its queue. The id of an unregistered
+        producer is recycled once its queue is empty.
+        """
+        with self.producer_locks[producer_id]:
+            self.products_per_producer[producer_id] -= quantity
+            recycle = self.products_per_producer[producer_id] == 0 and \
+                producer_id in self.retiring_producers
+            if recycle:
+                del self.retiring_producers[producer_id]
+
+        if recycle:
+            # The next producer with the id starts without the history of this one
+            self.emit('recycle', producer_id)
+            if self.ledger is not None:
+                self.ledger.forget_producer(producer_id)
+            if self.admission is not None:
+                self.admission.forget_producer(producer_id)
+            with self.lock_producer:
+                self.free_producer_ids.append(producer_id)
+
+    def return_unsold(self, producer_id, product):
+        """ Gives a product of an unregistered producer, removed from a cart, back to it. """
+        # The release event of the product did not put it back on sale
+        self.emit('unregister', producer_id, product=product)
+        with self.producer_locks[producer_id]:
+            self.retiring_producers[producer_id].append(product)
+        self.return_products(producer_id, 1)
@@ -0,0 +1,61 @@
+"""
+This module represents the outputs of the Marketplace: its logs, change feed and sales ledger.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+
+class EventsMixin:
+    """
+    Mixin of the Marketplace that writes the text or the binary log and sends the events to
+    the optional change feed and sales ledger. The Marketplace provides the text logger.
+    """
+
+    def __init__(self, change_feed=None, ledger=None, binary_log=None):
+        """
+        Constructor
+
+        :type change_feed: ChangeFeed
+        :param change_feed: optional feed that receives the publish, reserve, release and
+        order events
+
+        :type ledger: SalesLedger
+        :param ledger: optional ledger that records the products sold at checkout
+
+        :type binary_log: BinaryLog
+        :param binary_log: optional binary log that replaces the text log
+        """
+        self.change_feed = change_feed
+        self.ledger = ledger
+        self.binary_log = binary_log
+
+    def log(self, message, *args):
+        """ Writes a line in the text log, unless the binary log is used. """
+        if self.binary_log is None:
+            self.logger.info(message, *args)
+
+    def log_call(self, method, id_arg=-1, product=None, result=-1):
+        """ Writes a record of a call that returned in the binary log, if it is used. """
+        if self.binary_log is not None:
+            self.binary_log.record(method, id_arg, product, result)
+
+    def emit(self, kind, producer_id, cart_id=None, product=None, quantity=1):
+        """ Sends an event to the change feed, if it is used. """
+        if self.change_feed is not None:
+            self.change_feed.emit(kind, producer_id, cart_id, product, quantity)
+
+    def record_order(self, cart_id, producer_id, product, quantity):
+        """ Sends the units of a product checked out from a cart to the feed and the ledger. """
+        self.emit('order', producer_id, cart_id, product, quantity)
+        if self.ledger is not None:
+            self.ledger.record(cart_id, producer_id, product, quantity)
+
+    def log_order(self, cart_id, cart_list):
+        """ Logs the products returned by place_order, one record per product in binary. """
+        self.log('Method \'place_order\' returns cart (list): %s', cart_list)
+        if self.binary_log is not None:
+            for product in cart_list:
+                self.binary_log.record('order_item', cart_id, product)
+        self.log_call('place_order', cart_id, result=len(cart_list))
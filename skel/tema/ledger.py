@@ -0,0 +1,267 @@
+"""
+This module represents the Sales Ledger of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from array import array
+from threading import Lock
+import time
+import unittest
+
+from tema.marketplace import Marketplace
+from tema.product import Coffee, Tea
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def aggregate(keys, weights, size=0):
+    """
+    Sums the weights of every key.
+
+    :type keys: array
+    :param keys: the non-negative integer keys
+
+    :type weights: array
+    :param weights: the values that are summed
+
+    :type size: Int
+    :param size: the minimum length of the result
+
+    :returns a list where the element i is the sum of the weights having the key i
+    """
+    if numpy is not None:
+        # Zero-copy views over the columns
+        return numpy.bincount(numpy.asarray(keys), numpy.asarray(weights),
+                              minlength=size).tolist()
+
+    sums = [0.0] * max(size, max(keys, default=-1) + 1)
+    for key, weight in zip(keys, weights):
+        sums[key] += weight
+    return sums
+
+
+def pair_keys(firsts, seconds):
+    """
+    Gives a dense key to every distinct (first, second) pair.
+
+    :type firsts: array
+    :param firsts: the first element of the pairs
+
+    :type seconds: array
+    :param seconds: the second element of the pairs
+
+    :returns the list of the distinct pairs and an array with the key of every pair, the index
+    of the pair in the list
+    """
+    if numpy is not None:
+        pairs, keys = numpy.unique(numpy.stack([numpy.asarray(firsts), numpy.asarray(seconds)]),
+                                   axis=1, return_inverse=True)
+        return [tuple(pair) for pair in pairs.T.tolist()], keys.ravel()
+
+    index = {}
+    keys = array('q', (index.setdefault(pair, len(index)) for pair in zip(firsts, seconds)))
+    return list(index), keys
+
+
+def time_buckets(timestamps, width):
+    """
+    Splits the timestamps in buckets of width seconds, the first one starting at the oldest
+    timestamp.
+
+    :returns the start of the first bucket and an array with the bucket of every timestamp
+    """
+    if numpy is not None:
+        timestamps = numpy.asarray(timestamps)
+        start = timestamps.min()
+        return float(start), numpy.floor_divide(timestamps - start, width).astype(numpy.int64)
+
+    start = min(timestamps)
+    return start, array('q', (int((timestamp - start) // width) for timestamp in timestamps))
+
+
+class SalesLedger:  # pylint: disable=too-many-instance-attributes
+    """
+    Class that represents an append-only columnar ledger of the sold products. Every checkout
+    appends one row per (product, producer) pair of the cart. The queries copy the rows they
+    read, a view over a column would make the next append fail while it is alive.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.cart_ids = array('q')
+        self.producer_ids = array('q')
+        self.product_ids = array('q')
+        self.quantities = array('q')
+        self.revenues = array('d')  # quantity * price
+        self.timestamps = array('d')
+        self.product_index = {}  # {product : product_id}, in the order of the ids
+        self.generations = array('q')  # the number of producers the id had before
+        self.producer_generations = {}  # {recycled producer_id : generation of its producer}
+        self.size = 0
+        self.lock = Lock()
+
+    def intern(self, product):
+        """ Returns the dense id of the product. """
+        product_id = self.product_index.get(product)
+        if product_id is None:
+            product_id = len(self.product_index)
+            self.product_index[product] = product_id
+        return product_id
+
+    def record(self, cart_id, producer_id, product, quantity, timestamp=None):
+        """
+        Appends a sale to the ledger.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :type producer_id: Int
+        :param producer_id: the producer that sold the product
+
+        :type product: Product
+        :param product: the product sold
+
+        :type quantity: Int
+        :param quantity: the number of units sold
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.lock:
+            self.cart_ids.append(cart_id)
+            self.producer_ids.append(producer_id)
+            self.generations.append(self.producer_generations.get(producer_id, 0))
+            self.product_ids.append(self.intern(product))
+            self.quantities.append(quantity)
+            self.revenues.append(quantity * getattr(product, 'price', 0))
+            self.timestamps.append(timestamp)
+            # Make the row visible to the queries only after every column has it
+            self.size += 1
+
+    def units_by_product(self):
+        """ Returns a dict {product : units sold}. """
+        size = self.size
+        units = aggregate(self.product_ids[:size], self.quantities[:size])
+        return {product: int(count)
+                for product, count in zip(list(self.product_index), units) if count > 0}
+
+    def revenue_by_product(self):
+        """ Returns a dict {product : revenue}. """
+        size = self.size
+        sums = aggregate(self.product_ids[:size], self.revenues[:size])
+        return {product: total
+                for product, total in zip(list(self.product_index), sums) if total > 0}
+
+    def forget_producer(self, producer_id):
+        """
+        Starts a new generation of the id, it is given to a new producer. The sales recorded so
+        far stay with the previous producer.
+        """
+        with self.lock:
+            self.producer_generations[producer_id] = \
+                self.producer_generations.get(producer_id, 0) + 1
+
+    def revenue_by_producer(self):
+        """
+        Returns a dict {(producer_id, generation) : revenue}, the generation being the number of
+        producers the id had before the one that sold.
+        """
+        size = self.size
+        if size == 0:
+            return {}
+
+        producers, keys = pair_keys(self.producer_ids[:size], self.generations[:size])
+        sums = aggregate(keys, self.revenues[:size])
+        return {producer: total for producer, total in zip(producers, sums) if total > 0}
+
+    def units_by_type(self):
+        """ Returns a dict {product type : units sold}, e.g. {'Coffee': 3, 'Tea': 2}. """
+        units = {}
+        # Aggregate the rows per product first, then only the distinct products per type
+        for product, count in self.units_by_product().items():
+            product_type = type(product).__name__
+            units[product_type] = units.get(product_type, 0) + count
+        return units
+
+    def revenue_by_time_bucket(self, width):
+        """
+        Returns a dict {bucket start timestamp : revenue}.
+
+        :type width: Time
+        :param width: the number of seconds of a bucket
+        """
+        size = self.size
+        if size == 0:
+            return {}
+
+        start, buckets = time_buckets(self.timestamps[:size], width)
+        sums = aggregate(buckets, self.revenues[:size])
+        return {start + i * width: total for i, total in enumerate(sums) if total > 0}
+
+
+class SalesLedgerTest(unittest.TestCase):
+    """ Sales Ledger Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        self.ledger = SalesLedger()
+        self.coffee = Coffee('Arabica', 10, 5.0, 'DARK')
+        self.tea = Tea('Linden', 9, 'Herbal')
+
+    def test_aggregations(self):
+        """ Test method """
+        self.ledger.record(0, 0, self.coffee, 2, 100.0)
+        self.ledger.record(0, 1, self.tea, 1, 100.5)
+        self.ledger.record(1, 1, self.coffee, 3, 102.0)
+
+        # Check every grouping
+        self.assertDictEqual({self.coffee: 5, self.tea: 1}, self.ledger.units_by_product())
+        self.assertDictEqual({(0, 0): 20.0, (1, 0): 39.0}, self.ledger.revenue_by_producer())
+        self.assertDictEqual({'Coffee': 5, 'Tea': 1}, self.ledger.units_by_type())
+        self.assertDictEqual({100.0: 29.0, 102.0: 30.0},
+                             self.ledger.revenue_by_time_bucket(1.0))
+
+    def test_recycled_producer(self):
+        """ Test method """
+        self.ledger.record(0, 0, self.coffee, 2, 100.0)
+        self.ledger.record(0, 1, self.tea, 1, 100.5)
+        self.ledger.forget_producer(0)
+        self.ledger.record(1, 0, self.coffee, 1, 101.0)
+
+        # Check if the new producer with the id does not get the sales of the previous one
+        revenues = self.ledger.revenue_by_producer()
+        self.assertDictEqual({(0, 0): 20.0, (1, 0): 9.0, (0, 1): 10.0}, revenues)
+        self.assertDictEqual({self.coffee: 3, self.tea: 1}, self.ledger.units_by_product())
+
+        # Check if no revenue is lost with the previous producer
+        self.assertEqual(sum(self.ledger.revenue_by_product().values()), sum(revenues.values()))
+
+    def test_empty(self):
+        """ Test method """
+        self.assertDictEqual({}, self.ledger.units_by_product())
+        self.assertDictEqual({}, self.ledger.revenue_by_producer())
+        self.assertDictEqual({}, self.ledger.revenue_by_time_bucket(1.0))
+
+    def test_marketplace_checkout(self):
+        """ Test method """
+        marketplace = Marketplace(5, ledger=self.ledger)
+        producer_id = marketplace.register_producer()
+        cart = marketplace.new_cart()
+        marketplace.publish(producer_id, self.coffee)
+        marketplace.publish(producer_id, self.coffee)
+        marketplace.publish(producer_id, self.tea)
+        marketplace.add_to_cart(cart, self.coffee)
+        marketplace.add_to_cart(cart, self.coffee)
+        marketplace.add_to_cart(cart, self.tea)
+        marketplace.place_order(cart)
+
+        # Check if one row is recorded per (product, producer) pair
+        self.assertEqual(2, self.ledger.size)
+        self.assertDictEqual({(producer_id, 0): 29.0}, self.ledger.revenue_by_producer())
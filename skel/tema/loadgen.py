@@ -0,0 +1,283 @@
+"""
+This module represents an open-loop load generator for the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from array import array
+from threading import Thread, Lock, Barrier
+import argparse
+import random
+import time
+import unittest
+
+from tema.marketplace import Marketplace
+from tema.stress import ENGINES
+
+# Weights of the requests issued by the generator
+MIX = {'publish': 4, 'add_to_cart': 4, 'place_order': 2}
+
+
+class Histogram:
+    """
+    Class that represents an HDR-style histogram of integer values (microseconds). The values
+    below 2 ** precision_bits have their own bucket, the larger ones share a bucket with the
+    values that have the same precision_bits most significant bits, so the relative error is
+    below 2 ** (1 - precision_bits) over the whole range and the size stays small.
+    """
+
+    def __init__(self, precision_bits=11, max_value=60 * 10 ** 6):
+        """
+        Constructor
+
+        :type precision_bits: Int
+        :param precision_bits: the number of significant bits kept, 11 gives 0.1% error
+
+        :type max_value: Int
+        :param max_value: the largest value recorded, the larger ones are clamped
+        """
+        self.precision_bits = precision_bits
+        self.half = 1 << (precision_bits - 1)
+        self.max_value = max_value
+        self.counts = array('q', bytes(8 * (self.index(max_value) + 1)))
+        self.count = 0
+        self.max = 0
+
+    def index(self, value):
+        """ Returns the bucket of the value. """
+        shift = max(0, value.bit_length() - self.precision_bits)
+        return (value >> shift) + shift * self.half
+
+    def highest_value(self, index):
+        """ Returns the largest value of the bucket. """
+        shift = max(0, index // self.half - 1)
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, value):
+        """ Adds a value. """
+        value = min(max(0, int(value)), self.max_value)
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """ Adds the values of another histogram with the same precision. """
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """ Returns the value below which the given fraction of the values fall. """
+        if self.count == 0:
+            return 0
+
+        rank = max(1, int(fraction * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.highest_value(index), self.max)
+        return self.max
+
+
+class LoadGenerator:
+    """
+    Class that issues requests against the marketplace at a fixed rate, from a schedule that
+    does not depend on the responses: the request i is due at start + i / rate, whether the
+    previous ones returned or not. The latency of a request is measured from the time it was
+    due, so the time a request waits for a free worker when the marketplace falls behind is
+    counted (no coordinated omission).
+    """
+
+    def __init__(self, marketplace, num_workers=64, num_kinds=16, mix=None, seed=0):
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the marketplace, or any object with its API
+
+        :type num_workers: Int
+        :param num_workers: the number of threads that send the requests, each one with its
+        own producer and cart
+
+        :type num_kinds: Int
+        :param num_kinds: the number of different products
+
+        :type mix: Dict
+        :param mix: the weight of every request {method : weight}, MIX by default
+        """
+        self.marketplace = marketplace
+        self.num_workers = num_workers
+        self.products = [f'product{i}' for i in range(num_kinds)]
+        self.mix = MIX if mix is None else mix
+        self.seed = seed
+        self.producers = [marketplace.register_producer() for _ in range(num_workers)]
+
+    def run(self, rate, duration):
+        """
+        Issues rate requests per second for duration seconds.
+
+        :returns a tuple (histogram of the latencies in microseconds, number of requests
+        completed per second, number of refused publish and add_to_cart requests)
+        """
+        num_requests = int(rate * duration)
+        barrier = Barrier(self.num_workers + 1)
+        lock = Lock()
+        next_request = [0]
+        histograms = [Histogram() for _ in range(self.num_workers)]
+        refused = [0] * self.num_workers
+        start = [0.0]
+        methods = list(self.mix)
+        weights = list(self.mix.values())
+
+        def work(index):
+            rng = random.Random(self.seed * self.num_workers + index)
+            producer_id = self.producers[index]
+            cart_id = self.marketplace.new_cart()
+            histogram = histograms[index]
+            barrier.wait()
+
+            while True:
+                with lock:
+                    request = next_request[0]
+                    next_request[0] += 1
+                if request >= num_requests:
+                    return
+
+                # Wait for the time the request is due, unless it is late already
+                intended = start[0] + request / rate
+                delay = intended - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                method = rng.choices(methods, weights)[0]
+                if method == 'publish':
+                    status = self.marketplace.publish(producer_id, rng.choice(self.products))
+                elif method == 'add_to_cart':
+                    status = self.marketplace.add_to_cart(cart_id, rng.choice(self.products))
+                else:
+                    self.marketplace.place_order(cart_id)
+                    cart_id = self.marketplace.new_cart()
+                    status = True
+
+                histogram.record((time.perf_counter() - intended) * 10 ** 6)
+                if not status:
+                    refused[index] += 1
+
+        threads = [Thread(target=work, args=(index,), daemon=True)
+                   for index in range(self.num_workers)]
+        for thread in threads:
+            thread.start()
+
+        start[0] = time.perf_counter()
+        barrier.wait()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start[0]
+
+        histogram = Histogram()
+        for worker_histogram in histograms:
+            histogram.merge(worker_histogram)
+        return histogram, histogram.count / elapsed, sum(refused)
+
+
+def sweep(generator, rates, duration, slo):
+    """
+    Runs the generator at every rate, in increasing order, and prints the latencies.
+
+    :type slo: Time
+    :param slo: the p99 latency in seconds above which the marketplace is saturated
+
+    :returns the highest rate that is sustained (95% of it completed, p99 within the slo), or
+    None if no rate is
+    """
+    sustained = None
+    print(f'{"target/s":>10} {"done/s":>10} {"refused":>8} {"p50 ms":>9} {"p99 ms":>9} '
+          f'{"p99.9 ms":>9} {"max ms":>9}')
+    for rate in sorted(rates):
+        histogram, throughput, refused = generator.run(rate, duration)
+        p99 = histogram.percentile(0.99) / 1000
+        print(f'{rate:10.0f} {throughput:10.0f} {refused:8} '
+              f'{histogram.percentile(0.5) / 1000:9.3f} {p99:9.3f} '
+              f'{histogram.percentile(0.999) / 1000:9.3f} {histogram.max / 1000:9.3f}')
+
+        if throughput < 0.95 * rate or p99 > slo * 1000:
+            break
+        sustained = rate
+
+    return sustained
+
+
+def main():
+    """ Sweeps the request rates and prints the saturation point of the marketplace. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='dict')
+    parser.add_argument('--rates', type=float, nargs='+',
+                        default=[1000, 2000, 5000, 10000, 20000, 50000, 100000])
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds of load at every rate')
+    parser.add_argument('--workers', type=int, default=64)
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--slo', type=float, default=0.01,
+                        help='p99 latency in seconds above which the marketplace is saturated')
+    args = parser.parse_args()
+
+    with Marketplace.quiet_log():
+        generator = LoadGenerator(ENGINES[args.engine](args.queue_size), args.workers)
+        sustained = sweep(generator, args.rates, args.duration, args.slo)
+        if sustained is None:
+            print('saturated at the lowest rate')
+        else:
+            print(f'sustained up to {sustained:.0f} requests/s')
+
+
+class LoadGeneratorTest(unittest.TestCase):
+    """ Load Generator Test class """
+    class SlowMarketplace(Marketplace):
+        """ Marketplace whose publish takes 10 ms, one call at a time. """
+        def __init__(self):
+            Marketplace.__init__(self, 1)
+            self.lock_slow = Lock()
+
+        def publish(self, producer_id, product):  # pylint: disable=unused-argument
+            """ Refuses every product after 10 ms. """
+            with self.lock_slow:
+                time.sleep(0.01)
+            return False
+
+    def test_histogram(self):
+        """ Test method """
+        histogram = Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+
+        # Check if the percentiles are within the precision
+        self.assertEqual(100000, histogram.count)
+        self.assertAlmostEqual(50000, histogram.percentile(0.5), delta=50)
+        self.assertAlmostEqual(99000, histogram.percentile(0.99), delta=100)
+        self.assertEqual(100000, histogram.percentile(1.0))
+        # Check if every bucket holds the values mapped to it
+        for value in (0, 2047, 2048, 2049, 4095, 4096, 10 ** 6):
+            index = histogram.index(value)
+            self.assertLessEqual(value, histogram.highest_value(index))
+            self.assertGreater(value, histogram.highest_value(index - 1))
+
+    def test_open_loop(self):
+        """ Test method """
+        with Marketplace.quiet_log():
+            generator = LoadGenerator(self.SlowMarketplace(), num_workers=4, mix={'publish': 1})
+            histogram, _, refused = generator.run(rate=200, duration=0.25)
+
+        # Check if the requests due while the marketplace was busy count their wait:
+        # 50 requests of 10 ms, one every 5 ms, the last one is due at 245 ms and done at 500 ms
+        self.assertEqual(50, histogram.count)
+        self.assertEqual(50, refused)
+        self.assertGreater(histogram.percentile(1.0), 200 * 1000)
+
+
+if __name__ == '__main__':
+    main()
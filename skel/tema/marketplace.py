@@ -7,14 +7,27 @@ March 2021
 """
 
 
-from threading import Lock
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, Thread
 import logging
+import os
+import tempfile
 import time
 import unittest
 from logging.handlers import RotatingFileHandler
 
+from tema.adaptive import AdaptiveQueuesMixin
+from tema.admission import AdmissionControl, AdmissionMixin
+from tema.child_process import PACKAGE_ROOT, start_python
+from tema.deregistration import DeregistrationMixin
+from tema.events import EventsMixin
+from tema.reservations import Backorder, ReservationsMixin
+from tema.stock import StockMixin
 
-class Marketplace:
+
+class Marketplace(EventsMixin, StockMixin, AdaptiveQueuesMixin, ReservationsMixin,
+                  DeregistrationMixin, AdmissionMixin):
     """
     Class that represents the Marketplace. It's the central part of the implementation.
     The producers and consumers use its methods concurrently.
@@ -32,23 +45,51 @@ class Marketplace:
     logging.Formatter.converter = time.gmtime
     logger.addHandler(handler)
 
-    def __init__(self, queue_size_per_producer):
+    @classmethod
+    @contextmanager
+    def quiet_log(cls):
+        """
+        Context manager that keeps only the warnings of the text log, so the benchmarks and
+        the tests measure the marketplace and not the log. The previous level is restored on
+        exit.
+        """
+        level = cls.logger.level
+        cls.logger.setLevel(logging.WARNING)
+        try:
+            yield
+        finally:
+            cls.logger.setLevel(level)
+
+    def __init__(self, queue_size_per_producer, *, change_feed=None, ledger=None,
+                 adapt_interval=None, inventory_budget=None, backorders=False,
+                 priority_aging=1.0, binary_log=None, shared_inventory=None, admission=None):
         """
         Constructor
 
         :type queue_size_per_producer: Int
         :param queue_size_per_producer: the maximum size of a queue associated with each producer
+
+        The other parameters are optional and passed to the mixins: change_feed, ledger and
+        binary_log to EventsMixin, adapt_interval and inventory_budget to AdaptiveQueuesMixin,
+        backorders and priority_aging to ReservationsMixin, shared_inventory to StockMixin and
+        admission to AdmissionMixin.
         """
+        EventsMixin.__init__(self, change_feed, ledger, binary_log)
+        StockMixin.__init__(self, shared_inventory)
+        AdaptiveQueuesMixin.__init__(self, adapt_interval, inventory_budget)
+        DeregistrationMixin.__init__(self)
+        AdmissionMixin.__init__(self, admission)
         self.queue_size_per_producer = queue_size_per_producer
         self.num_carts = 0
         self.num_producers = 0
         self.products_per_producer = []
+        self.producer_locks = []    # [lock of products_per_producer], one per producer
         self.carts = {}     # {cart_id : {product : [[producer_id, quantity]]}}
         self.products = {}  # {producer : {producer_id, quantity}}
-        self.lock_add_cart = Lock()
         self.lock_add_product = Lock()
         self.lock_producer = Lock()
         self.lock_cart = Lock()
+        ReservationsMixin.__init__(self, self.lock_add_product, backorders, priority_aging)
 
     def register_producer(self):
         """
@@ -56,21 +97,27 @@ class Marketplace:
         """
         # Does not let two threads have the same producer id
         with self.lock_producer:
-            producer_id = self.num_producers
-            self.num_producers += 1
+            producer_id = self.reuse_producer_id()
+            if producer_id is None:
+                producer_id = self.num_producers
+                self.num_producers += 1
+
+                # Create object counter for producer, before any thread can use the id
+                self.products_per_producer.append(0)
+                self.producer_locks.append(Lock())
 
-        # Create object counter for producer
-        self.products_per_producer.append(0)
+        # Create the adaptive queue of the producer
+        self.add_queue(producer_id)
 
-        self.logger.info(
-            'Method \'register producer\' returns int: %d', producer_id)
+        self.log('Method \'register producer\' returns int: %d', producer_id)
+        self.log_call('register_producer', result=producer_id)
         return producer_id
 
     def add_product(self, producer_id, product):
         """ Adds product to marketplace. """
-        self.logger.info(
-            'Method \'add_product\' has params producer_id (int): %d, product (object): %s',
-            producer_id, str(product))
+        self.log('Method \'add_product\' has params producer_id (int): %d, product (object): %s',
+                 producer_id, product)
+        self.log_call('add_product', producer_id, product)
 
         # Add product alongside the quantity each producer provides
         if self.products.get(product) is None:
@@ -83,6 +130,8 @@ class Marketplace:
             else:
                 self.products[product][producer_id] += 1
 
+        self.update_stock(product, 1)
+
     def publish(self, producer_id, product):
         """
         Adds the product provided by the producer to the marketplace
@@ -93,31 +142,54 @@ class Marketplace:
         :type product: Product
         :param product: the Product that will be published in the Marketplace
 
-        :returns True or False. If the caller receives False, it should wait and then try again.
+        :returns True or False (a falsy Rejection with admission control). If the caller
+        receives False, it should wait and then try again.
         """
-        self.logger.info(
-            'Method \'publish\' has params producer_id (int): %d, product (object): %s',
-            producer_id, str(product))
-
-        # Check if the maximum queue size has not been reached
-        if self.products_per_producer[producer_id] < self.queue_size_per_producer:
-            # Increment the count of objects the producer has
-            self.products_per_producer[producer_id] += 1
-
-            # Let only one thread add a product
-            with self.lock_add_product:
-                self.add_product(producer_id, product)
-
-            self.logger.info('Method \'publish\' returns bool: True')
-            return True
-
-        self.logger.info('Method \'publish\' returns bool: False')
-        return False
-
-    def new_cart(self):
+        self.log('Method \'publish\' has params producer_id (int): %d, product (object): %s',
+                 producer_id, product)
+
+        status = self.admit()
+        if status is None:
+            try:
+                # Check if the maximum queue size has not been reached and take a place in it
+                # at once, other threads can publish for the same producer
+                with self.producer_locks[producer_id]:
+                    published = \
+                        self.products_per_producer[producer_id] < self.queue_size(producer_id) \
+                        and producer_id not in self.retiring_producers
+                    if published:
+                        self.products_per_producer[producer_id] += 1
+
+                if published:
+                    self.emit('publish', producer_id, product=product)
+
+                    # Let only one thread add a product
+                    if self.release_product(producer_id, product):
+                        self.log('Method \'publish\' returns bool: True')
+                        self.log_call('publish', producer_id, product, True)
+                        return True
+
+                    # The producer has been unregistered since the check, the unit announced
+                    # by the publish event is not on sale
+                    self.emit('unregister', producer_id, product=product)
+                    self.return_products(producer_id, 1)
+            finally:
+                self.leave()
+
+            status = self.refuse_publish(producer_id)
+
+        self.log('Method \'publish\' returns bool: False')
+        self.log_call('publish', producer_id, product, False)
+        return status
+
+    def new_cart(self, priority=0):
         """
         Creates a new cart for the consumer
 
+        :type priority: Int
+        :param priority: the priority class of the cart, the carts of higher classes are
+        served first when they wait in the backorder queues for a product
+
         :returns an int representing the cart_id
         """
         # Does not let two threads have the same cart id
@@ -127,8 +199,11 @@ class Marketplace:
 
         # Initialize empty dictionary for the generated cart
         self.carts[cart_id] = {}
+        if priority != 0:
+            self.cart_priorities[cart_id] = priority
 
-        self.logger.info('Method \'new_cart\' returns int: %d', cart_id)
+        self.log('Method \'new_cart\' returns int: %d', cart_id)
+        self.log_call('new_cart', result=cart_id)
         return cart_id
 
     def add_to_cart(self, cart_id, product):
@@ -141,32 +216,75 @@ class Marketplace:
         :type product: Product
         :param product: the product to add to cart
 
-        :returns True or False. If the caller receives False, it should wait and then try again
+        :returns True or False (a falsy Rejection with admission control). If the caller
+        receives False, it should wait and then try again
         """
-        self.logger.info(
-            'Method \'add_to_cart\' has params cart_id (int): %d, product (object): %s',
-            cart_id, str(product))
+        self.log('Method \'add_to_cart\' has params cart_id (int): %d, product (object): %s',
+                 cart_id, product)
 
-        # Check if the product exists
-        if self.products.get(product) is None:
-            logging.info('Method \'add_to_cart\' returns bool: False')
-            return False
+        status = self.admit()
+        if status is None:
+            try:
+                producer_id = self.take_product(product)
+            finally:
+                self.leave()
+
+            if producer_id is None:
+                status = self.refuse_cart(cart_id, product)
+
+        if status is not None:
+            self.log('Method \'add_to_cart\' returns bool: False')
+            self.log_call('add_to_cart', cart_id, product, False)
+            return status
+
+        self.add_cart_entry(cart_id, product, producer_id)
+
+        self.log('Method \'add_to_cart\' returns bool: True')
+        self.log_call('add_to_cart', cart_id, product, True)
+        return True
+
+    def take_product(self, product):
+        """
+        Marks one unit of the product unavailable.
+
+        :returns the id of the producer of the unit or None if the product is not in stock
+        """
+        # Let only one thread change the products, the same lock as add_product
+        with self.lock_add_product:
+            # Check if the product exists
+            if self.products.get(product) is None:
+                return None
+
+            return self.take_unit(product)
 
-        # Let only one thread occupy a product
-        with self.lock_add_cart:
+    def take_unit(self, product):
+        """
+        Marks one unit of a product in stock unavailable. Must be called with lock_add_product
+        taken.
+
+        :returns the id of the producer of the unit
+        """
+        # Get the product from the first producer available
+        producer_id = next(iter(self.products[product]))
+        # Decrement the quantity of the required product that the producer has in the market
+        self.products[product][producer_id] -= 1
 
-            # Get the product from the first producer available
-            producer_id = next(iter(self.products[product]))
-            # Decrement the quantity of the required product that the producer has in the market
-            self.products[product][producer_id] -= 1
+        # If the producer's quantity reaches 0 -> remove him
+        if self.products[product][producer_id] == 0:
+            del self.products[product][producer_id]
 
-            # If the producer's quantity reaches 0 -> remove him
-            if self.products[product][producer_id] == 0:
-                del self.products[product][producer_id]
+        # If the product does not have any more producers -> remove it
+        if len(self.products[product]) == 0:
+            del self.products[product]
 
-            # If the product does not have any more producers -> remove it
-            if len(self.products[product]) == 0:
-                del self.products[product]
+        self.update_stock(product, -1)
+
+        return producer_id
+
+    def add_cart_entry(self, cart_id, product, producer_id):
+        """ Adds a unit of the product, provided by the producer, to the cart. """
+        # Count the sale for the adaptive queues
+        self.count_sale(producer_id)
 
         # Check if the cart already has the product
         if self.carts[cart_id].get(product) is None:
@@ -182,8 +300,7 @@ class Marketplace:
                 # The producer is not in the list -> add him as a provider and the quantity
                 self.carts[cart_id][product].append([producer_id, 1])
 
-        self.logger.info('Method \'add_to_cart\' returns bool: True')
-        return True
+        self.emit('reserve', producer_id, cart_id, product)
 
     def remove_from_cart(self, cart_id, product):
         """
@@ -195,9 +312,9 @@ class Marketplace:
         :type product: Product
         :param product: the product to remove from cart
         """
-        self.logger.info(
-            'Method \'remove_from_cart\' has params cart_id (int): %d, product (object): %s',
-            cart_id, str(product))
+        self.log('Method \'remove_from_cart\' has params cart_id (int): %d, product (object): %s',
+                 cart_id, product)
+        self.log_call('remove_from_cart', cart_id, product)
 
         # Check if the cart has the product
         if self.carts[cart_id].get(product) is None:
@@ -215,9 +332,12 @@ class Marketplace:
         if self.carts[cart_id][product] == []:
             del self.carts[cart_id][product]
 
-        # Let only one thread mark the product removed from the cart as available again
-        with self.lock_add_product:
-            self.add_product(producer_id, product)
+        self.emit('release', producer_id, cart_id, product)
+
+        # Let only one thread mark the product removed from the cart as available again, the
+        # product of an unregistered producer goes back to it
+        if not self.release_product(producer_id, product):
+            self.return_unsold(producer_id, product)
 
     def place_order(self, cart_id):
         """
@@ -226,25 +346,34 @@ class Marketplace:
         :type cart_id: Int
         :param cart_id: id cart
         """
-        self.logger.info(
-            'Method \'place_order\' has params cart_id (int): %d', cart_id)
+        self.log('Method \'place_order\' has params cart_id (int): %d', cart_id)
 
         cart_list = []
 
         # Iterate through the cart
         for product in self.carts[cart_id]:
             for producer in self.carts[cart_id][product]:
+                # Record the sale before the producer's id can be recycled
+                self.record_order(cart_id, producer[0], product, producer[1])
+
                 for _ in range(producer[1]):
+                    if self.admission is not None:
+                        self.admission.note_checkout(producer[0])
                     # Decrease the queue size of the producer
-                    self.products_per_producer[producer[0]] -= 1
+                    self.return_products(producer[0], 1)
                     # Add the product to the list
                     cart_list.append(product)
 
         # Delete the cart
         del self.carts[cart_id]
+        self.cart_priorities.pop(cart_id, None)
+        if self.admission is not None:
+            self.admission.cart_closed(cart_id)
 
-        self.logger.info(
-            'Method \'place_order\' returns cart (list): %s', str(cart_list))
+        # Periodically resize the producers' queues
+        self.count_order()
+
+        self.log_order(cart_id, cart_list)
         return cart_list
 
 
@@ -260,6 +389,14 @@ class MarketplaceTest(unittest.TestCase):
         self.assertEqual(0, self.marketplace.register_producer())
         self.assertEqual(1, self.marketplace.register_producer())
 
+    def test_quiet_log(self):
+        """ Test method """
+        with Marketplace.quiet_log():
+            self.assertFalse(Marketplace.logger.isEnabledFor(logging.INFO))
+            self.assertTrue(Marketplace.logger.isEnabledFor(logging.WARNING))
+        # Check if the previous level is restored
+        self.assertEqual(logging.INFO, Marketplace.logger.level)
+
     def test_add_product(self):
         """ Test method """
         self.marketplace.add_product(0, 'Chocolate')
@@ -426,3 +563,248 @@ class MarketplaceTest(unittest.TestCase):
         # Check if the products were completely removed
         self.assertIsNone(self.marketplace.products.get('Cocoa'))
         self.assertIsNone(self.marketplace.products.get('Vanilla'))
+
+    def test_stock_queries(self):
+        """ Test method """
+        cart = self.marketplace.new_cart()
+        producer_id = self.marketplace.register_producer()
+        producer_id_new = self.marketplace.register_producer()
+        snapshot = self.marketplace.inventory_snapshot()
+
+        self.marketplace.publish(producer_id, 'Cocoa')
+        self.marketplace.publish(producer_id_new, 'Cocoa')
+        self.marketplace.publish(producer_id, 'Vanilla')
+        # Check if the quantities are summed over the producers
+        self.assertEqual(2, self.marketplace.stock('Cocoa'))
+        self.assertDictEqual({'Cocoa': 2, 'Vanilla': 1},
+                             dict(self.marketplace.inventory_snapshot()))
+        # Check if an older snapshot is not altered
+        self.assertDictEqual({}, dict(snapshot))
+
+        self.marketplace.add_to_cart(cart, 'Vanilla')
+        self.marketplace.add_to_cart(cart, 'Cocoa')
+        self.marketplace.remove_from_cart(cart, 'Cocoa')
+        # Check if the reserved products are not available
+        self.assertEqual(0, self.marketplace.stock('Vanilla'))
+        self.assertEqual(['Cocoa'], self.marketplace.available_products())
+        # Check if the snapshot is reused while nothing changes
+        self.assertIs(self.marketplace.inventory_snapshot(),
+                      self.marketplace.inventory_snapshot())
+
+    def test_unregister_producer(self):
+        """ Test method """
+        cart = self.marketplace.new_cart()
+        producer_id = self.marketplace.register_producer()
+        self.marketplace.publish(producer_id, 'Cocoa')
+        self.marketplace.publish(producer_id, 'Cocoa')
+        self.marketplace.publish(producer_id, 'Vanilla')
+        self.marketplace.add_to_cart(cart, 'Cocoa')
+        self.marketplace.add_to_cart(cart, 'Vanilla')
+
+        # Check if the unsold products are returned and the next ones refused
+        unsold = self.marketplace.unregister_producer(producer_id)
+        self.assertEqual(['Cocoa'], unsold)
+        self.assertEqual(0, self.marketplace.stock('Cocoa'))
+        self.assertFalse(self.marketplace.publish(producer_id, 'Cocoa'))
+        # Check if a product that passed the check is not stocked after the products are taken
+        self.assertFalse(self.marketplace.release_product(producer_id, 'Cocoa'))
+        self.assertEqual(0, self.marketplace.stock('Cocoa'))
+        # Check if the id is reused only once its products in carts are gone
+        self.assertEqual(1, self.marketplace.register_producer())
+        self.marketplace.remove_from_cart(cart, 'Cocoa')
+        self.assertEqual(0, self.marketplace.stock('Cocoa'))
+        self.assertEqual(['Cocoa', 'Cocoa'], unsold)
+        self.assertEqual(['Vanilla'], self.marketplace.place_order(cart))
+        self.assertEqual(producer_id, self.marketplace.register_producer())
+        self.assertEqual([0, 0], self.marketplace.products_per_producer)
+        self.assertTrue(self.marketplace.publish(producer_id, 'Cocoa'))
+
+    def test_reserve_all(self):
+        """ Test method """
+        cart = self.marketplace.new_cart()
+        producer_id = self.marketplace.register_producer()
+        self.marketplace.publish(producer_id, 'Cocoa')
+        self.marketplace.publish(producer_id, 'Cocoa')
+
+        # Check if nothing is reserved while one of the products is missing
+        self.assertFalse(self.marketplace.reserve_all(cart, {'Cocoa': 2, 'Vanilla': 1}))
+        self.assertEqual(2, self.marketplace.stock('Cocoa'))
+        self.assertFalse(self.marketplace.reserve_all(cart, {'Cocoa': 2, 'Vanilla': 1},
+                                                      wait=True, timeout=0.01))
+
+        # Check if a waiting reservation takes everything once the last product is published
+        publisher = Thread(target=self.marketplace.publish, args=(producer_id, 'Vanilla'))
+        publisher.start()
+        self.assertTrue(self.marketplace.reserve_all(cart, {'Cocoa': 2, 'Vanilla': 1},
+                                                     wait=True, timeout=5))
+        publisher.join()
+        self.assertEqual(0, self.marketplace.stock('Cocoa'))
+        self.assertCountEqual(['Cocoa', 'Cocoa', 'Vanilla'], self.marketplace.place_order(cart))
+
+    def test_backorders(self):
+        """ Test method """
+        marketplace = Marketplace(5, backorders=True)
+        producer_id = marketplace.register_producer()
+        first_cart = marketplace.new_cart()
+        second_cart = marketplace.new_cart()
+
+        # Check if a cart gives up once the timeout expires
+        self.assertFalse(marketplace.reserve(first_cart, 'Cocoa', timeout=0.01))
+        self.assertDictEqual({}, marketplace.backorder_queues)
+
+        # Check if the waiting carts are served in FIFO order
+        waiters = [Thread(target=marketplace.reserve, args=(cart, 'Cocoa'))
+                   for cart in (first_cart, second_cart)]
+        for waiter in waiters:
+            waiter.start()
+            while len(marketplace.backorder_queues.get('Cocoa', [])) < waiters.index(waiter) + 1:
+                time.sleep(0.001)
+
+        marketplace.publish(producer_id, 'Cocoa')
+        waiters[0].join()
+        self.assertDictEqual({'Cocoa': [[producer_id, 1]]}, marketplace.carts[first_cart])
+        # Check if the product went directly to the cart, not through the inventory
+        self.assertIsNone(marketplace.products.get('Cocoa'))
+
+        marketplace.remove_from_cart(first_cart, 'Cocoa')
+        waiters[1].join()
+        self.assertDictEqual({}, marketplace.carts[first_cart])
+        self.assertDictEqual({'Cocoa': [[producer_id, 1]]}, marketplace.carts[second_cart])
+        self.assertEqual(['Cocoa'], marketplace.place_order(second_cart))
+        self.assertEqual([0], marketplace.products_per_producer)
+
+    def test_retiring_backorders(self):
+        """ Test method """
+        marketplace = Marketplace(5, backorders=True)
+        producer_id = marketplace.register_producer()
+        holding_cart = marketplace.new_cart()
+        marketplace.publish(producer_id, 'Vanilla')
+        marketplace.add_to_cart(holding_cart, 'Vanilla')
+        marketplace.unregister_producer(producer_id)
+        backorder = Backorder(marketplace.new_cart())
+        marketplace.backorder_queues['Cocoa'] = deque([backorder])
+
+        # Check if a unit of a retiring producer is not handed to a waiting cart
+        self.assertFalse(marketplace.release_product(producer_id, 'Cocoa'))
+        self.assertFalse(backorder.event.is_set())
+        self.assertEqual([backorder], list(marketplace.backorder_queues['Cocoa']))
+
+    def test_backorder_priorities(self):
+        """ Test method """
+        marketplace = Marketplace(5, backorders=True, priority_aging=0.05)
+        low_cart = marketplace.new_cart()
+        high_cart = marketplace.new_cart(priority=1)
+        waiting = deque([Backorder(low_cart), Backorder(high_cart, 1)])
+
+        # Check if the higher class is served first, even if it arrived later
+        self.assertEqual(high_cart, marketplace.next_backorder(waiting).cart_id)
+        # Check if a lower class that waited long enough is not starved
+        waiting[0].created -= 0.1
+        self.assertEqual(low_cart, marketplace.next_backorder(waiting).cart_id)
+
+        marketplace.place_order(high_cart)
+        self.assertDictEqual({}, marketplace.cart_priorities)
+        # Check if a cart can not wait forever in the lowest class
+        with self.assertRaises(ValueError):
+            Marketplace(5, backorders=True, priority_aging=0)
+
+    def test_adaptive_queue_sizes(self):
+        """ Test method """
+        marketplace = Marketplace(5, adapt_interval=1)
+        fast_producer = marketplace.register_producer()
+        slow_producer = marketplace.register_producer()
+        # Check if the budget is split equally without sales
+        self.assertEqual([5, 5], marketplace.queue_sizes())
+
+        for _ in range(4):
+            marketplace.publish(fast_producer, 'Cocoa')
+        marketplace.publish(slow_producer, 'Vanilla')
+        cart = marketplace.new_cart()
+        for _ in range(4):
+            marketplace.add_to_cart(cart, 'Cocoa')
+        marketplace.place_order(cart)
+
+        # Check if the producer that sells more gets a larger queue within the same budget
+        limits = marketplace.queue_sizes()
+        self.assertEqual([7, 3], limits)
+        self.assertLessEqual(sum(limits), 10)
+        # Check if the slow producer keeps a minimum share on top of its queued product
+        self.assertTrue(marketplace.publish(slow_producer, 'Vanilla'))
+        self.assertTrue(marketplace.publish(slow_producer, 'Vanilla'))
+        self.assertFalse(marketplace.publish(slow_producer, 'Vanilla'))
+
+    def test_adaptive_floor(self):
+        """ Test method """
+        marketplace = Marketplace(4, adapt_interval=1)
+        held_producer = marketplace.register_producer()
+        busy_producer = marketplace.register_producer()
+        for _ in range(4):
+            marketplace.publish(held_producer, 'Cocoa')
+        held_cart = marketplace.new_cart()
+        for _ in range(4):
+            marketplace.add_to_cart(held_cart, 'Cocoa')
+
+        for _ in range(10):
+            marketplace.publish(busy_producer, 'Vanilla')
+            cart = marketplace.new_cart()
+            marketplace.add_to_cart(cart, 'Vanilla')
+            marketplace.place_order(cart)
+
+        # Check if the units held in an unfinished cart stay within the producer's queue and
+        # the busy producer does not take the whole budget
+        limits = marketplace.queue_sizes()
+        self.assertEqual(4 + 2, limits[held_producer])
+        self.assertLessEqual(limits[busy_producer], 8)
+        self.assertTrue(marketplace.publish(held_producer, 'Cocoa'))
+
+    def test_adaptive_scenario(self):
+        """ Test method """
+        with tempfile.TemporaryDirectory() as run_dir:
+            # Scenario 07 used to livelock when a producer's queue shrank under its held units
+            process = start_python([os.path.join(PACKAGE_ROOT, 'test.py'),
+                                    os.path.join(PACKAGE_ROOT, 'tests', '07.in'),
+                                    '--adaptive-queues'], run_dir)
+            try:
+                output, _ = process.communicate(timeout=40)
+            finally:
+                process.kill()
+                process.wait()
+        self.assertEqual(0, process.returncode)
+        with open(os.path.join(PACKAGE_ROOT, 'tests', '07.ref.out'),
+                  encoding='utf-8') as ref_file:
+            expected = ref_file.read().splitlines()
+
+        # Check if every consumer bought its products, in any order (as check_test.py does)
+        bought = sorted(line.strip() + ')' for line in output.split(')') if line.strip())
+        self.assertEqual(expected, bought)
+
+    def test_adaptive_registration(self):
+        """ Test method """
+        marketplace = Marketplace(5, adapt_interval=1)
+        registrations = [Thread(target=marketplace.register_producer) for _ in range(16)]
+        for registration in registrations:
+            registration.start()
+        for registration in registrations:
+            registration.join()
+
+        # Check if every producer has a queue, whatever the order the threads got there in
+        self.assertEqual(16, len(marketplace.queue_sizes()))
+        for producer_id in range(16):
+            self.assertTrue(marketplace.publish(producer_id, 'Cocoa'))
+
+    def test_admission(self):
+        """ Test method """
+        marketplace = Marketplace(1, admission=AdmissionControl(default_retry_after=0.05))
+        producer_id = marketplace.register_producer()
+        cart = marketplace.new_cart()
+
+        # Check if the refused calls return falsy rejections with their reason
+        self.assertTrue(marketplace.publish(producer_id, 'Cocoa'))
+        rejection = marketplace.publish(producer_id, 'Cocoa')
+        self.assertFalse(rejection)
+        self.assertEqual('queue full', rejection.reason)
+        self.assertEqual('out of stock', marketplace.add_to_cart(cart, 'Vanilla').reason)
+        self.assertTrue(marketplace.add_to_cart(cart, 'Cocoa'))
+        # Check if the checkout frees the queue of the producer
+        marketplace.place_order(cart)
+        self.assertTrue(marketplace.publish(producer_id, 'Cocoa'))
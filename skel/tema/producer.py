@@ -6,8 +6,9 @@ Assignment 1
 March 2021
 """
 
-from threading import Thread
-import time
+from threading import Thread, Event
+
+from tema.admission import retry_delay
 
 
 class Producer(Thread):
@@ -37,12 +38,18 @@ class Producer(Thread):
         self.marketplace = marketplace
         self.republish_wait_time = republish_wait_time
         self.kwargs = kwargs
+        self.stopped = Event()
+        self.unsold = []    # products returned by the marketplace when the producer stops
+
+    def stop(self):
+        """ Makes the producer unregister from the marketplace and finish. """
+        self.stopped.set()
 
     def run(self):
         # Generate producer ID
         producer_id = self.marketplace.register_producer()
 
-        while True:
+        while not self.stopped.is_set():
             for product in self.products:
                 current_quantity_added = 0
                 prod_name = product[0]
@@ -50,12 +57,14 @@ class Producer(Thread):
                 prod_wait_time = product[2]
 
                 # Publish as many products as needed
-                while current_quantity_added < prod_quantity:
+                while current_quantity_added < prod_quantity and not self.stopped.is_set():
                     status = self.marketplace.publish(producer_id, prod_name)
-                    if status is False:
-                        # Retry again in a few moments
-                        time.sleep(self.republish_wait_time)
+                    if not status:
+                        # Retry again when the marketplace expects to have room
+                        self.stopped.wait(retry_delay(status, self.republish_wait_time))
                     else:
                         # Produce the product and increment the counter
-                        time.sleep(prod_wait_time)
+                        self.stopped.wait(prod_wait_time)
                         current_quantity_added += 1
+
+        self.unsold = self.marketplace.unregister_producer(producer_id)
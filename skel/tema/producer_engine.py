@@ -0,0 +1,188 @@
+"""
+This module represents the Producer Engine.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from dataclasses import dataclass
+from heapq import heappush, heappop
+from threading import Thread, Condition
+import time
+import unittest
+
+from tema.admission import retry_delay
+from tema.marketplace import Marketplace
+
+
+@dataclass(init=True, repr=True, order=False)
+class ProducerSchedule:
+    """
+    Class that represents the publishing state of one producer.
+    """
+    producer_id: int
+    products: list
+    republish_wait_time: float
+    product_index: int = 0
+    quantity_added: int = 0
+
+
+class ProducerEngine(Thread):
+    """
+    Class that drives every registered producer from a single thread. Each producer has
+    a deadline for its next publish, the deadlines are kept in a heap and the engine
+    always serves the earliest one.
+    """
+
+    def __init__(self, marketplace, **kwargs):
+        """
+        Constructor.
+
+        :type marketplace: Marketplace
+        :param marketplace: a reference to the marketplace
+
+        :type kwargs:
+        :param kwargs: other arguments that are passed to the Thread's __init__()
+        """
+        Thread.__init__(self, **kwargs)
+        self.marketplace = marketplace
+        self.schedules = []     # [(deadline, sequence, ProducerSchedule)]
+        self.sequence = 0
+        self.stopped = False
+        self.condition = Condition()
+
+    def add_producer(self, products, republish_wait_time):
+        """
+        Registers a producer in the marketplace and schedules its first publish.
+
+        :type products: List
+        :param products: a list of (product, quantity, wait_time) that the producer will produce
+
+        :type republish_wait_time: Time
+        :param republish_wait_time: the number of seconds that a producer must
+        wait until the marketplace becomes available
+
+        :returns an int representing the producer_id
+        """
+        producer_id = self.marketplace.register_producer()
+
+        # A producer without products never publishes
+        if len(products) == 0:
+            return producer_id
+
+        schedule = ProducerSchedule(producer_id, list(products), republish_wait_time)
+        self.push(time.monotonic(), schedule)
+
+        return producer_id
+
+    def push(self, deadline, schedule):
+        """ Adds the schedule in the heap and wakes up the engine. """
+        with self.condition:
+            heappush(self.schedules, (deadline, self.sequence, schedule))
+            self.sequence += 1
+            self.condition.notify()
+
+    def pop(self):
+        """ Waits until the earliest deadline expires and returns its schedule. """
+        with self.condition:
+            while not self.stopped:
+                now = time.monotonic()
+                if self.schedules and self.schedules[0][0] <= now:
+                    return heappop(self.schedules)[2]
+
+                # Sleep until the earliest deadline or until a new producer arrives
+                timeout = self.schedules[0][0] - now if self.schedules else None
+                self.condition.wait(timeout)
+
+        return None
+
+    def publish(self, schedule):
+        """
+        Publishes the next product of the producer and returns the deadline of the
+        following publish.
+        """
+        prod_name, prod_quantity, prod_wait_time = schedule.products[schedule.product_index]
+
+        status = self.marketplace.publish(schedule.producer_id, prod_name)
+        if not status:
+            # Retry again when the marketplace expects to have room
+            return time.monotonic() + retry_delay(status, schedule.republish_wait_time)
+
+        # Move to the next product once the current quantity has been published
+        schedule.quantity_added += 1
+        if schedule.quantity_added >= prod_quantity:
+            schedule.quantity_added = 0
+            schedule.product_index = (schedule.product_index + 1) % len(schedule.products)
+
+        # Produce the product
+        return time.monotonic() + prod_wait_time
+
+    def stop(self):
+        """ Stops the engine, the producers' schedules are discarded. """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            schedule = self.pop()
+            if schedule is None:
+                return
+
+            self.push(self.publish(schedule), schedule)
+
+
+class ProducerEngineTest(unittest.TestCase):
+    """ Producer Engine Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        self.marketplace = Marketplace(3)
+        self.engine = ProducerEngine(self.marketplace, daemon=True)
+
+    def tearDown(self):
+        """ Stops the engine. """
+        self.engine.stop()
+
+    def test_add_producer(self):
+        """ Test method """
+        # Check the IDs of the producers
+        self.assertEqual(0, self.engine.add_producer([('Cocoa', 1, 0)], 0))
+        self.assertEqual(1, self.engine.add_producer([], 0))
+        # Check that only producers with products are scheduled
+        self.assertEqual(1, len(self.engine.schedules))
+
+    def test_publish_schedule(self):
+        """ Test method """
+        producer_id = self.engine.add_producer([('Cocoa', 2, 0), ('Vanilla', 1, 0)], 0)
+        schedule = self.engine.schedules[0][2]
+
+        for _ in range(3):
+            self.engine.publish(schedule)
+        # Check that the quantities of every product are honored
+        self.assertDictEqual({producer_id: 2}, self.marketplace.products['Cocoa'])
+        self.assertDictEqual({producer_id: 1}, self.marketplace.products['Vanilla'])
+        self.assertEqual(0, schedule.product_index)
+
+    def test_republish_backoff(self):
+        """ Test method """
+        self.engine.add_producer([('Cocoa', 5, 0)], 10)
+        schedule = self.engine.schedules[0][2]
+
+        for _ in range(3):
+            self.engine.publish(schedule)
+        # Check that a full queue delays the producer by republish_wait_time
+        self.assertGreater(self.engine.publish(schedule), time.monotonic() + 5)
+        self.assertEqual(3, self.marketplace.products_per_producer[0])
+
+    def test_run(self):
+        """ Test method """
+        for _ in range(10):
+            self.engine.add_producer([('Cocoa', 1, 0)], 0.01)
+        self.engine.start()
+
+        # Every producer fills its queue from the single engine thread
+        deadline = time.monotonic() + 5
+        while sum(self.marketplace.products_per_producer) < 30 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([3] * 10, self.marketplace.products_per_producer)
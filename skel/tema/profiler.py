@@ -0,0 +1,147 @@
+"""
+This module represents a sampling profiler for the threads of a scenario run.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from threading import Thread, Event
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+
+def frame_label(frame):
+    """ Returns the name of the function of the frame, e.g. 'publish (marketplace.py:160)'. """
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler(Thread):
+    """
+    Class that represents a thread which periodically samples the stacks of all the other
+    threads. The samples are aggregated as collapsed stacks (one line per distinct stack, rooted
+    at the thread name), the format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        Constructor
+
+        :type interval: Time
+        :param interval: the number of seconds between two samples
+        """
+        Thread.__init__(self, name='profiler', daemon=True)
+        self.interval = interval
+        self.stacks = {}    # {(thread name, frame label, ...) : samples}
+        self.num_samples = 0
+        self.stopped = Event()
+
+    def sample(self):
+        """ Records the current stack of every thread but the profiler. """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident == self.ident:
+                continue
+
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, str(ident)))
+            stack = tuple(reversed(labels))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+        self.num_samples += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        """ Stops sampling and waits for the profiler thread. """
+        self.stopped.set()
+        self.join()
+
+    def collapsed(self):
+        """ Returns the lines 'thread;outer;...;inner samples', the most sampled first. """
+        return [f'{";".join(stack)} {count}'
+                for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1])]
+
+    def summary(self):
+        """
+        Returns a list of (function, self samples, total samples), the most expensive first.
+        A function is counted once per stack in its total, even when it is recursive.
+        """
+        own = {}
+        total = {}
+        for stack, count in self.stacks.items():
+            functions = stack[1:]
+            own[functions[-1]] = own.get(functions[-1], 0) + count
+            for function in set(functions):
+                total[function] = total.get(function, 0) + count
+
+        return sorted(((function, own.get(function, 0), count)
+                       for function, count in total.items()),
+                      key=lambda row: (-row[1], -row[2]))
+
+    def write(self, prefix):
+        """ Writes the collapsed stacks to PREFIX.collapsed and the summary to PREFIX.txt. """
+        with open(prefix + '.collapsed', 'w', encoding='utf-8') as collapsed_file:
+            for line in self.collapsed():
+                collapsed_file.write(line + '\n')
+
+        with open(prefix + '.txt', 'w', encoding='utf-8') as summary_file:
+            summary_file.write(f'{self.num_samples} samples every {self.interval * 1000:g} ms\n')
+            summary_file.write(f'{"self":>8} {"total":>8}  function\n')
+            for function, own, count in self.summary():
+                summary_file.write(f'{own:8} {count:8}  {function}\n')
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    """ Sampling Profiler Test class """
+    def test_sample(self):
+        """ Test method """
+        stopped = Event()
+
+        def busy():
+            while not stopped.is_set():
+                sum(range(100))
+
+        thread = Thread(target=busy, name='worker')
+        profiler = SamplingProfiler(interval=0.001)
+        thread.start()
+        profiler.start()
+        time.sleep(0.05)
+        profiler.stop()
+        stopped.set()
+        thread.join()
+
+        # Check if the stacks of the worker are rooted at its name and end in its function
+        worker_stacks = [stack for stack in profiler.stacks if stack[0] == 'worker']
+        self.assertTrue(worker_stacks)
+        self.assertTrue(all('busy' in ' '.join(stack) for stack in worker_stacks))
+        # Check if the profiler never samples itself
+        self.assertFalse([stack for stack in profiler.stacks if stack[0] == 'profiler'])
+
+    def test_write(self):
+        """ Test method """
+        profiler = SamplingProfiler()
+        profiler.stacks = {('worker', 'run (a.py:1)', 'work (a.py:5)'): 3,
+                           ('worker', 'run (a.py:1)'): 1}
+        profiler.num_samples = 4
+
+        # Check the self and total samples of every function
+        self.assertEqual([('work (a.py:5)', 3, 3), ('run (a.py:1)', 1, 4)], profiler.summary())
+
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, 'profile')
+            profiler.write(prefix)
+            with open(prefix + '.collapsed', encoding='utf-8') as collapsed_file:
+                self.assertEqual(['worker;run (a.py:1);work (a.py:5) 3', 'worker;run (a.py:1) 1'],
+                                 collapsed_file.read().splitlines())
@@ -0,0 +1,207 @@
+"""
+This module represents the reservations and the backorders of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Lock, Event, Condition
+import time
+
+
+@dataclass(init=True, repr=True, order=False)
+class Backorder:
+    """
+    Class that represents a cart waiting for a product that is not in stock.
+    """
+    cart_id: int
+    priority: int = 0
+    producer_id: int = None
+    created: float = field(default_factory=time.monotonic)
+    event: Event = field(default_factory=Event)
+
+
+class ReservationsMixin:
+    """
+    Mixin of the Marketplace that reserves several products at once and, with backorders,
+    queues the carts that wait for a product. The Marketplace provides the products, the
+    carts and the methods that take a unit and add it to a cart.
+    """
+
+    def __init__(self, lock_add_product, backorders=False, priority_aging=1.0):
+        """
+        Constructor
+
+        :type lock_add_product: Lock
+        :param lock_add_product: the lock of the products, woken up when one is added
+
+        :type backorders: Bool
+        :param backorders: True to queue the carts that wait for a product and hand the
+        product directly to the oldest one when it becomes available
+
+        :type priority_aging: Time
+        :param priority_aging: the number of seconds after which a waiting cart is served as if
+        it had one more priority class, so the lower classes are not starved
+
+        :raises ValueError: if priority_aging is not positive
+        """
+        if priority_aging <= 0:
+            raise ValueError(f'priority_aging must be positive, got {priority_aging}')
+
+        self.backorders = backorders
+        self.backorder_queues = {}  # {product : deque([Backorder])}
+        self.cart_priorities = {}   # {cart_id : priority}, only for carts with a priority
+        self.priority_aging = priority_aging
+        self.lock_backorder = Lock()
+        self.stock_changed = Condition(lock_add_product)
+
+    def reserve_all(self, cart_id, quantities, wait=False, timeout=None):
+        """
+        Adds all the products to the given cart or none of them. The units are taken in one
+        step under the products' lock, so a cart never holds a part of what it needs while it
+        waits for the rest.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :type quantities: Dict
+        :param quantities: {product : quantity}, the net quantities of the cart
+
+        :type wait: Bool
+        :param wait: True to wait until all the products are in stock
+
+        :type timeout: Time
+        :param timeout: the maximum number of seconds to wait, None waits forever
+
+        :returns True or False if the products are not in stock (or the timeout expired)
+        """
+        self.log('Method \'reserve_all\' has params cart_id (int): %d, quantities (dict): %s',
+                 cart_id, quantities)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        units = []
+        with self.stock_changed:
+            while any(self.stock_counts.get(product, 0) < quantity
+                      for product, quantity in quantities.items()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not wait or (remaining is not None and remaining <= 0):
+                    self.log('Method \'reserve_all\' returns bool: False')
+                    return False
+
+                # Woken up by every product added to the marketplace
+                self.stock_changed.wait(remaining)
+
+            for product, quantity in quantities.items():
+                for _ in range(quantity):
+                    units.append((product, self.take_unit(product)))
+
+        for product, producer_id in units:
+            self.add_cart_entry(cart_id, product, producer_id)
+            # The binary log has no record for a reservation, it is recorded unit by unit
+            self.log_call('add_to_cart', cart_id, product, True)
+
+        self.log('Method \'reserve_all\' returns bool: True')
+        return True
+
+    def reserve(self, cart_id, product, timeout=None):
+        """
+        Adds a product to the given cart, waiting for it if it is not in stock. The waiting
+        carts are served by priority class and then in FIFO order, the products published or
+        removed from other carts are handed directly to them.
+
+        :type cart_id: Int
+        :param cart_id: id cart
+
+        :type product: Product
+        :param product: the product to add to cart
+
+        :type timeout: Time
+        :param timeout: the maximum number of seconds to wait, None waits forever
+
+        :returns True or False if the timeout expired
+        """
+        with self.lock_backorder:
+            # Do not overtake the carts already waiting
+            if not self.backorder_queues.get(product) and self.add_to_cart(cart_id, product):
+                return True
+
+            backorder = Backorder(cart_id, self.cart_priorities.get(cart_id, 0))
+            self.backorder_queues.setdefault(product, deque()).append(backorder)
+
+        if backorder.event.wait(timeout):
+            return True
+
+        with self.lock_backorder:
+            # The product has been handed over just now -> wait for the cart update
+            if backorder.producer_id is not None:
+                backorder.event.wait()
+                return True
+
+            waiting = self.backorder_queues[product]
+            waiting.remove(backorder)
+            if not waiting:
+                del self.backorder_queues[product]
+
+        return False
+
+    def release_product(self, producer_id, product):
+        """
+        Hands the product to the waiting cart of the highest class (the oldest one of that
+        class) or, if there is none, makes it available in the marketplace.
+
+        :returns True or False if the producer is unregistered and the product is not taken
+        """
+        if self.admission is not None:
+            self.admission.note_arrival(product)
+
+        if not self.backorders:
+            return self.stock_product(producer_id, product)
+
+        with self.lock_backorder:
+            waiting = self.backorder_queues.get(product)
+            if not waiting:
+                return self.stock_product(producer_id, product)
+
+            # The same check as stock_product, a retiring producer hands over nothing
+            with self.stock_changed:
+                if producer_id in self.retiring_producers:
+                    return False
+
+            backorder = self.next_backorder(waiting)
+            waiting.remove(backorder)
+            if not waiting:
+                del self.backorder_queues[product]
+            backorder.producer_id = producer_id
+
+        # The waiting consumer does not touch its cart until the event is set
+        self.add_cart_entry(backorder.cart_id, product, producer_id)
+        backorder.event.set()
+        return True
+
+    def stock_product(self, producer_id, product):
+        """
+        Makes the product available, unless its producer is unregistered. The check is made
+        under the lock that unregister_producer holds while it takes the products back.
+
+        :returns True or False if the producer is unregistered
+        """
+        with self.stock_changed:
+            if producer_id in self.retiring_producers:
+                return False
+
+            self.add_product(producer_id, product)
+            # Wake up the carts waiting in reserve_all
+            self.stock_changed.notify_all()
+        return True
+
+    def next_backorder(self, waiting):
+        """
+        Returns the waiting cart with the highest priority class, a cart gaining one class for
+        every priority_aging seconds it waited.
+        """
+        now = time.monotonic()
+        return max(waiting, key=lambda backorder:
+                   backorder.priority + (now - backorder.created) / self.priority_aging)
@@ -0,0 +1,790 @@
+"""
+This module exposes the Marketplace over a TCP or Unix socket.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from contextlib import nullcontext
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+import argparse
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import time
+import unittest
+
+from tema.admission import AdmissionControl, Rejection
+from tema.marketplace import Marketplace
+from tema.product import Tea
+from tema.trace import encode_product, decode_product
+
+# payload length, request id, opcode (requests) or status (responses)
+FRAME = struct.Struct('<IIB')
+INT = struct.Struct('<i')
+ID_PRODUCT = struct.Struct('<iI')
+# refused, retry-after hint in seconds, followed by the reason
+REJECTION = struct.Struct('<Bd')
+# cart id, product id, timeout in seconds (negative to wait forever)
+RESERVE_REQUEST = struct.Struct('<iId')
+# cart id, wait, timeout in seconds (negative to wait forever), number of products, followed
+# by a (product id, quantity) pair per product
+RESERVE_ALL_REQUEST = struct.Struct('<i?dI')
+QUANTITY = struct.Struct('<Ii')
+
+REGISTER_PRODUCER = 0
+PUBLISH = 1
+NEW_CART = 2
+ADD_TO_CART = 3
+REMOVE_FROM_CART = 4
+PLACE_ORDER = 5
+DEFINE_PRODUCT = 6
+LOOKUP_PRODUCT = 7
+RESERVE = 8
+RESERVE_ALL = 9
+UNREGISTER_PRODUCER = 10
+PRODUCTS_IN_MARKET = 11
+
+OK = 0
+ERROR = 1
+
+
+class MarketplaceError(Exception):
+    """
+    Exception raised by the client when the server fails to execute a request.
+    """
+
+
+class ProductTable:
+    """
+    Class that interns the products, the server and the clients exchange only their ids.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.products = []  # [product], indexed by product id
+        self.ids = {}       # {product : product id}
+        self.lock = Lock()
+
+    def intern(self, product):
+        """ Returns the id of the product, assigning one if it is new. """
+        product_id = self.ids.get(product)
+        if product_id is None:
+            with self.lock:
+                product_id = self.ids.get(product)
+                if product_id is None:
+                    product_id = len(self.products)
+                    self.products.append(product)
+                    self.ids[product] = product_id
+        return product_id
+
+
+def read_frame(stream):
+    """ Reads a frame from a buffered stream, returns None at the end of the stream. """
+    header = stream.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None
+
+    length, request_id, code = FRAME.unpack(header)
+    return request_id, code, stream.read(length)
+
+
+def pack_frame(request_id, code, payload=b''):
+    """ Returns the bytes of a frame. """
+    return FRAME.pack(len(payload), request_id, code) + payload
+
+
+def encode_status(status):
+    """
+    Returns the payload of a publish or add_to_cart response: one byte, followed by the
+    retry-after hint and the reason of a Rejection.
+    """
+    if isinstance(status, Rejection):
+        return REJECTION.pack(0, status.retry_after) + status.reason.encode()
+    return bytes([bool(status)])
+
+
+def decode_status(payload):
+    """ Returns the status of a publish or add_to_cart response, True, False or a Rejection. """
+    if len(payload) == 1:
+        return payload == b'\x01'
+    _, retry_after = REJECTION.unpack_from(payload)
+    return Rejection(retry_after, payload[REJECTION.size:].decode())
+
+
+def new_cart_payload(priority):
+    """ Returns the payload of a new_cart request, empty for the default priority class. """
+    return INT.pack(priority) if priority != 0 else b''
+
+
+class MarketplaceHandler(socketserver.BaseRequestHandler):
+    """
+    Class that serves the requests of one client connection, in order. All the requests
+    received together are executed before their responses are sent back in one write.
+    """
+
+    def handle(self):
+        marketplace = self.server.marketplace
+        products = self.server.products
+        buffer = b''
+
+        while True:
+            data = self.request.recv(1 << 16)
+            if not data:
+                return
+            buffer += data
+
+            # Execute every complete frame of the buffer
+            responses = []
+            offset = 0
+            while len(buffer) - offset >= FRAME.size:
+                length, request_id, opcode = FRAME.unpack_from(buffer, offset)
+                end = offset + FRAME.size + length
+                if end > len(buffer):
+                    break
+
+                payload = buffer[offset + FRAME.size:end]
+                offset = end
+                try:
+                    response = self.execute(marketplace, products, opcode, payload)
+                    responses.append(pack_frame(request_id, OK, response))
+                except Exception as error:  # pylint: disable=broad-except
+                    responses.append(pack_frame(request_id, ERROR, repr(error).encode()))
+
+            buffer = buffer[offset:]
+            if responses:
+                self.request.sendall(b''.join(responses))
+
+    @staticmethod
+    def execute(marketplace, products, opcode, payload):
+        """ Executes a request and returns the payload of the response. """
+        handler = HANDLERS.get(opcode)
+        if handler is None:
+            raise ValueError(f'unknown opcode {opcode}')
+        return handler(marketplace, products, payload)
+
+
+def serve_register_producer(marketplace, _products, _payload):
+    """ Executes a register_producer request. """
+    return INT.pack(marketplace.register_producer())
+
+
+def serve_new_cart(marketplace, _products, payload):
+    """ Executes a new_cart request. """
+    # The carts without a priority class are created like before priorities existed
+    if payload:
+        return INT.pack(marketplace.new_cart(priority=INT.unpack(payload)[0]))
+    return INT.pack(marketplace.new_cart())
+
+
+def serve_define_product(_marketplace, products, payload):
+    """ Interns a product sent by a client. """
+    return INT.pack(products.intern(decode_product(payload)))
+
+
+def serve_lookup_product(_marketplace, products, payload):
+    """ Sends the definition of a product back to a client. """
+    return encode_product(products.products[INT.unpack(payload)[0]])
+
+
+def serve_publish(marketplace, products, payload):
+    """ Executes a publish request. """
+    producer_id, product_id = ID_PRODUCT.unpack(payload)
+    return encode_status(marketplace.publish(producer_id, products.products[product_id]))
+
+
+def serve_add_to_cart(marketplace, products, payload):
+    """ Executes an add_to_cart request. """
+    cart_id, product_id = ID_PRODUCT.unpack(payload)
+    return encode_status(marketplace.add_to_cart(cart_id, products.products[product_id]))
+
+
+def serve_remove_from_cart(marketplace, products, payload):
+    """ Executes a remove_from_cart request. """
+    cart_id, product_id = ID_PRODUCT.unpack(payload)
+    marketplace.remove_from_cart(cart_id, products.products[product_id])
+    return b''
+
+
+def serve_reserve(marketplace, products, payload):
+    """ Executes a reserve request, the connection waits with the cart. """
+    cart_id, product_id, timeout = RESERVE_REQUEST.unpack(payload)
+    timeout = None if timeout < 0 else timeout
+    return bytes([marketplace.reserve(cart_id, products.products[product_id], timeout)])
+
+
+def serve_reserve_all(marketplace, products, payload):
+    """ Executes a reserve_all request, the connection waits with the cart. """
+    cart_id, wait, timeout, count = RESERVE_ALL_REQUEST.unpack_from(payload)
+    quantities = {}
+    for index in range(count):
+        product_id, quantity = QUANTITY.unpack_from(
+            payload, RESERVE_ALL_REQUEST.size + index * QUANTITY.size)
+        quantities[products.products[product_id]] = quantity
+
+    timeout = None if timeout < 0 else timeout
+    return bytes([marketplace.reserve_all(cart_id, quantities, wait, timeout)])
+
+
+def encode_products(products, product_list):
+    """ Returns the payload of a list of products, sent as ids. """
+    product_ids = [products.intern(product) for product in product_list]
+    return struct.pack(f'<I{len(product_ids)}I', len(product_ids), *product_ids)
+
+
+def serve_place_order(marketplace, products, payload):
+    """ Executes a place_order request, the products are sent as ids. """
+    return encode_products(products, marketplace.place_order(INT.unpack(payload)[0]))
+
+
+def serve_unregister_producer(marketplace, products, payload):
+    """
+    Executes an unregister_producer request. The products are sent as ids, the ones removed
+    from carts afterwards stay on the server.
+    """
+    return encode_products(products, marketplace.unregister_producer(INT.unpack(payload)[0]))
+
+
+def serve_products_in_market(marketplace, _products, payload):
+    """ Sends the number of products of a producer in the marketplace, in stock or in carts. """
+    return INT.pack(marketplace.products_per_producer[INT.unpack(payload)[0]])
+
+
+HANDLERS = {REGISTER_PRODUCER: serve_register_producer, PUBLISH: serve_publish,
+            NEW_CART: serve_new_cart, ADD_TO_CART: serve_add_to_cart,
+            REMOVE_FROM_CART: serve_remove_from_cart, PLACE_ORDER: serve_place_order,
+            DEFINE_PRODUCT: serve_define_product, LOOKUP_PRODUCT: serve_lookup_product,
+            RESERVE: serve_reserve, RESERVE_ALL: serve_reserve_all,
+            UNREGISTER_PRODUCER: serve_unregister_producer,
+            PRODUCTS_IN_MARKET: serve_products_in_market}
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server with one daemon thread per connection.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Unix socket server with one daemon thread per connection.
+    """
+    daemon_threads = True
+
+
+class MarketplaceServer:
+    """
+    Class that serves a marketplace on a TCP address (host, port) or on a Unix socket path,
+    with one thread per client connection.
+    """
+
+    def __init__(self, marketplace, address):
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the marketplace that executes the requests
+
+        :type address: Tuple or String
+        :param address: (host, port) for TCP or a path for a Unix socket
+        """
+        if isinstance(address, str):
+            server_class = ThreadingUnixServer
+        else:
+            server_class = ThreadingTCPServer
+
+        self.server = server_class(address, MarketplaceHandler)
+        self.server.marketplace = marketplace
+        self.server.products = ProductTable()
+        self.address = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        """ Serves the requests from a background thread. """
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        """ Stops serving and closes the socket. """
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class Connection:
+    """
+    Class that represents one client connection to the server.
+    """
+
+    def __init__(self, address):
+        """
+        Constructor
+
+        :type address: Tuple or String
+        :param address: (host, port) for TCP or a path for a Unix socket
+        """
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+        self.stream = self.sock.makefile('rb')
+        self.next_request_id = 0
+
+    def call(self, requests):
+        """
+        Sends all the requests at once and reads their responses.
+
+        :type requests: List
+        :param requests: a list of (opcode, payload)
+
+        :returns the list of response payloads, in the order of the requests
+        """
+        first_request_id = self.next_request_id
+        self.next_request_id += len(requests)
+        self.sock.sendall(b''.join(pack_frame(first_request_id + i, opcode, payload)
+                                   for i, (opcode, payload) in enumerate(requests)))
+
+        responses = []
+        for _ in requests:
+            frame = read_frame(self.stream)
+            if frame is None:
+                raise MarketplaceError('connection closed by the server')
+
+            _, status, payload = frame
+            if status != OK:
+                raise MarketplaceError(payload.decode())
+            responses.append(payload)
+
+        return responses
+
+    def close(self):
+        """ Closes the connection. """
+        self.stream.close()
+        self.sock.close()
+
+
+class MarketplaceClient:
+    """
+    Class that implements the Marketplace API over a pool of connections to a
+    MarketplaceServer, so it can be given to the Producers and Consumers unchanged.
+    """
+
+    def __init__(self, address, pool_size=4):
+        """
+        Constructor
+
+        :type address: Tuple or String
+        :param address: (host, port) for TCP or a path for a Unix socket
+
+        :type pool_size: Int
+        :param pool_size: the maximum number of idle connections kept open
+        """
+        self.address = address
+        self.pool = Queue(pool_size)
+        self.product_ids = {}   # {product : product id on the server}
+        self.products = {}      # {product id on the server : product}
+
+    def call(self, requests):
+        """ Executes the requests on a connection taken from the pool. """
+        try:
+            connection = self.pool.get_nowait()
+        except Empty:
+            connection = Connection(self.address)
+
+        try:
+            responses = connection.call(requests)
+        except Exception:
+            connection.close()
+            raise
+
+        # Another thread may fill the pool between a check and a put, never block on it
+        try:
+            self.pool.put_nowait(connection)
+        except Full:
+            connection.close()
+
+        return responses
+
+    def product_id(self, product):
+        """ Returns the id of the product on the server, defining it the first time. """
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            payload, = self.call([(DEFINE_PRODUCT, encode_product(product))])
+            product_id = INT.unpack(payload)[0]
+            self.product_ids[product] = product_id
+            self.products[product_id] = product
+        return product_id
+
+    def product(self, product_id):
+        """ Returns the product with the given id on the server. """
+        product = self.products.get(product_id)
+        if product is None:
+            payload, = self.call([(LOOKUP_PRODUCT, INT.pack(product_id))])
+            product = decode_product(payload)
+            self.products[product_id] = product
+            self.product_ids[product] = product_id
+        return product
+
+    def decode_order(self, payload):
+        """ Returns the list of products of a place_order or unregister_producer response. """
+        count, = struct.unpack_from('<I', payload)
+        product_ids = struct.unpack_from(f'<{count}I', payload, 4)
+        return [self.product(product_id) for product_id in product_ids]
+
+    def pipeline(self):
+        """ Returns a Pipeline that sends several requests in a single round trip. """
+        return Pipeline(self)
+
+    def register_producer(self):
+        """ Returns an id for the producer that calls this. """
+        return INT.unpack(self.call([(REGISTER_PRODUCER, b'')])[0])[0]
+
+    def publish(self, producer_id, product):
+        """ Adds the product provided by the producer to the marketplace. """
+        payload = ID_PRODUCT.pack(producer_id, self.product_id(product))
+        return decode_status(self.call([(PUBLISH, payload)])[0])
+
+    def new_cart(self, priority=0):
+        """ Creates a new cart for the consumer, of the given priority class. """
+        return INT.unpack(self.call([(NEW_CART, new_cart_payload(priority))])[0])[0]
+
+    def add_to_cart(self, cart_id, product):
+        """ Adds a product to the given cart. """
+        payload = ID_PRODUCT.pack(cart_id, self.product_id(product))
+        return decode_status(self.call([(ADD_TO_CART, payload)])[0])
+
+    def reserve(self, cart_id, product, timeout=None):
+        """ Adds a product to the given cart, waiting for it if it is not in stock. """
+        payload = RESERVE_REQUEST.pack(cart_id, self.product_id(product),
+                                       -1.0 if timeout is None else timeout)
+        return self.call([(RESERVE, payload)])[0] == b'\x01'
+
+    def reserve_all(self, cart_id, quantities, wait=False, timeout=None):
+        """ Adds all the products to the given cart or none of them. """
+        payload = RESERVE_ALL_REQUEST.pack(cart_id, wait, -1.0 if timeout is None else timeout,
+                                           len(quantities))
+        payload += b''.join(QUANTITY.pack(self.product_id(product), quantity)
+                            for product, quantity in quantities.items())
+        return self.call([(RESERVE_ALL, payload)])[0] == b'\x01'
+
+    def remove_from_cart(self, cart_id, product):
+        """ Removes a product from cart. """
+        self.call([(REMOVE_FROM_CART, ID_PRODUCT.pack(cart_id, self.product_id(product)))])
+
+    def place_order(self, cart_id):
+        """ Return a list with all the products in the cart. """
+        return self.decode_order(self.call([(PLACE_ORDER, INT.pack(cart_id))])[0])
+
+    def unregister_producer(self, producer_id):
+        """
+        Removes the producer from the marketplace and returns its unsold products. Unlike the
+        Marketplace, the list is not extended with the products removed from carts later.
+        """
+        return self.decode_order(self.call([(UNREGISTER_PRODUCER, INT.pack(producer_id))])[0])
+
+    def products_in_market(self, producer_id):
+        """ Returns the number of products of the producer in the marketplace. """
+        return INT.unpack(self.call([(PRODUCTS_IN_MARKET, INT.pack(producer_id))])[0])[0]
+
+    def close(self):
+        """ Closes the idle connections. """
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+class Pipeline:
+    """
+    Class that queues Marketplace calls and executes them in one round trip. The calls are
+    executed by the server in the order they were queued.
+    """
+
+    def __init__(self, client):
+        """
+        Constructor
+
+        :type client: MarketplaceClient
+        :param client: the client that sends the requests
+        """
+        self.client = client
+        self.requests = []
+        self.decoders = []
+
+    def queue(self, opcode, payload, decoder):
+        """ Queues a request and the function that decodes its response. """
+        self.requests.append((opcode, payload))
+        self.decoders.append(decoder)
+
+    def register_producer(self):
+        """ Queues Marketplace.register_producer """
+        self.queue(REGISTER_PRODUCER, b'', lambda payload: INT.unpack(payload)[0])
+
+    def publish(self, producer_id, product):
+        """ Queues Marketplace.publish """
+        payload = ID_PRODUCT.pack(producer_id, self.client.product_id(product))
+        self.queue(PUBLISH, payload, decode_status)
+
+    def new_cart(self, priority=0):
+        """ Queues Marketplace.new_cart """
+        self.queue(NEW_CART, new_cart_payload(priority), lambda payload: INT.unpack(payload)[0])
+
+    def add_to_cart(self, cart_id, product):
+        """ Queues Marketplace.add_to_cart """
+        payload = ID_PRODUCT.pack(cart_id, self.client.product_id(product))
+        self.queue(ADD_TO_CART, payload, decode_status)
+
+    def remove_from_cart(self, cart_id, product):
+        """ Queues Marketplace.remove_from_cart """
+        payload = ID_PRODUCT.pack(cart_id, self.client.product_id(product))
+        self.queue(REMOVE_FROM_CART, payload, lambda payload: None)
+
+    def place_order(self, cart_id):
+        """ Queues Marketplace.place_order """
+        self.queue(PLACE_ORDER, INT.pack(cart_id), self.client.decode_order)
+
+    def execute(self):
+        """
+        Sends the queued requests.
+
+        :returns the list of results, in the order of the calls
+        """
+        requests, decoders = self.requests, self.decoders
+        self.requests, self.decoders = [], []
+        if not requests:
+            return []
+
+        responses = self.client.call(requests)
+        return [decoder(payload) for decoder, payload in zip(decoders, responses)]
+
+
+def benchmark(address, num_operations, batch_size):
+    """
+    Publishes and buys num_operations products through a client.
+
+    :returns a tuple (calls per second without pipelining, calls per second with pipelining)
+    """
+    client = MarketplaceClient(address)
+    product = Tea('Linden', 9, 'Herbal')
+    producer_id = client.register_producer()
+    cart_id = client.new_cart()
+
+    start = time.perf_counter()
+    for _ in range(num_operations):
+        client.publish(producer_id, product)
+        client.add_to_cart(cart_id, product)
+    client.place_order(cart_id)
+    sequential = (2 * num_operations + 1) / (time.perf_counter() - start)
+
+    cart_id = client.new_cart()
+    pipeline = client.pipeline()
+    start = time.perf_counter()
+    for i in range(num_operations):
+        pipeline.publish(producer_id, product)
+        pipeline.add_to_cart(cart_id, product)
+        if (i + 1) % batch_size == 0:
+            pipeline.execute()
+    pipeline.place_order(cart_id)
+    pipeline.execute()
+    pipelined = (2 * num_operations + 1) / (time.perf_counter() - start)
+
+    client.close()
+    return sequential, pipelined
+
+
+def main():
+    """ Serves a marketplace or runs the loopback benchmark. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['serve', 'bench'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--unix', metavar='PATH', help='serve on a Unix socket')
+    parser.add_argument('--tcp', action='store_true',
+                        help='benchmark over TCP instead of a temporary Unix socket')
+    parser.add_argument('--queue-size', type=int, default=1 << 30,
+                        help='queue_size_per_producer of the served marketplace')
+    parser.add_argument('--operations', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--quiet', action='store_true',
+                        help='keep only the warnings of the text log while serving')
+    args = parser.parse_args()
+
+    address = args.unix if args.unix is not None else (args.host, args.port)
+    if args.command == 'bench' and args.unix is None and not args.tcp:
+        address = os.path.join(tempfile.mkdtemp(), 'marketplace.sock')
+
+    server = MarketplaceServer(Marketplace(args.queue_size), address)
+    if args.command == 'serve':
+        # The line tells a parent process that the socket is listening
+        print(f'serving on {server.address}', flush=True)
+        with Marketplace.quiet_log() if args.quiet else nullcontext():
+            server.server.serve_forever()
+        return
+
+    server.start()
+    # Measure the transport, not the text log
+    with Marketplace.quiet_log():
+        sequential, pipelined = benchmark(server.address, args.operations, args.batch)
+    server.shutdown()
+    print(f'sequential: {sequential:.0f} calls/s')
+    print(f'pipelined (batch {args.batch}): {pipelined:.0f} calls/s')
+
+
+class MarketplaceServiceTest(unittest.TestCase):
+    """ Marketplace Service Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        self.marketplace = Marketplace(5)
+        self.server = MarketplaceServer(self.marketplace, ('127.0.0.1', 0))
+        self.server.start()
+        self.client = MarketplaceClient(self.server.address, pool_size=2)
+        self.product = Tea('Linden', 9, 'Herbal')
+
+    def tearDown(self):
+        """ Stops the server. """
+        self.client.close()
+        self.server.shutdown()
+
+    def test_api(self):
+        """ Test method """
+        producer_id = self.client.register_producer()
+        cart = self.client.new_cart()
+
+        # Check if every call is executed by the served marketplace
+        self.assertTrue(self.client.publish(producer_id, self.product))
+        self.assertTrue(self.client.publish(producer_id, 'Cocoa'))
+        self.assertTrue(self.client.add_to_cart(cart, self.product))
+        self.assertTrue(self.client.add_to_cart(cart, 'Cocoa'))
+        self.assertFalse(self.client.add_to_cart(cart, 'Cocoa'))
+        self.client.remove_from_cart(cart, 'Cocoa')
+        self.assertEqual([self.product], self.client.place_order(cart))
+        self.assertDictEqual({producer_id: 1}, self.marketplace.products['Cocoa'])
+        # Check if the priority class of a cart reaches the marketplace
+        cart = self.client.new_cart(priority=2)
+        self.assertDictEqual({cart: 2}, self.marketplace.cart_priorities)
+
+    def test_pipeline(self):
+        """ Test method """
+        pipeline = self.client.pipeline()
+        pipeline.register_producer()
+        pipeline.new_cart()
+        producer_id, cart = pipeline.execute()
+
+        for _ in range(6):
+            pipeline.publish(producer_id, self.product)
+        pipeline.add_to_cart(cart, self.product)
+        pipeline.place_order(cart)
+
+        # Check if the results come back in order
+        self.assertEqual([True] * 5 + [False, True, [self.product]], pipeline.execute())
+
+    def test_error(self):
+        """ Test method """
+        # Check if a failure of the marketplace is reported to the client
+        with self.assertRaises(MarketplaceError):
+            self.client.place_order(42)
+        # Check if the connection can still be used
+        self.assertEqual(0, self.client.new_cart())
+
+    def test_reserve(self):
+        """ Test method """
+        marketplace = Marketplace(5, backorders=True)
+        server = MarketplaceServer(marketplace, ('127.0.0.1', 0))
+        server.start()
+        client = MarketplaceClient(server.address)
+        producer_id = client.register_producer()
+        cart = client.new_cart()
+
+        # Check if a reservation gives up after its timeout and waits for a product otherwise
+        self.assertFalse(client.reserve(cart, self.product, timeout=0.01))
+        waiter = Thread(target=client.reserve, args=(cart, self.product))
+        waiter.start()
+        while not marketplace.backorder_queues:
+            time.sleep(0.001)
+        self.assertTrue(client.publish(producer_id, self.product))
+        waiter.join(timeout=5)
+        self.assertEqual([self.product], client.place_order(cart))
+
+        # Check if all the products are reserved at once or none of them
+        cart = client.new_cart()
+        client.publish(producer_id, self.product)
+        quantities = {self.product: 1, 'Cocoa': 2}
+        self.assertFalse(client.reserve_all(cart, quantities))
+        client.publish(producer_id, 'Cocoa')
+        client.publish(producer_id, 'Cocoa')
+        self.assertTrue(client.reserve_all(cart, quantities, wait=True, timeout=5))
+        self.assertCountEqual([self.product, 'Cocoa', 'Cocoa'], client.place_order(cart))
+        client.close()
+        server.shutdown()
+
+    def test_rejection(self):
+        """ Test method """
+        marketplace = Marketplace(1, admission=AdmissionControl(default_retry_after=0.05))
+        server = MarketplaceServer(marketplace, ('127.0.0.1', 0))
+        server.start()
+        client = MarketplaceClient(server.address)
+        producer_id = client.register_producer()
+
+        # Check if the retry-after hint and the reason travel back to the client
+        self.assertTrue(client.publish(producer_id, 'Cocoa'))
+        rejection = client.publish(producer_id, 'Cocoa')
+        self.assertFalse(rejection)
+        self.assertEqual(Rejection(0.05, 'queue full'), rejection)
+        self.assertEqual('out of stock', client.add_to_cart(client.new_cart(), 'Mint').reason)
+        client.close()
+        server.shutdown()
+
+    def test_unregister_producer(self):
+        """ Test method """
+        producer_id = self.client.register_producer()
+        cart = self.client.new_cart()
+        self.client.publish(producer_id, self.product)
+        self.client.publish(producer_id, 'Cocoa')
+        self.client.add_to_cart(cart, 'Cocoa')
+
+        # Check if the products that are not in a cart come back to the client
+        self.assertEqual([self.product], self.client.unregister_producer(producer_id))
+        self.assertIn(producer_id, self.marketplace.retiring_producers)
+        self.assertFalse(self.client.publish(producer_id, self.product))
+        self.assertEqual(['Cocoa'], self.client.place_order(cart))
+        self.assertEqual(producer_id, self.client.register_producer())
+
+    def test_products_in_market(self):
+        """ Test method """
+        producer_id = self.client.register_producer()
+        cart = self.client.new_cart()
+        self.client.publish(producer_id, self.product)
+        self.client.publish(producer_id, 'Cocoa')
+        self.client.add_to_cart(cart, 'Cocoa')
+
+        # Check if the products in carts count until they are bought
+        self.assertEqual(2, self.client.products_in_market(producer_id))
+        self.client.place_order(cart)
+        self.assertEqual(1, self.client.products_in_market(producer_id))
+
+    def test_pool(self):
+        """ Test method """
+        # More threads than pooled connections return them at the same time
+        threads = [Thread(target=lambda: [self.client.new_cart() for _ in range(50)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        # Check if no thread is left blocked returning its connection
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(400, self.client.new_cart())
+
+
+if __name__ == '__main__':
+    main()
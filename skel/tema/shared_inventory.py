@@ -0,0 +1,289 @@
+"""
+This module represents the stock counts of the Marketplace mirrored into a memory-mapped file,
+and the reader used by the other processes.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import hashlib
+import mmap
+import struct
+import time
+
+from tema.binary_files import BinaryFileTest
+from tema.marketplace import Marketplace
+from tema.product import Coffee
+
+# magic, number of slots, maximum bytes of a product name, slots used, products without a slot
+HEADER = struct.Struct('<8sIIQQ')
+# sequence (odd while the writer updates the slot), quantity available, digest of the name
+SLOT = struct.Struct('<Qq16s')
+# length of the product name, product name
+NAME = struct.Struct('<H254s')
+MAGIC = b'TEMAINV2'
+NAME_SIZE = 254
+
+
+def name_digest(name):
+    """ Returns the fixed-width key of the slot of a product name. """
+    return hashlib.blake2b(name, digest_size=16).digest()
+
+
+def encode_name(name):
+    """
+    Returns the bytes of a product name.
+
+    :raises ValueError: if the name does not fit in the name table
+    """
+    encoded = name.encode()
+    if len(encoded) > NAME_SIZE:
+        raise ValueError(f'product name of {len(encoded)} bytes, at most {NAME_SIZE} fit')
+    return encoded
+
+
+def slot_offset(slot):
+    """ Returns the offset of the slot in the file. """
+    return HEADER.size + slot * SLOT.size
+
+
+def name_offset(capacity, slot):
+    """ Returns the offset of the name of the slot, the name table follows the slots. """
+    return slot_offset(capacity) + slot * NAME.size
+
+
+class SharedInventory:
+    """
+    Class that writes the quantity available of every product into a file with a fixed layout:
+    a header, one slot per product, assigned the first time the product is in stock, and a
+    table with the names of the products (str(product)). A slot is keyed by the digest of the
+    name, so the readers find it without reading the names. Every slot has its own sequence
+    counter, so a reader never waits for the writer and retries only the slot being updated.
+    The products that do not fit in the file, or whose name is longer than NAME_SIZE bytes, are
+    only counted in the header.
+    """
+
+    def __init__(self, path, capacity=4096):
+        """
+        Constructor
+
+        :type path: String
+        :param path: the file, created or truncated
+
+        :type capacity: Int
+        :param capacity: the number of products the file has room for
+        """
+        self.capacity = capacity
+        self.slots = {}     # {product : slot}
+        self.num_missing = 0
+        with open(path, 'wb') as shared_file:
+            shared_file.truncate(name_offset(capacity, capacity))
+        with open(path, 'r+b') as shared_file:
+            self.buffer = mmap.mmap(shared_file.fileno(), 0)
+        HEADER.pack_into(self.buffer, 0, MAGIC, capacity, NAME_SIZE, 0, 0)
+
+    def set(self, product, quantity):
+        """
+        Writes the quantity available of the product. The caller serializes the writes
+        (Marketplace.update_stock holds lock_stock).
+        """
+        slot = self.slots.get(product)
+        if slot is None:
+            self.slots[product] = slot = self.new_slot(product, quantity)
+            return
+
+        if slot == -1:
+            return
+
+        offset = slot_offset(slot)
+        sequence, = struct.unpack_from('<Q', self.buffer, offset)
+        struct.pack_into('<Q', self.buffer, offset, sequence + 1)
+        struct.pack_into('<q', self.buffer, offset + 8, quantity)
+        struct.pack_into('<Q', self.buffer, offset, sequence + 2)
+
+    def new_slot(self, product, quantity):
+        """
+        Writes the name and the quantity of a new product.
+
+        :returns the slot of the product, or -1 if it is only counted as missing
+        """
+        try:
+            name = encode_name(str(product))
+        except ValueError:
+            name = None
+
+        slot = -1
+        if name is None or len(self.slots) - self.num_missing == self.capacity:
+            self.num_missing += 1
+        else:
+            slot = len(self.slots) - self.num_missing
+            NAME.pack_into(self.buffer, name_offset(self.capacity, slot), len(name), name)
+            SLOT.pack_into(self.buffer, slot_offset(slot), 0, quantity, name_digest(name))
+
+        # Publish the slot only once its name is written
+        HEADER.pack_into(self.buffer, 0, MAGIC, self.capacity, NAME_SIZE,
+                         len(self.slots) + 1 - self.num_missing, self.num_missing)
+        return slot
+
+    def close(self):
+        """ Unmaps the file, the readers keep their mappings. """
+        self.buffer.close()
+
+
+class InventoryReader:
+    """
+    Class that reads the stock counts written by a SharedInventory, straight from the shared
+    mapping, without any call into the marketplace.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor
+
+        :type path: String
+        :param path: the file written by the marketplace
+        """
+        with open(path, 'rb') as shared_file:
+            self.buffer = mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.capacity, _, _, _ = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a shared inventory')
+        self.slots = {}     # {digest of the product name : slot}
+
+    def refresh(self):
+        """ Learns the slots added since the last call. """
+        _, _, _, num_slots, _ = HEADER.unpack_from(self.buffer, 0)
+        for slot in range(len(self.slots), num_slots):
+            _, _, digest = SLOT.unpack_from(self.buffer, slot_offset(slot))
+            self.slots[digest] = slot
+
+    def read_slot(self, slot):
+        """ Returns a consistent quantity of the slot. """
+        offset = slot_offset(slot)
+        while True:
+            sequence, quantity = struct.unpack_from('<Qq', self.buffer, offset)
+            # The writer is in the middle of an update -> retry
+            if sequence % 2 == 1:
+                time.sleep(0)
+                continue
+            if struct.unpack_from('<Q', self.buffer, offset)[0] == sequence:
+                return quantity
+
+    def read_name(self, slot):
+        """ Returns the product name of the slot. """
+        length, name = NAME.unpack_from(self.buffer, name_offset(self.capacity, slot))
+        return name[:length].decode(errors='replace')
+
+    def stock(self, name):
+        """
+        Returns the quantity available of the product named str(product).
+
+        :raises ValueError: if the name is longer than any name the file can hold
+        """
+        digest = name_digest(encode_name(name))
+        slot = self.slots.get(digest)
+        if slot is None:
+            self.refresh()
+            slot = self.slots.get(digest)
+            if slot is None:
+                return 0
+        return self.read_slot(slot)
+
+    def snapshot(self):
+        """ Returns a dict {product name : quantity available} of the products in stock. """
+        self.refresh()
+        quantities = {self.read_name(slot): self.read_slot(slot) for slot in self.slots.values()}
+        return {name: quantity for name, quantity in quantities.items() if quantity > 0}
+
+    def missing(self):
+        """ Returns the number of products that did not fit in the file. """
+        return HEADER.unpack_from(self.buffer, 0)[4]
+
+    def close(self):
+        """ Unmaps the file. """
+        self.buffer.close()
+
+
+def main():
+    """ Prints the stock counts of a running marketplace. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str, help='shared inventory written by the marketplace')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='print the stock counts again every SECONDS')
+    args = parser.parse_args()
+
+    reader = InventoryReader(args.path)
+    while True:
+        for name, quantity in sorted(reader.snapshot().items()):
+            print(f'{quantity:8} {name}')
+        if args.watch is None:
+            break
+        print()
+        time.sleep(args.watch)
+
+
+class SharedInventoryTest(BinaryFileTest):
+    """ Shared Inventory Test class """
+    def test_reader(self):
+        """ Test method """
+        inventory = SharedInventory(self.path, capacity=2)
+        reader = InventoryReader(self.path)
+        inventory.set('Cocoa', 2)
+        inventory.set('Vanilla', 1)
+        inventory.set('Cocoa', 3)
+        # Check if the reader sees the updates of the writer
+        self.assertEqual(3, reader.stock('Cocoa'))
+        self.assertEqual(0, reader.stock('Mint'))
+        inventory.set('Vanilla', 0)
+        self.assertDictEqual({'Cocoa': 3}, reader.snapshot())
+
+        # Check if the products beyond the capacity and the too long names are counted
+        inventory.set('Mint', 1)
+        inventory.set('x' * (NAME_SIZE + 1), 1)
+        self.assertEqual(0, reader.stock('Mint'))
+        self.assertEqual(2, reader.missing())
+        with self.assertRaises(ValueError):
+            reader.stock('x' * (NAME_SIZE + 1))
+        reader.close()
+        inventory.close()
+
+    def test_product_names(self):
+        """ Test method """
+        inventory = SharedInventory(self.path)
+        reader = InventoryReader(self.path)
+        medium = Coffee('Indonezia', 1, 5.05, 'MEDIUM')
+        light = Coffee('Indonezia', 1, 5.05, 'LIGHT')
+        inventory.set(medium, 2)
+        inventory.set(light, 1)
+
+        # Check if the products whose names share a long prefix have their own slots
+        self.assertEqual(2, reader.stock(str(medium)))
+        self.assertEqual(1, reader.stock(str(light)))
+        self.assertDictEqual({str(medium): 2, str(light): 1}, reader.snapshot())
+        reader.close()
+        inventory.close()
+
+    def test_marketplace(self):
+        """ Test method """
+        inventory = SharedInventory(self.path)
+        reader = InventoryReader(self.path)
+        marketplace = Marketplace(5, shared_inventory=inventory)
+        producer_id = marketplace.register_producer()
+        cart = marketplace.new_cart()
+        for _ in range(2):
+            marketplace.publish(producer_id, 'Cocoa')
+        marketplace.add_to_cart(cart, 'Cocoa')
+
+        # Check if the mirror has the quantities of the marketplace
+        self.assertEqual(marketplace.stock('Cocoa'), reader.stock('Cocoa'))
+        marketplace.remove_from_cart(cart, 'Cocoa')
+        self.assertDictEqual({'Cocoa': 2}, reader.snapshot())
+        reader.close()
+        inventory.close()
+
+
+if __name__ == '__main__':
+    main()
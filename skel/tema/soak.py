@@ -0,0 +1,230 @@
+"""
+This module represents a soak test: a long-running churned workload against the Marketplace,
+whose memory is sampled to detect growth.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from threading import Thread, Event
+import argparse
+import os
+import random
+import resource
+import time
+import tracemalloc
+import unittest
+
+from tema.marketplace import Marketplace
+from tema.producer import Producer
+
+# The containers of the Marketplace whose number of entries is sampled
+STRUCTURES = ('products', 'carts', 'products_per_producer', 'producer_locks',
+              'retiring_producers', 'free_producer_ids', 'stock_counts', 'backorder_queues',
+              'cart_priorities', 'producer_limits')
+# Modules of the Marketplace and its mixins, traced line by line
+MODULES = ('marketplace.py', 'adaptive.py', 'admission.py', 'deregistration.py', 'events.py',
+           'reservations.py', 'stock.py')
+
+
+def rss_bytes():
+    """ Returns the resident set size of the process (the peak one if /proc is missing). """
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def sample(marketplace, start):
+    """
+    Returns a dict {series : value} with the time of the sample, the RSS, the memory traced
+    by tracemalloc, the memory allocated by every line of the marketplace's modules and the
+    number of entries of every structure of the marketplace.
+    """
+    values = {'time': time.monotonic() - start, 'rss': rss_bytes()}
+
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(True, f'*{module}') for module in MODULES])
+        values['traced'] = tracemalloc.get_traced_memory()[0]
+        for statistic in snapshot.statistics('lineno'):
+            frame = statistic.traceback[0]
+            values[f'{os.path.basename(frame.filename)}:{frame.lineno}'] = statistic.size
+
+    for name in STRUCTURES:
+        values[f'len({name})'] = len(getattr(marketplace, name))
+    return values
+
+
+def growth(times, values):
+    """
+    Returns the growth of the series over the sampled time, from its least squares line.
+    """
+    count = len(times)
+    mean_time = sum(times) / count
+    mean_value = sum(values) / count
+    variance = sum((t - mean_time) ** 2 for t in times)
+    if variance == 0:
+        return 0.0
+
+    slope = sum((t - mean_time) * (v - mean_value) for t, v in zip(times, values)) / variance
+    return slope * (times[-1] - times[0])
+
+
+def find_trends(samples, warmup=0.25, tolerance=0.1, min_growth=64 * 1024, min_entries=16):
+    """
+    Returns the series that keep growing after the warm-up.
+
+    :type samples: List
+    :param samples: the dicts returned by sample()
+
+    :type warmup: Float
+    :param warmup: the fraction of the samples that is ignored
+
+    :type tolerance: Float
+    :param tolerance: the growth, as a fraction of the mean, that is flagged
+
+    :type min_growth: Int
+    :param min_growth: the growth in bytes below which the memory series are not flagged
+
+    :type min_entries: Int
+    :param min_entries: the growth below which the sizes of the structures are not flagged
+
+    :returns a list of tuples (series, growth)
+    """
+    samples = samples[int(len(samples) * warmup):]
+    if len(samples) < 3:
+        return []
+
+    times = [values['time'] for values in samples]
+    trends = []
+    for series in samples[-1]:
+        if series == 'time':
+            continue
+
+        values = [values.get(series, 0) for values in samples]
+        change = growth(times, values)
+        mean = sum(values) / len(values)
+        floor = min_entries if series.startswith('len(') else min_growth
+        if change > max(tolerance * mean, floor):
+            trends.append((series, change))
+    return trends
+
+
+def consume(marketplace, products, stopped, seed):
+    """ Fills and checks out carts of random products until stopped. """
+    rng = random.Random(seed)
+    while not stopped.is_set():
+        cart_id = marketplace.new_cart()
+        for _ in range(rng.randint(1, 4)):
+            product = rng.choice(products)
+            if marketplace.add_to_cart(cart_id, product) and rng.random() < 0.2:
+                marketplace.remove_from_cart(cart_id, product)
+        marketplace.place_order(cart_id)
+        stopped.wait(0.001)
+
+
+def soak(marketplace, duration, round_time, *, num_producers, num_consumers, sample_interval,
+         report=print):
+    """
+    Runs rounds of round_time seconds for duration seconds. Every round a new set of
+    producers is started and stopped at its end, so the producers churn, while the consumers
+    keep buying. The memory is sampled every sample_interval seconds.
+
+    :returns the list of samples
+    """
+    products = [f'product{i}' for i in range(16)]
+    stopped = Event()
+    consumers = [Thread(target=consume, args=(marketplace, products, stopped, seed), daemon=True)
+                 for seed in range(num_consumers)]
+    for consumer in consumers:
+        consumer.start()
+
+    samples = []
+    start = time.monotonic()
+    next_sample = start
+    rng = random.Random(0)
+    while time.monotonic() - start < duration:
+        producers = [Producer([(rng.choice(products), rng.randint(1, 5), 0.001)], marketplace,
+                              0.005, daemon=True)
+                     for _ in range(num_producers)]
+        for producer in producers:
+            producer.start()
+
+        round_end = time.monotonic() + round_time
+        while time.monotonic() < round_end:
+            if time.monotonic() >= next_sample:
+                samples.append(sample(marketplace, start))
+                report(' '.join(f'{series}={value:.0f}' for series, value in samples[-1].items()
+                                if ':' not in series))
+                next_sample += sample_interval
+            time.sleep(min(0.05, max(0.0, round_end - time.monotonic())))
+
+        for producer in producers:
+            producer.stop()
+        for producer in producers:
+            producer.join()
+
+    stopped.set()
+    for consumer in consumers:
+        consumer.join()
+    return samples
+
+
+def main():
+    """ Runs a soak test and exits with 1 if a growth trend is found. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=3600.0, help='seconds of the test')
+    parser.add_argument('--round-time', type=float, default=5.0,
+                        help='seconds a set of producers lives')
+    parser.add_argument('--producers', type=int, default=8)
+    parser.add_argument('--consumers', type=int, default=8)
+    parser.add_argument('--sample-interval', type=float, default=30.0)
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='sample only the RSS and the sizes of the structures')
+    args = parser.parse_args()
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+
+    with Marketplace.quiet_log():
+        samples = soak(Marketplace(8), args.duration, args.round_time,
+                       num_producers=args.producers, num_consumers=args.consumers,
+                       sample_interval=args.sample_interval)
+    trends = find_trends(samples)
+    for series, change in trends:
+        print(f'GROWTH {series}: +{change:.0f} over the test')
+    if trends:
+        raise SystemExit(1)
+    print('no growth trend found')
+
+
+class SoakTest(unittest.TestCase):
+    """ Soak Test class """
+    def test_find_trends(self):
+        """ Test method """
+        flat = [{'time': t, 'len(carts)': 3 + t % 2, 'rss': 10 ** 8} for t in range(20)]
+        self.assertEqual([], find_trends(flat))
+        # Check if a steadily growing structure is flagged
+        leak = [{'time': t, 'len(carts)': 3 + 2 * t, 'rss': 10 ** 8 + t * 10 ** 6}
+                for t in range(20)]
+        self.assertEqual(['len(carts)', 'rss'], [series for series, _ in find_trends(leak)])
+
+    def test_churn(self):
+        """ Test method """
+        with Marketplace.quiet_log():
+            marketplace = Marketplace(4)
+            samples = soak(marketplace, duration=0.6, round_time=0.2, num_producers=4,
+                           num_consumers=2, sample_interval=0.1, report=lambda line: None)
+
+        # Check if the ids of the stopped producers are reused
+        self.assertTrue(samples)
+        self.assertLessEqual(marketplace.num_producers, 8)
+        self.assertEqual(marketplace.num_producers, len(marketplace.free_producer_ids) +
+                         len(marketplace.retiring_producers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+This module represents the stock queries of the Marketplace.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from threading import Lock
+from types import MappingProxyType
+import time
+
+
+class StockMixin:
+    """
+    Mixin of the Marketplace that keeps the available quantity of every product, so the
+    readers get it without taking any lock, and mirrors it in the optional shared inventory.
+    """
+
+    def __init__(self, shared_inventory=None):
+        """
+        Constructor
+
+        :type shared_inventory: SharedInventory
+        :param shared_inventory: optional memory-mapped file that mirrors the stock counts for
+        the other processes
+        """
+        self.stock_counts = {}  # {product : quantity available}
+        self.stock_sequence = 0  # odd while a writer updates stock_counts
+        self.stock_snapshot = (0, MappingProxyType({}))
+        self.lock_stock = Lock()
+        self.shared_inventory = shared_inventory
+
+    def update_stock(self, product, delta):
+        """ Updates the available quantity of a product for the readers. """
+        # Only the writers take the lock, the readers retry if the sequence changed
+        with self.lock_stock:
+            self.stock_sequence += 1
+            quantity = self.stock_counts.get(product, 0) + delta
+            if quantity == 0:
+                del self.stock_counts[product]
+            else:
+                self.stock_counts[product] = quantity
+            self.stock_sequence += 1
+            if self.shared_inventory is not None:
+                self.shared_inventory.set(product, quantity)
+
+    def stock(self, product):
+        """
+        Returns the quantity of the product available in the marketplace, without taking
+        any lock.
+        """
+        return self.stock_counts.get(product, 0)
+
+    def inventory_snapshot(self):
+        """
+        Returns a read-only and consistent view {product : quantity available}, without taking
+        any lock. The view is reused until the inventory changes.
+        """
+        while True:
+            snapshot_sequence, snapshot = self.stock_snapshot
+            sequence = self.stock_sequence
+            if sequence == snapshot_sequence:
+                return snapshot
+
+            # A writer is in the middle of an update -> retry
+            if sequence % 2 == 1:
+                time.sleep(0)
+                continue
+
+            stock_counts = self.stock_counts.copy()
+            if self.stock_sequence == sequence:
+                snapshot = MappingProxyType(stock_counts)
+                self.stock_snapshot = (sequence, snapshot)
+                return snapshot
+
+    def available_products(self):
+        """
+        Returns a list with the products that can be added to a cart.
+        """
+        return list(self.inventory_snapshot())
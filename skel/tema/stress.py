@@ -0,0 +1,281 @@
+"""
+This module represents a stress harness that checks the histories of concurrent Marketplace
+calls against the sequential model of the inventory.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from threading import Thread, Barrier
+import argparse
+import random
+import sys
+import time
+import unittest
+
+from tema.cluster import MarketplaceCluster
+from tema.dense_marketplace import DenseMarketplace
+from tema.marketplace import Marketplace
+
+ENGINES = {'dict': Marketplace, 'dense': DenseMarketplace, 'cluster': MarketplaceCluster}
+
+
+def product_name(producer_id, kind):
+    """ Returns the name of a product, which tells the producer that published it. """
+    return f'p{producer_id}-{kind}'
+
+
+def producer_of(product):
+    """ Returns the producer that published the product. """
+    return int(product[1:product.index('-')])
+
+
+def worker(marketplace, barrier, producers, num_operations, *, num_kinds, seed):
+    """
+    Publishes and buys random products and records every call as a tuple
+    (method, argument, result, start, end), with the times of the call and of its return.
+    Every thread registers a producer but publishes for any of them, like the threads of a
+    producer engine or of the service.
+
+    :type producers: List
+    :param producers: the ids of the producers, shared by the threads
+
+    :returns the id of the producer of the thread and its history
+    """
+    rng = random.Random(seed)
+    producer_id = marketplace.register_producer()
+    producers.append(producer_id)
+    history = []
+    barrier.wait()
+
+    def call(method, argument, *args):
+        start = time.perf_counter()
+        result = getattr(marketplace, method)(*args)
+        history.append((method, argument, result, start, time.perf_counter()))
+        return result
+
+    for _ in range(num_operations):
+        publisher = rng.choice(producers)
+        product = product_name(publisher, rng.randrange(num_kinds))
+        call('publish', product, publisher, product)
+
+        cart_id = marketplace.new_cart()
+        in_cart = []
+        for _ in range(rng.randint(1, 3)):
+            product = product_name(rng.choice(producers), rng.randrange(num_kinds))
+            if call('add_to_cart', product, cart_id, product):
+                in_cart.append(product)
+
+        if in_cart and rng.random() < 0.3:
+            product = in_cart.pop(rng.randrange(len(in_cart)))
+            call('remove_from_cart', product, cart_id, product)
+
+        call('place_order', None, cart_id)
+
+    return producer_id, history
+
+
+def sweep(events, limit):
+    """
+    Returns the first time at which the running sum of the events (time, delta) exceeds the
+    limit, or None. Events at the same time are applied in the order of their deltas, the
+    negative ones first, so a tie never counts as a violation.
+    """
+    total = 0
+    for timestamp, delta in sorted(events):
+        total += delta
+        if total > limit:
+            return timestamp
+    return None
+
+
+def check(histories, queue_size):
+    """
+    Checks the histories of the calls against the sequential model. A call takes effect at
+    some point between its start and its end, so the checks only use bounds that hold for
+    every such order and report nothing that a linearizable marketplace could have done:
+
+    - a producer never has more than queue_size products in the marketplace: the products
+      published before a time minus the products of the producer that may have been checked
+      out before it never exceed queue_size;
+    - a unit is never sold twice: the products added to carts before a time never exceed the
+      products that may have been published or removed from carts before it.
+
+    :type histories: List
+    :param histories: the (producer id, history) returned by every worker
+
+    :returns a list of the violations found
+    """
+    occupancy = {}  # {producer_id : [(time, delta)]}
+    stock = {}      # {product : [(time, delta)]}
+
+    for producer_id, history in histories:
+        occupancy.setdefault(producer_id, [])
+        for method, product, result, start, end in history:
+            if method == 'publish' and result:
+                occupancy.setdefault(producer_of(product), []).append((end, 1))
+                stock.setdefault(product, []).append((start, -1))
+            elif method == 'add_to_cart' and result:
+                stock.setdefault(product, []).append((end, 1))
+            elif method == 'remove_from_cart':
+                stock.setdefault(product, []).append((start, -1))
+            elif method == 'place_order':
+                for bought in result:
+                    occupancy.setdefault(producer_of(bought), []).append((start, -1))
+
+    violations = []
+    for producer_id, events in sorted(occupancy.items()):
+        timestamp = sweep(events, queue_size)
+        if timestamp is not None:
+            violations.append(f'producer {producer_id} has more than {queue_size} products '
+                              f'at {timestamp:.6f}')
+    for product, events in sorted(stock.items()):
+        timestamp = sweep(events, 0)
+        if timestamp is not None:
+            violations.append(f'{product} is sold more times than it is available '
+                              f'at {timestamp:.6f}')
+    return violations
+
+
+def check_final_state(marketplace, histories, queue_size):
+    """
+    Checks, once every worker is done, that the products left in the marketplace are the ones
+    published or removed and not bought, and that every producer has its whole queue again
+    once they are bought.
+
+    :returns a list of the violations found
+    """
+    expected = {}   # {product : quantity available}
+    for _, history in histories:
+        for method, product, result, _, _ in history:
+            if method in ('publish', 'remove_from_cart') and (result or result is None):
+                expected[product] = expected.get(product, 0) + 1
+            elif method == 'add_to_cart' and result:
+                expected[product] = expected.get(product, 0) - 1
+
+    violations = []
+    cart_id = marketplace.new_cart()
+    for product, quantity in sorted(expected.items()):
+        left = 0
+        while marketplace.add_to_cart(cart_id, product):
+            left += 1
+        if left != quantity:
+            violations.append(f'{product} has {left} products left instead of {quantity}')
+    marketplace.place_order(cart_id)
+
+    for producer_id, _ in histories:
+        published = 0
+        while published <= queue_size and marketplace.publish(producer_id, 'drain'):
+            published += 1
+        if published != queue_size:
+            violations.append(f'producer {producer_id} can publish {published} products '
+                              f'instead of {queue_size}')
+    return violations
+
+
+def stress(marketplace, queue_size, *, num_threads=64, num_operations=500, num_kinds=2, seed=0,
+           switch_interval=1e-5):
+    """
+    Runs num_threads workers against the marketplace and checks their histories.
+
+    :type switch_interval: Time
+    :param switch_interval: the interpreter's thread switch interval during the run, much
+    shorter than the default 5 ms so the threads interleave inside the marketplace's methods
+
+    :returns a tuple (calls per second, list of violations)
+    """
+    barrier = Barrier(num_threads + 1)
+    histories = [None] * num_threads
+    producers = []
+    errors = []
+
+    def run(index):
+        try:
+            histories[index] = worker(marketplace, barrier, producers, num_operations,
+                                      num_kinds=num_kinds, seed=seed * num_threads + index)
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append(f'thread {index} raised {error!r}')
+
+    threads = [Thread(target=run, args=(index,)) for index in range(num_threads)]
+    for thread in threads:
+        thread.start()
+
+    default_interval = sys.getswitchinterval()
+    sys.setswitchinterval(switch_interval)
+    try:
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.setswitchinterval(default_interval)
+
+    # The histories of a crashed run are incomplete, the checks would report false violations
+    if errors:
+        return 0.0, errors
+
+    num_calls = sum(len(history) for _, history in histories)
+    violations = check(histories, queue_size) + \
+        check_final_state(marketplace, histories, queue_size)
+    return num_calls / elapsed, violations
+
+
+def main():
+    """ Prints the throughput and the violations of every engine. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=sorted(ENGINES))
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--operations', type=int, default=500,
+                        help='number of publish/cart rounds per thread')
+    parser.add_argument('--queue-size', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--switch-interval', type=float, default=1e-5,
+                        help='thread switch interval in seconds during the run')
+    args = parser.parse_args()
+
+    failed = False
+    for engine in args.engines:
+        for seed in range(args.rounds):
+            marketplace = ENGINES[engine](args.queue_size)
+            with Marketplace.quiet_log():
+                throughput, violations = stress(marketplace, args.queue_size,
+                                                num_threads=args.threads,
+                                                num_operations=args.operations, seed=seed,
+                                                switch_interval=args.switch_interval)
+            print(f'{engine}: {throughput:.0f} calls/s, {len(violations)} violations')
+            for violation in violations[:10]:
+                print(f'  {violation}')
+            failed = failed or bool(violations)
+
+    if failed:
+        raise SystemExit(1)
+
+
+class StressTest(unittest.TestCase):
+    """ Stress Test class """
+    def test_check(self):
+        """ Test method """
+        # Two products published one after the other while the queue holds one
+        history = [('publish', 'p0-0', True, 0.0, 1.0), ('publish', 'p0-0', True, 2.0, 3.0)]
+        self.assertEqual(1, len(check([(0, history)], 1)))
+        # Check if an overlapping checkout excuses the second publish
+        history.append(('place_order', None, ['p0-0'], 1.5, 2.5))
+        self.assertEqual([], check([(0, history)], 1))
+        # Check if a unit added to two carts is reported
+        history.append(('add_to_cart', 'p0-0', True, 3.5, 4.0))
+        history.append(('add_to_cart', 'p0-0', True, 3.5, 4.0))
+        history.append(('add_to_cart', 'p0-0', True, 4.5, 5.0))
+        self.assertEqual(1, len(check([(0, history)], 1)))
+
+    def test_engines(self):
+        """ Test method """
+        with Marketplace.quiet_log():
+            for engine in ENGINES.values():
+                _, violations = stress(engine(2), 2, num_threads=16, num_operations=100)
+                self.assertEqual([], violations)
+
+
+if __name__ == '__main__':
+    main()
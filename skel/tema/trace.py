@@ -0,0 +1,481 @@
+"""
+This module records the calls made to the Marketplace and replays them.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from dataclasses import dataclass, fields, is_dataclass
+from json import dumps, loads
+from threading import Thread, Lock, Barrier, get_ident
+import argparse
+import struct
+import time
+
+from tema.binary_files import NONE, BinaryFileTest, intern
+from tema.marketplace import Marketplace
+from tema.product import Product, Coffee, Tea
+
+MAGIC = b'MKTRACE2'
+# The traces recorded before new_cart had a priority class
+MAGIC_V1 = b'MKTRACE1'
+HEADER = struct.Struct('<8sI')
+# tag, product index, payload length
+PRODUCT_RECORD = struct.Struct('<BII')
+# tag, method code, thread index, timestamp, id argument, product index, result
+CALL_RECORD = struct.Struct('<BBHdiii')
+
+PRODUCT_TAG = 0
+CALL_TAG = 1
+
+# The methods added later are appended, the codes of the older ones do not change
+METHODS = ['register_producer', 'publish', 'new_cart', 'add_to_cart', 'remove_from_cart',
+           'place_order', 'reserve', 'reserve_all', 'unregister_producer']
+METHOD_CODES = {method: code for code, method in enumerate(METHODS)}
+PRODUCT_CLASSES = {cls.__name__: cls for cls in (Product, Coffee, Tea)}
+
+
+def product_fields(product):
+    """
+    Returns the name of the class of a product and its fields. A tuple of (product, quantity)
+    pairs, the quantities of a reserve_all, is serialized as 'items'.
+    """
+    if isinstance(product, tuple):
+        return ['items', [[product_fields(item), quantity] for item, quantity in product]]
+    if is_dataclass(product):
+        return [type(product).__name__,
+                {field.name: getattr(product, field.name) for field in fields(product)}]
+    return ['str', str(product)]
+
+
+def product_from_fields(class_name, params):
+    """ Rebuilds a product from the fields returned by product_fields. """
+    if class_name == 'items':
+        return tuple((product_from_fields(*item), quantity) for item, quantity in params)
+    if class_name == 'str':
+        return params
+    return PRODUCT_CLASSES[class_name](**params)
+
+
+def encode_product(product):
+    """ Serializes a product as the name of its class and its fields. """
+    return dumps(product_fields(product)).encode()
+
+
+def decode_product(payload):
+    """ Rebuilds a product serialized by encode_product. """
+    return product_from_fields(*loads(payload.decode()))
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class TraceCall:
+    """
+    Class that represents a recorded call of the marketplace.
+    """
+    method: str
+    thread: int
+    timestamp: float
+    id_arg: int
+    product: object
+    result: int
+
+
+class TraceRecorder:
+    """
+    Class that wraps a marketplace, exposes the same methods and appends every call to a
+    compact binary trace.
+    """
+
+    def __init__(self, marketplace, path):
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the marketplace that executes the calls
+
+        :type path: String
+        :param path: the trace file
+        """
+        self.marketplace = marketplace
+        self.trace_file = open(path, 'wb')   # pylint: disable=consider-using-with
+        self.trace_file.write(HEADER.pack(MAGIC, marketplace.queue_size_per_producer))
+        self.product_ids = {}   # {product : product_index}
+        self.thread_ids = {}    # {thread ident : thread_index}
+        self.start_time = time.perf_counter()
+        self.closed = False
+        self.lock = Lock()
+
+    def record(self, method, timestamp, id_arg=NONE, product=None, result=NONE):
+        """ Appends a call to the trace. """
+        with self.lock:
+            if self.closed:
+                return
+
+            thread_index = self.thread_ids.setdefault(get_ident(), len(self.thread_ids))
+
+            # Intern the product, its definition is written only once
+            product_index = NONE
+            if product is not None:
+                product_index, new = intern(self.product_ids, product)
+                if new:
+                    payload = encode_product(product)
+                    self.trace_file.write(
+                        PRODUCT_RECORD.pack(PRODUCT_TAG, product_index, len(payload)))
+                    self.trace_file.write(payload)
+
+            self.trace_file.write(CALL_RECORD.pack(
+                CALL_TAG, METHOD_CODES[method], thread_index, timestamp,
+                id_arg, product_index, int(result)))
+
+    def now(self):
+        """ Returns the number of seconds since the recording started. """
+        return time.perf_counter() - self.start_time
+
+    def register_producer(self):
+        """ Records Marketplace.register_producer """
+        timestamp = self.now()
+        producer_id = self.marketplace.register_producer()
+        self.record('register_producer', timestamp, result=producer_id)
+        return producer_id
+
+    def publish(self, producer_id, product):
+        """ Records Marketplace.publish """
+        timestamp = self.now()
+        status = self.marketplace.publish(producer_id, product)
+        self.record('publish', timestamp, producer_id, product, bool(status))
+        return status
+
+    def new_cart(self, priority=0):
+        """ Records Marketplace.new_cart, the id argument is the priority class """
+        timestamp = self.now()
+        if priority != 0:
+            cart_id = self.marketplace.new_cart(priority=priority)
+        else:
+            cart_id = self.marketplace.new_cart()
+        self.record('new_cart', timestamp, priority, result=cart_id)
+        return cart_id
+
+    def add_to_cart(self, cart_id, product):
+        """ Records Marketplace.add_to_cart """
+        timestamp = self.now()
+        status = self.marketplace.add_to_cart(cart_id, product)
+        self.record('add_to_cart', timestamp, cart_id, product, bool(status))
+        return status
+
+    def reserve(self, cart_id, product, timeout=None):
+        """
+        Records Marketplace.reserve, at the time it returns: the product was handed over
+        then, so a serialized replay finds it in stock.
+        """
+        status = self.marketplace.reserve(cart_id, product, timeout)
+        self.record('reserve', self.now(), cart_id, product, status)
+        return status
+
+    def reserve_all(self, cart_id, quantities, wait=False, timeout=None):
+        """
+        Records Marketplace.reserve_all at the time it returns, like reserve. The product of
+        the record is the tuple of the (product, quantity) pairs.
+        """
+        status = self.marketplace.reserve_all(cart_id, quantities, wait, timeout)
+        self.record('reserve_all', self.now(), cart_id, tuple(quantities.items()), status)
+        return status
+
+    def remove_from_cart(self, cart_id, product):
+        """ Records Marketplace.remove_from_cart """
+        timestamp = self.now()
+        self.marketplace.remove_from_cart(cart_id, product)
+        self.record('remove_from_cart', timestamp, cart_id, product)
+
+    def place_order(self, cart_id):
+        """ Records Marketplace.place_order, the result is the number of products bought """
+        timestamp = self.now()
+        cart_list = self.marketplace.place_order(cart_id)
+        self.record('place_order', timestamp, cart_id, result=len(cart_list))
+        return cart_list
+
+    def unregister_producer(self, producer_id):
+        """
+        Records Marketplace.unregister_producer, the result is the number of products returned
+        """
+        timestamp = self.now()
+        unsold = self.marketplace.unregister_producer(producer_id)
+        self.record('unregister_producer', timestamp, producer_id, result=len(unsold))
+        return unsold
+
+    def close(self):
+        """ Flushes the trace, the calls made afterwards are not recorded. """
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.trace_file.close()
+
+
+class TraceReplayer:
+    """
+    Class that loads a trace and re-executes it against a marketplace at maximum speed.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor
+
+        :type path: String
+        :param path: the trace file
+        """
+        self.calls = []
+        with open(path, 'rb') as trace_file:
+            data = trace_file.read()
+
+        magic, self.queue_size_per_producer = HEADER.unpack_from(data)
+        if magic not in (MAGIC, MAGIC_V1):
+            raise ValueError(f'{path} is not a marketplace trace')
+
+        products = {}
+        offset = HEADER.size
+        while offset < len(data):
+            if data[offset] == PRODUCT_TAG:
+                _, product_index, length = PRODUCT_RECORD.unpack_from(data, offset)
+                offset += PRODUCT_RECORD.size
+                products[product_index] = decode_product(data[offset:offset + length])
+                offset += length
+            else:
+                _, code, thread, timestamp, id_arg, product_index, result = \
+                    CALL_RECORD.unpack_from(data, offset)
+                offset += CALL_RECORD.size
+                if magic == MAGIC_V1 and METHODS[code] == 'new_cart':
+                    id_arg = 0
+                self.calls.append(TraceCall(METHODS[code], thread, timestamp, id_arg,
+                                            products.get(product_index), result))
+
+        # The records are written at completion, replay them in the order they were issued
+        self.calls.sort(key=lambda call: call.timestamp)
+
+    def new_marketplace(self):
+        """ Returns an empty marketplace configured like the recorded one. """
+        backorders = any(call.method == 'reserve' for call in self.calls)
+        return Marketplace(self.queue_size_per_producer, backorders=backorders)
+
+    def replay(self, marketplace, concurrent=False):
+        """
+        Re-executes the trace without any waiting.
+
+        :type marketplace: Marketplace
+        :param marketplace: the marketplace that executes the calls
+
+        :type concurrent: Bool
+        :param concurrent: False to execute the calls one by one, True to use one thread per
+        recorded thread, each one executing its calls in the recorded order
+
+        :returns a tuple (elapsed seconds, number of calls whose result differs from the trace)
+        """
+        # The ids given by the new marketplace may differ from the recorded ones
+        ids = {'producer': {}, 'cart': {}}
+        mismatches = [0]
+        lock = Lock()
+
+        def execute(calls):
+            count = 0
+            for call in calls:
+                if not self.execute_call(marketplace, call, ids):
+                    count += 1
+            with lock:
+                mismatches[0] += count
+
+        start = time.perf_counter()
+        if not concurrent:
+            execute(self.calls)
+        else:
+            threads_calls = {}
+            for call in self.calls:
+                threads_calls.setdefault(call.thread, []).append(call)
+
+            barrier = Barrier(len(threads_calls))
+
+            def run(calls):
+                barrier.wait()
+                execute(calls)
+
+            threads = [Thread(target=run, args=(calls,)) for calls in threads_calls.values()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return time.perf_counter() - start, mismatches[0]
+
+    @staticmethod
+    def execute_call(marketplace, call, ids):
+        """
+        Executes one call and checks if the result is the recorded one. A reserve does not
+        wait for its product, like the rest of the replay.
+        """
+        producers = ids['producer']
+        carts = ids['cart']
+
+        if call.method == 'register_producer':
+            producers[call.result] = marketplace.register_producer()
+            return True
+        if call.method == 'new_cart':
+            if call.id_arg != 0:
+                carts[call.result] = marketplace.new_cart(priority=call.id_arg)
+            else:
+                carts[call.result] = marketplace.new_cart()
+            return True
+        if call.method == 'unregister_producer':
+            unsold = marketplace.unregister_producer(producers.get(call.id_arg, call.id_arg))
+            return len(unsold) == call.result
+        if call.method == 'remove_from_cart':
+            marketplace.remove_from_cart(carts.get(call.id_arg, call.id_arg), call.product)
+            return True
+        if call.method in ('publish', 'add_to_cart', 'reserve', 'reserve_all'):
+            id_map = producers if call.method == 'publish' else carts
+            args = (id_map.get(call.id_arg, call.id_arg), call.product)
+            if call.method == 'reserve':
+                args += (0,)
+            elif call.method == 'reserve_all':
+                args = (args[0], dict(call.product))
+            status = getattr(marketplace, call.method)(*args)
+            return bool(status) == bool(call.result)
+
+        cart_list = marketplace.place_order(carts.get(call.id_arg, call.id_arg))
+        return len(cart_list) == call.result
+
+
+def main():
+    """ Replays a trace and prints the elapsed time. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', type=str, help='trace file recorded by test.py')
+    parser.add_argument('--concurrent', action='store_true',
+                        help='replay with one thread per recorded thread')
+    parser.add_argument('--repeat', type=int, default=1, help='number of replays')
+    args = parser.parse_args()
+
+    with Marketplace.quiet_log():
+        replayer = TraceReplayer(args.trace)
+        for _ in range(args.repeat):
+            elapsed, mismatches = replayer.replay(replayer.new_marketplace(), args.concurrent)
+            print(f'{len(replayer.calls)} calls in {elapsed:.4f}s '
+                  f'({len(replayer.calls) / elapsed:.0f} calls/s), {mismatches} mismatches')
+
+
+class TraceTest(BinaryFileTest):
+    """ Trace Test class """
+    def setUp(self):
+        """ Sets up initial fields. """
+        super().setUp()
+        self.recorder = TraceRecorder(Marketplace(2), self.path)
+
+    def tearDown(self):
+        """ Removes the trace file. """
+        self.recorder.close()
+        super().tearDown()
+
+    def record_workload(self):
+        """ Executes a small workload through the recorder. """
+        producer_id = self.recorder.register_producer()
+        cart = self.recorder.new_cart(priority=1)
+        self.recorder.publish(producer_id, Tea('Linden', 9, 'Herbal'))
+        self.recorder.publish(producer_id, 'Cocoa')
+        self.recorder.publish(producer_id, 'Cocoa')
+        self.recorder.add_to_cart(cart, 'Cocoa')
+        self.recorder.add_to_cart(cart, Tea('Linden', 9, 'Herbal'))
+        self.recorder.remove_from_cart(cart, 'Cocoa')
+        self.recorder.place_order(cart)
+        self.recorder.close()
+
+    def test_load(self):
+        """ Test method """
+        self.record_workload()
+        replayer = TraceReplayer(self.path)
+
+        # Check if the calls and the products are decoded
+        self.assertEqual(2, replayer.queue_size_per_producer)
+        self.assertEqual(['register_producer', 'new_cart', 'publish', 'publish', 'publish',
+                          'add_to_cart', 'add_to_cart', 'remove_from_cart', 'place_order'],
+                         [call.method for call in replayer.calls])
+        self.assertEqual(Tea('Linden', 9, 'Herbal'), replayer.calls[2].product)
+        # Check if the priority class of the cart is recorded
+        self.assertEqual(1, replayer.calls[1].id_arg)
+        # Check if the rejected publish is recorded
+        self.assertEqual(0, replayer.calls[4].result)
+
+    def test_replay(self):
+        """ Test method """
+        self.record_workload()
+        replayer = TraceReplayer(self.path)
+
+        # Check if both modes reproduce the recorded results
+        for concurrent in (False, True):
+            marketplace = replayer.new_marketplace()
+            _, mismatches = replayer.replay(marketplace, concurrent)
+            self.assertEqual(0, mismatches)
+            self.assertEqual([1], marketplace.products_per_producer)
+
+    def test_reserve(self):
+        """ Test method """
+        self.recorder.close()
+        self.recorder = TraceRecorder(Marketplace(2, backorders=True), self.path)
+        producer_id = self.recorder.register_producer()
+        cart = self.recorder.new_cart()
+        waiter = Thread(target=self.recorder.reserve, args=(cart, 'Cocoa'))
+        waiter.start()
+        while not self.recorder.marketplace.backorder_queues:
+            time.sleep(0.001)
+        self.recorder.publish(producer_id, 'Cocoa')
+        waiter.join()
+        self.recorder.place_order(cart)
+        self.recorder.close()
+        replayer = TraceReplayer(self.path)
+
+        # Check if the reservation is recorded once the product was handed over
+        self.assertEqual(['register_producer', 'new_cart', 'publish', 'reserve', 'place_order'],
+                         [call.method for call in replayer.calls])
+        marketplace = replayer.new_marketplace()
+        self.assertTrue(marketplace.backorders)
+        self.assertEqual(0, replayer.replay(marketplace)[1])
+
+    def test_reserve_all(self):
+        """ Test method """
+        producer_id = self.recorder.register_producer()
+        cart = self.recorder.new_cart()
+        self.recorder.publish(producer_id, 'Cocoa')
+        quantities = {'Cocoa': 1, Tea('Linden', 9, 'Herbal'): 1}
+        self.recorder.reserve_all(cart, quantities)
+        self.recorder.publish(producer_id, Tea('Linden', 9, 'Herbal'))
+        self.recorder.reserve_all(cart, quantities)
+        self.recorder.place_order(cart)
+        self.recorder.close()
+        replayer = TraceReplayer(self.path)
+
+        # Check if the quantities of the reservations are recorded with their results
+        self.assertEqual(tuple(quantities.items()), replayer.calls[3].product)
+        self.assertEqual([0, 1], [call.result for call in replayer.calls
+                                  if call.method == 'reserve_all'])
+        self.assertEqual(0, replayer.replay(replayer.new_marketplace())[1])
+
+    def test_unregister_producer(self):
+        """ Test method """
+        producer_id = self.recorder.register_producer()
+        cart = self.recorder.new_cart()
+        self.recorder.publish(producer_id, 'Cocoa')
+        self.recorder.publish(producer_id, 'Mint')
+        self.recorder.add_to_cart(cart, 'Cocoa')
+        self.assertEqual(['Mint'], self.recorder.unregister_producer(producer_id))
+        self.recorder.place_order(cart)
+        # The id is free again once the producer's last product is sold
+        self.assertEqual(producer_id, self.recorder.register_producer())
+        self.recorder.close()
+        replayer = TraceReplayer(self.path)
+
+        # Check if the unregistration is recorded with the number of products returned
+        call = replayer.calls[5]
+        self.assertEqual(('unregister_producer', producer_id, 1),
+                         (call.method, call.id_arg, call.result))
+        marketplace = replayer.new_marketplace()
+        self.assertEqual(0, replayer.replay(marketplace)[1])
+        self.assertEqual([0], marketplace.products_per_producer)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,142 @@ Assignment 1
 March 2020
 """
 
+import argparse
+import os
 import sys
+import tempfile
+import threading
 from json import loads
 
 from tema.producer import Producer
-from tema.consumer import Consumer
+from tema.producer_engine import ProducerEngine
+from tema.consumer import Consumer, percentile
 from tema.marketplace import Marketplace
 from tema.product import Product, Coffee, Tea
+from tema.trace import TraceRecorder
+from tema.service import MarketplaceServer, MarketplaceClient
+from tema.binlog import BinaryLog
+from tema.profiler import SamplingProfiler
+from tema.shared_inventory import SharedInventory
+from tema.admission import AdmissionControl
+from tema.adaptive import ADAPT_INTERVAL
+
+
+def parse_args():
+    """
+        Parses the test file and the options of the run
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', nargs='?', help='test input file')
+    parser.add_argument('--producer-engine', action='store_true',
+                        help='drive all the producers from one thread')
+    parser.add_argument('--compile-carts', action='store_true',
+                        help='consumers add only the net quantity of each product')
+    parser.add_argument('--atomic-carts', action='store_true',
+                        help='consumers reserve the net quantities of a cart all at once')
+    parser.add_argument('--adaptive-queues', action='store_true',
+                        help='size the producers\' queues by their sell-through rate')
+    parser.add_argument('--backorders', action='store_true',
+                        help='consumers wait in FIFO backorder queues instead of retrying, '
+                             'the consumers\' priority classes only take effect with it')
+    parser.add_argument('--wait-metrics', action='store_true',
+                        help='print the wait time percentiles of every consumer to stderr')
+    parser.add_argument('--service', action='store_true',
+                        help='serve the marketplace on a Unix socket, the producers and '
+                             'consumers use it through a client')
+    parser.add_argument('--binary-log', metavar='PATH',
+                        help='write the marketplace log in binary instead of text')
+    parser.add_argument('--record-trace', metavar='PATH',
+                        help='record every marketplace call to a binary trace')
+    parser.add_argument('--shared-inventory', metavar='PATH',
+                        help='mirror the stock counts into a memory-mapped file')
+    parser.add_argument('--admission-control', action='store_true',
+                        help='refused calls carry a retry-after hint that the producers and '
+                             'consumers wait instead of their fixed times')
+    parser.add_argument('--max-in-flight', type=int, metavar='N',
+                        help='with --admission-control, shed the calls beyond N at the same time')
+    parser.add_argument('--profile', metavar='PREFIX',
+                        help='sample the stacks of all the threads, write PREFIX.collapsed '
+                             '(flamegraph input) and PREFIX.txt (per function summary)')
+    args = parser.parse_args()
+
+    if args.filename is None:
+        print("no input file specified")
+        raise SystemExit
+
+    return args
+
+
+def print_wait_metrics(consumers):
+    """
+        Print the wait time percentiles of every consumer and of every priority class
+    """
+    classes = {}
+    for consumer in consumers:
+        classes.setdefault(consumer.priority, []).extend(consumer.wait_times)
+        print(f'{consumer.name} waited p50 {percentile(consumer.wait_times, 0.5):.4f}s '
+              f'p99 {percentile(consumer.wait_times, 0.99):.4f}s '
+              f'max {max(consumer.wait_times, default=0.0):.4f}s', file=sys.stderr)
+
+    for priority, wait_times in sorted(classes.items(), reverse=True):
+        print(f'priority {priority} waited p50 {percentile(wait_times, 0.5):.4f}s '
+              f'p99 {percentile(wait_times, 0.99):.4f}s '
+              f'max {max(wait_times, default=0.0):.4f}s', file=sys.stderr)
+
+
+def build_marketplace(args, market_config):
+    """
+        Build the marketplace configured by the input file and the options of the run
+
+        :returns the marketplace the producers and consumers use and the list of the
+        outputs to close once the consumers are done
+    """
+    config = market_config['marketplace']
+    outputs = []
+
+    if args.adaptive_queues:
+        config['adapt_interval'] = ADAPT_INTERVAL
+    if args.backorders:
+        config['backorders'] = True
+    if args.binary_log is not None:
+        config['binary_log'] = BinaryLog(args.binary_log)
+        outputs.append(config['binary_log'])
+    if args.admission_control:
+        config['admission'] = AdmissionControl(args.max_in_flight)
+    if args.shared_inventory is not None:
+        config['shared_inventory'] = SharedInventory(args.shared_inventory)
+    marketplace = Marketplace(**config)
+
+    if args.record_trace is not None:
+        marketplace = TraceRecorder(marketplace, args.record_trace)
+        outputs.append(marketplace)
+    if args.service:
+        # the producers keep publishing until exit, so the server is never shut down
+        server = MarketplaceServer(marketplace,
+                                   os.path.join(tempfile.mkdtemp(), 'marketplace.sock'))
+        server.start()
+        marketplace = MarketplaceClient(server.address, pool_size=len(market_config['producers'])
+                                        + len(market_config['consumers']))
+
+    return marketplace, outputs
+
+
+def start_producers(args, market_config, marketplace):
+    """
+        Build and start the producers, in their own threads or in one producer engine
+    """
+    if args.producer_engine:
+        producer_engine = ProducerEngine(marketplace, daemon=True)
+        for p_market_config in market_config['producers']:
+            producer_engine.add_producer(p_market_config['products'],
+                                         p_market_config['republish_wait_time'])
+        producer_engine.start()
+    else:
+        producers = [Producer(**p_market_config, marketplace=marketplace, daemon=True)
+                     for p_market_config in market_config['producers']]
+
+        for producer in producers:
+            producer.start()
 
 
 def main():
@@ -20,13 +149,18 @@ def main():
         Convert the market_configuration input file into specific models:
         Producer, Consumer, Marketplace
     """
-    try:
-        filename = sys.argv[1]
-    except IndexError:
-        print("no input file specified")
-        raise SystemExit
+    args = parse_args()
 
-    with open(filename) as input_file:
+    # a producer or consumer that dies leaves a wrong output, fail the run
+    failed_threads = []
+
+    def excepthook(hook_args):
+        failed_threads.append(hook_args.thread.name)
+        threading.__excepthook__(hook_args)
+
+    threading.excepthook = excepthook
+
+    with open(args.filename) as input_file:
         market_config = loads(input_file.read())
 
     # turn product definitions into actual products
@@ -49,18 +183,18 @@ def main():
             for operation in cart:
                 operation['product'] = products[operation['product']]
 
-    # build the marketplace
-    marketplace = Marketplace(**market_config['marketplace'])
+    if args.profile is not None:
+        profiler = SamplingProfiler()
+        profiler.start()
 
-    # build and start the producers
-    producers = [Producer(**p_market_config, marketplace=marketplace, daemon=True)
-                 for p_market_config in market_config['producers']]
+    marketplace, outputs = build_marketplace(args, market_config)
 
-    for producer in producers:
-        producer.start()
+    start_producers(args, market_config, marketplace)
 
     # build and start the consumers
-    consumers = [Consumer(**c_market_config, marketplace=marketplace)
+    consumers = [Consumer(**c_market_config, marketplace=marketplace,
+                          compile_carts=args.compile_carts, backorders=args.backorders,
+                          atomic_carts=args.atomic_carts)
                  for c_market_config in market_config['consumers']]
 
     for consumer in consumers:
@@ -69,6 +203,21 @@ def main():
     for consumer in consumers:
         consumer.join()
 
+    if args.profile is not None:
+        profiler.stop()
+        profiler.write(args.profile)
+
+    if args.wait_metrics:
+        print_wait_metrics(consumers)
+
+    # the trace before the binary log, in the reverse order of their creation
+    for output in reversed(outputs):
+        output.close()
+
+    if failed_threads:
+        print(f'threads failed: {", ".join(failed_threads)}', file=sys.stderr)
+        raise SystemExit(1)
+
 
 if __name__ == '__main__':
     main()